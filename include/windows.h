@@ -94,9 +94,23 @@ typedef struct _WIN32_FIND_DATAW {
 
 typedef WIN32_FIND_DATAW WIN32_FIND_DATA;
 
+// minwinbase.h
+
+// FINDEX_INFO_LEVELS
+#define FindExInfoStandard 0
+#define FindExInfoBasic 1
+
+// FINDEX_SEARCH_OPS
+#define FindExSearchNameMatch 0
+
+#define FIND_FIRST_EX_CASE_SENSITIVE 0x00000001
+#define FIND_FIRST_EX_LARGE_FETCH 0x00000002
+
 // fileapi.h
 
 HANDLE FindFirstFileW(WCHAR* lpFileName,LPWIN32_FIND_DATAW lpFindFileData);
+// fInfoLevelId is a FINDEX_INFO_LEVELS and fSearchOp a FINDEX_SEARCH_OPS enum
+HANDLE FindFirstFileExW(WCHAR* lpFileName,int fInfoLevelId,LPWIN32_FIND_DATAW lpFindFileData,int fSearchOp,void* lpSearchFilter,DWORD dwAdditionalFlags);
 BOOL FindNextFileW(HANDLE hFindFile,LPWIN32_FIND_DATAW lpFindFileData);
 BOOL FindClose(HANDLE hFindFile);
 
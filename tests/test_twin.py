@@ -0,0 +1,123 @@
+#!/usr/bin/env python2
+"""
+Tests for twin.py, run with
+
+    python -m pytest tests
+
+Requires the same packages as twin.py (PyQt5, PIL), skipped otherwise.
+"""
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("PIL")
+pytest.importorskip("PyQt5")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import twin
+
+
+class FakeSelectionRange(object):
+    def __init__(self, top, bottom):
+        self._top = top
+        self._bottom = bottom
+
+    def top(self):
+        return self._top
+
+    def bottom(self):
+        return self._bottom
+
+
+class FakeSelectionModel(object):
+    def __init__(self, selection_ranges):
+        self.selection_ranges = selection_ranges
+
+    def selection(self):
+        return self.selection_ranges
+
+
+class FakeView(object):
+    def __init__(self, selection_ranges):
+        self.selection_model = FakeSelectionModel(selection_ranges)
+
+    def selectionModel(self):
+        return self.selection_model
+
+
+class FakeModel(object):
+    def __init__(self, file_infos):
+        self.file_infos = file_infos
+
+    def rowCount(self, parent=None):
+        return len(self.file_infos)
+
+    def canFetchMore(self, parent):
+        return False
+
+
+class FakeLabel(object):
+    def __init__(self):
+        self.text = None
+
+    def setText(self, text):
+        self.text = text
+
+
+class FakeFilePane(object):
+    """
+    Just the attributes and methods FilePane.updateSummary uses
+    """
+    def __init__(self, file_infos, selection_ranges):
+        self.file_dir = "dir"
+        self.disk_info_dir = "dir"
+        self.model = FakeModel(file_infos)
+        self.view = FakeView(selection_ranges)
+        self.summary_label = FakeLabel()
+
+    def getActiveView(self):
+        return self.view
+
+    def refreshDiskInfo(self):
+        pass
+
+    def updateDirectoryLabel(self):
+        pass
+
+
+def make_file_infos():
+    return [
+        twin.FileInfo("dir", 0, 0, twin.FILEINFO_ATTR_DIR),
+        twin.FileInfo("a.txt", 2 * 2**10, 0, 0),
+        twin.FileInfo("b.txt", 4 * 2**10, 0, 0),
+        twin.FileInfo("c.txt", 8 * 2**10, 0, 0),
+    ]
+
+
+def test_xrange_override():
+    assert list(twin.xrange(3)) == [0, 1, 2]
+    assert list(twin.xrange([1, 2, 3])) == [0, 1, 2]
+    assert list(twin.xrange(2, 4)) == [2, 3]
+    assert list(twin.xrange(1, [1, 2, 3])) == [1, 2]
+    assert list(twin.xrange(3, -1, -1)) == [3, 2, 1, 0]
+
+
+def test_update_summary_no_selection():
+    pane = FakeFilePane(make_file_infos(), [])
+    twin.FilePane.updateSummary.__func__(pane)
+
+    assert pane.summary_label.text == "0 k / 14 k in 0 / 3 files, 0 / 1 dirs"
+
+
+def test_update_summary_selection():
+    # Overlapping ranges (eg column by column selection) and ranges past the
+    # row count are counted once
+    pane = FakeFilePane(make_file_infos(), [
+        FakeSelectionRange(0, 1),
+        FakeSelectionRange(1, 2),
+        FakeSelectionRange(3, 10),
+    ])
+    twin.FilePane.updateSummary.__func__(pane)
+
+    assert pane.summary_label.text == "14 k / 14 k in 3 / 3 files, 1 / 1 dirs"
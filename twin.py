@@ -143,8 +143,11 @@ import ctypes
 import datetime
 import errno
 import fnmatch
+import hashlib
+import itertools
 import json
 import logging
+import operator
 import os
 import platform
 import Queue
@@ -155,6 +158,7 @@ import string
 import StringIO
 import struct
 import sys
+import threading
 import time
 import zipfile
 
@@ -166,7 +170,14 @@ import zipfile
 # See https://marc.info/?l=python-list&m=144408313516472&w=2
 import _strptime
 
-from PIL import Image, ImageQt, ExifTags
+from PIL import Image
+
+try:
+    # libjpeg-turbo bindings, optional, decodes and downscales jpegs faster than
+    # PIL, see https://github.com/lilohuang/PyTurboJPEG
+    import turbojpeg
+except ImportError:
+    turbojpeg = None
 
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
@@ -201,6 +212,18 @@ def fileinfo_is_link(fileinfo):
 def fileinfo_is_dir(fileinfo):
     return ((fileinfo.attr & FILEINFO_ATTR_DIR) != 0)
 
+def fileinfo_totals(fileinfos):
+    """
+    Return (total size, number of files, number of directories) of the given
+    fileinfos
+    """
+    # Use builtins that loop in C instead of a Python loop, this is called on
+    # every selection change and directories can have lots of entries
+    total_size = sum(map(operator.attrgetter("size"), fileinfos))
+    total_dirs = len(filter(FILEINFO_ATTR_DIR.__and__, map(operator.attrgetter("attr"), fileinfos)))
+
+    return total_size, len(fileinfos) - total_dirs, total_dirs
+
 def fileinfo_is_packed(fileinfo):
     """
     Return if this is an archive (packed file format). Note this is a heuristic
@@ -224,6 +247,27 @@ def fileinfo_build_attr(is_dir, is_hidden, is_writable, is_link):
         0
     )
 
+def fileinfos_combine(dir_infos, file_infos):
+    """
+    Return a new list with the dir_infos iterable followed by the file_infos
+    list.
+    
+    This is used by the FileInfoIterators to return directories first, extend
+    in place instead of list concatenation to prevent allocating and copying
+    intermediate lists on large batches
+    """
+    combined_infos = list(dir_infos)
+    combined_infos.extend(file_infos)
+    return combined_infos
+
+def temp_extract_dirpath(arcpath):
+    """
+    Return the absolute temporary directory files inside the archive arcpath
+    are extracted to, a semi-unique subdirectory of TEMP_DIR
+    """
+    temp_subdir = "%x" % (hash(arcpath) + (sys.maxint - 1))
+    return TEMP_DIR_ABS + os.sep + temp_subdir
+
 def fileinfo_cmp(a, b, field=0, reverse=False):
     """
     Compare FileInfos by the given field, name by default: ".." first, then
@@ -272,15 +316,50 @@ def fileinfo_cmp(a, b, field=0, reverse=False):
 
 def sort_fileinfos(file_infos, sort_field, sort_order):
     """
-    Sort in place
+    Sort in place, return the permutation applied as the list of the row
+    before sorting of each row after sorting
     """
     logger.info("Sorting %d file_infos sort_field %d sort_order %d", len(file_infos), sort_field, sort_order)
-    file_infos.sort(
-        cmp=lambda a, b: fileinfo_cmp(a, b, sort_field, sort_order == Qt.DescendingOrder),
-    )
+    # This produces the same order as sorting with fileinfo_cmp, but sorting
+    # with keys is much faster than with a cmp function since the keys are
+    # calculated once per entry and compared natively, vs. calling into a
+    # Python function on every comparison:
+    # - ".." first, then directories sorted by name, never reversed
+    # - files sorted by the field then by name, reversed as requested
+    # Rows are sorted instead of the fileinfos so the caller gets the
+    # permutation for free, and the sort keys are precomputed into per field
+    # lists indexed by row, so the name key is a C-level list lookup
+    dotdot_rows = []
+    dir_rows = []
+    other_rows = []
+    for row, file_info in enumerate(file_infos):
+        if (file_info.filename == ".."):
+            dotdot_rows.append(row)
+        elif (fileinfo_is_dir(file_info)):
+            dir_rows.append(row)
+        else:
+            other_rows.append(row)
+
+    names = [file_info.filename.lower() for file_info in file_infos]
+    dir_rows.sort(key=names.__getitem__)
+    if (sort_field == 0):
+        key = names.__getitem__
+    else:
+        # Build the tuple keys with zip at C speed, so there's no Python
+        # key function call at all
+        keys = zip([file_info[sort_field] for file_info in file_infos], names)
+        key = keys.__getitem__
+    other_rows.sort(key=key, reverse=(sort_order == Qt.DescendingOrder))
+
+    old_rows = dotdot_rows
+    old_rows.extend(dir_rows)
+    old_rows.extend(other_rows)
+    file_infos[:] = map(file_infos.__getitem__, old_rows)
 
     logger.info("Sorted")
 
+    return old_rows
+
 
 def class_name(o):
     return o.__class__.__name__
@@ -462,6 +541,74 @@ def os_makedirs(dirpath):
         if (e.errno != errno.EEXIST):
             raise
 
+def os_read(filepath):
+    """
+    Read the whole file, hinting the OS that the access is sequential so it
+    reads ahead aggressively (FILE_FLAG_SEQUENTIAL_SCAN on Windows). This also
+    reads into a buffer of the file size instead of growing one
+    """
+    fd = os.open(filepath, os.O_RDONLY | getattr(os, "O_BINARY", 0) | getattr(os, "O_SEQUENTIAL", 0))
+    try:
+        size = os.fstat(fd).st_size
+        data = os.read(fd, size)
+        # Reads can be short on network drives, keep reading until EOF
+        if (len(data) < size):
+            chunks = [data]
+            while (True):
+                chunk = os.read(fd, max(size - len(data), 2**16))
+                if (len(chunk) == 0):
+                    break
+                chunks.append(chunk)
+            data = "".join(chunks)
+    finally:
+        os.close(fd)
+
+    return data
+
+def os_get_disk_free_space(dirpath):
+    """
+    Return (drive, free_bytes, total_bytes) of the drive or network share of
+    dirpath, free_bytes and total_bytes are zero on error or if unknown.
+
+    This can block for a long time on network drives
+    """
+    total_bytes = 0
+    free_bytes = 0
+    # Ignore for SHARE_ROOT, it's possible it confuses XP and takes a
+    # long time to return
+    # XXX Not clear, verify
+    if (os_path_contains(SHARE_ROOT, dirpath)):
+        drive = SHARE_ROOT
+    else:
+        drive = os.path.splitdrive(dirpath)[0]
+        unc = os.path.splitunc(dirpath)[0]
+        drive = unc if (drive == "") else (drive + "\\")
+        # XXX There's no QStorageInfo until 5.4 and and no shutil.disk_usage in
+        #     python 2.7
+        try:
+            GetDiskFreeSpaceExW = ctypes.windll.kernel32.GetDiskFreeSpaceExW
+
+            root_path = ctypes.c_wchar_p(drive)
+            free_bytes_available = ctypes.c_ulonglong(0)
+            total_number_of_bytes = ctypes.c_ulonglong(0)
+            total_number_of_free_bytes = ctypes.c_ulonglong(0)
+
+            # Call GetDiskFreeSpaceExW to get the disk space details
+            logger.info("Calling GetDiskFreeSpaceExW")
+            result = GetDiskFreeSpaceExW(
+                root_path, 
+                ctypes.byref(free_bytes_available),
+                ctypes.byref(total_number_of_bytes),
+                ctypes.byref(total_number_of_free_bytes)
+            )
+            logger.info("Called GetDiskFreeSpaceExW")
+            total_bytes = total_number_of_bytes.value
+            free_bytes = free_bytes_available.value
+        except Exception as e:
+            logger.error("Error %s", e)
+
+    return drive, free_bytes, total_bytes
+
 def os_copy(filepath, target_dir):
     """
     Copy filepath (file or directory) inside target_dir
@@ -490,6 +637,10 @@ def xrange(list_or_int_start_stop, list_or_int_stop=None, step=None):
     if (list_or_int_stop is None):
         return __builtin__.xrange(len_or_int(list_or_int_start_stop))
 
+    elif (step is None):
+        # __builtin__.xrange doesn't accept None as step
+        return __builtin__.xrange(len_or_int(list_or_int_start_stop), len_or_int(list_or_int_stop))
+
     else:
         return __builtin__.xrange(len_or_int(list_or_int_start_stop), len_or_int(list_or_int_stop), step)
 
@@ -1404,6 +1555,110 @@ def win32_filetime_to_timestamp(filetime):
     
     return timestamp
 
+# Cache of mtime to display string, the same mtimes get formatted on every
+# repaint. Cleared when it grows over the limit, which is simpler than an LRU
+# and good enough since the visible rows are reinserted right away
+MTIME_STRING_CACHE_MAX_ENTRIES = 2**14
+g_mtime_strings = {}
+def mtime_to_string(mtime):
+    """
+    Return the local time "%Y-%m-%d %H:%M:%S" string for the given UTC epoch
+    in seconds
+    """
+    s = g_mtime_strings.get(mtime, None)
+    if (s is None):
+        # Formatting the localtime tuple is faster than creating a datetime
+        # and calling strftime
+        # XXX Get this from locale
+        s = "%04d-%02d-%02d %02d:%02d:%02d" % time.localtime(mtime)[:6]
+        if (len(g_mtime_strings) >= MTIME_STRING_CACHE_MAX_ENTRIES):
+            g_mtime_strings.clear()
+        g_mtime_strings[mtime] = s
+
+    return s
+
+# Cache of size to display string, see mtime_to_string
+SIZE_STRING_CACHE_MAX_ENTRIES = 2**16
+g_size_strings = {}
+g_locale = None
+def size_to_string(size):
+    """
+    Return the size formatted with the default locale's group separators
+
+    Also used for the summary counts so they share the same QLocale instead of
+    constructing one per call
+    """
+    global g_locale
+    s = g_size_strings.get(size, None)
+    if (s is None):
+        # Constructing a QLocale is not free, create it on first use so the
+        # default locale is already set by then
+        if (g_locale is None):
+            g_locale = QLocale()
+        s = g_locale.toString(size)
+        if (len(g_size_strings) >= SIZE_STRING_CACHE_MAX_ENTRIES):
+            g_size_strings.clear()
+        g_size_strings[size] = s
+
+    return s
+
+# Cache of (filename, attr) to file image keys, see mtime_to_string
+FILE_IMAGE_KEYS_CACHE_MAX_ENTRIES = 2**16
+g_file_image_keys = {}
+def file_image_keys(fileinfo):
+    """
+    Return the (key, icon_key, is_pinned, is_image) image keys for the given
+    non-directory fileinfo:
+    - key, icon_key are the keys of the pixmap and icon for the file, pinned
+      image keys for links, hidden, system and packed files, otherwise image
+      cache keys for the extension eg ":.txt" and ":.txt_icon"
+    - is_pinned is True if the keys are pinned image keys
+    - is_image is True if the file has an image extension and can have a
+      thumbnail
+    """
+    cache_key = (fileinfo.filename, fileinfo.attr)
+    keys = g_file_image_keys.get(cache_key, None)
+    if (keys is None):
+        is_pinned = True
+        if (fileinfo_is_link(fileinfo)):
+            key = ":file_link"
+        elif (fileinfo_is_hidden(fileinfo)):
+            key = ":file_hidden"
+        elif (not fileinfo_is_writable(fileinfo)):
+            key = ":file_system"
+        elif (fileinfo_is_packed(fileinfo)):
+            key = ":file_packed"
+        else:
+            is_pinned = False
+            key = ":%s" % os.path.splitext(fileinfo.filename)[1]
+        is_image = fileinfo.filename.lower().endswith(IMAGE_EXTENSIONS)
+        keys = (key, key + "_icon", is_pinned, is_image)
+        if (len(g_file_image_keys) >= FILE_IMAGE_KEYS_CACHE_MAX_ENTRIES):
+            g_file_image_keys.clear()
+        g_file_image_keys[cache_key] = keys
+
+    return keys
+
+# Cache of (filepath, size, mtime) to zipfile.is_zipfile result, see
+# mtime_to_string
+IS_ZIPFILE_CACHE_MAX_ENTRIES = 2**12
+g_is_zipfile = {}
+def is_zipfile_cached(filepath, size, mtime):
+    """
+    Return zipfile.is_zipfile(filepath), memoized on the file's size and mtime
+    so the file is only opened and read once per modification (this is
+    expensive on network drives)
+    """
+    cache_key = (filepath, size, mtime)
+    is_zip = g_is_zipfile.get(cache_key, None)
+    if (is_zip is None):
+        is_zip = zipfile.is_zipfile(filepath)
+        if (len(g_is_zipfile) >= IS_ZIPFILE_CACHE_MAX_ENTRIES):
+            g_is_zipfile.clear()
+        g_is_zipfile[cache_key] = is_zip
+
+    return is_zip
+
 # XXX Move to the include file, but how to express this? (.h files only support
 #     #define constants, and -1 cannot be used because it note this cannot be
 #     expressed via aneeds to be a positive number since comparing against -1
@@ -1857,10 +2112,24 @@ INCLUDE_DIR = "include"
 OUT_DIR = "_out"
 # XXX Get this from config file
 TEMP_DIR = os.path.join(OUT_DIR, "temp")
+# Absolute version of the above, precomputed so extracting files doesn't need
+# to call abspath (and getcwd) every time
+TEMP_DIR_ABS = os.path.abspath(TEMP_DIR)
+# Directory for the decoded thumbnails, see thumbnail_cache_filepath
+THUMBNAIL_CACHE_DIR_ABS = os.path.abspath(os.path.join(OUT_DIR, "thumbnails"))
+# Bytes of thumbnails to keep on disk, when exceeded the least recently used
+# thumbnails are removed until under the watermark, see thumbnail_cache_prune
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 2**20
+THUMBNAIL_CACHE_MAX_BYTES_WATERMARK = (THUMBNAIL_CACHE_MAX_BYTES * 3) / 4
 
 # XXX This needs to use the imagereader/PIL supported extensions
 IMAGE_EXTENSIONS = ('.bmp','.enc','.gif', '.jpg', '.jpeg', '.jfif', '.png', '.webp')
 FILTERED_EXTENSIONS = []
+# QDir name filters matching the above, precomputed so they are not rebuilt on
+# every directory listing
+# XXX Note this uses IMAGE_EXTENSIONS as the filter since FILTERED_EXTENSIONS is
+#     only used as a flag
+QDIR_NAME_FILTERS = [("*%s" % ext) for ext in IMAGE_EXTENSIONS] if (len(FILTERED_EXTENSIONS) > 0) else ["*"]
 # See https://www.7-zip.org/
 # Note remove ".bz2" so it uses ghisler bzip2dll for testing
 # Note remove ".zip" so it uses native support
@@ -1898,10 +2167,35 @@ IMAGE_HEIGHT = 256
 DISPLAY_WIDTH = 128
 DISPLAY_HEIGHT = 128
 
-# XXX Make this dependent in images per viewport and memory consumed
-MAX_CACHE_ENTRIES = 128
-# Reduce the cache by this number of entries when the cache overflows
-MAX_CACHE_ENTRIES_WATERMARK = 10
+# Maximum bytes used by the images in the cache. Most entries are 32-bit
+# IMAGE_WIDTH x IMAGE_HEIGHT thumbnails, 256KB each
+# XXX Make this dependent in images per viewport
+MAX_CACHE_BYTES = 128 * 2**20
+# Reduce the cache by this number of bytes when the cache overflows
+MAX_CACHE_BYTES_WATERMARK = 10 * IMAGE_WIDTH * IMAGE_HEIGHT * 4
+# Estimated bytes used by a QIcon in the cache, the icons are only used for the
+# small icons of the table view
+ICON_CACHE_ENTRY_BYTES = 32 * 32 * 4
+
+# Events handled by FilePane.eventFilter, the rest are let through without
+# further processing
+FILE_PANE_FILTERED_EVENTS = frozenset([QEvent.FocusIn, QEvent.FocusOut, 
+    QEvent.MouseButtonRelease, QEvent.KeyPress, QEvent.ShortcutOverride])
+
+# Number of rows sampled by the table view when sizing columns to contents, see
+# QHeaderView.setResizeContentsPrecision
+TABLE_RESIZE_CONTENTS_PRECISION = 100
+
+# Time in milliseconds between refreshes of the free disk space
+DISK_INFO_REFRESH_MS = 10000
+
+# Time in milliseconds an archive extraction can take before showing a
+# cancellable progress dialog, see WCXFileInfoIterator.extract
+EXTRACT_PROGRESS_DELAY_MS = 500
+
+# Number of items laid out by the list view before processing events, see
+# QListView.setBatchSize
+LIST_VIEW_LAYOUT_BATCH_SIZE = 256
 
 # Time in milliseconds to display the search string tooltip when typing
 SEARCH_STRING_DISPLAY_TIME_MS = 2000
@@ -1912,6 +2206,34 @@ SEARCH_STRING_DISPLAY_TIME_MS = 2000
 READING_THREADS = 10
 READING_THREADS = 1
 
+# Number of PixmapRetriever threads in charge of reading the image files for the
+# PixmapReader threads. Reads are latency bound on slow sources, so there can be
+# more of these than decoding threads. This is the maximum, the number of reads
+# in flight is adjusted per volume by ReadConcurrencyLimiter
+RETRIEVING_THREADS = 16
+# Initial number of reads in flight per volume
+READ_CONCURRENCY_INITIAL = 4
+# Number of read latencies sampled before adjusting the reads in flight
+READ_LATENCY_SAMPLES = 32
+# Read latency (99th percentile of the samples) over which the reads in flight
+# are reduced, in seconds
+READ_LATENCY_TARGET = 0.5
+# Maximum number of read images waiting to be decoded, this bounds the memory
+# used by the retrievers when the decoders are behind
+DECODE_QUEUE_MAX_ENTRIES = 8
+# Maximum number of thumbnail requests waiting for the retrievers, the oldest
+# requests are dropped over this. Fast scrolling on large directories can
+# request thumbnails much faster than they are retrieved
+REQUEST_QUEUE_MAX_ENTRIES = 256
+
+# Time in milliseconds to wait for directory watcher notifications to settle
+# before reloading the directory
+WATCHER_RELOAD_DELAY_MS = 150
+
+# Number of SubdirSizeReader threads used when calculating the size of all the
+# subdirectories, each thread walks a different subdirectory
+SIZE_READING_THREADS = 4
+
 # This prefix is used to access the network share directory, which also contains
 # the WFX plugins.
 # - it's a UNC-like path so it works with path.os. functions
@@ -1931,6 +2253,13 @@ use_image_reader = True
 # PIL is able to read exif tags but causes the UI to stutter noticeably
 # and consumes a 4x more memory
 use_pil = True
+# Use libjpeg-turbo for jpegs if available, takes precedence over the above for
+# jpegs, other file formats still use the above
+use_turbojpeg = (turbojpeg is not None)
+# The TurboJPEG instance only holds the loaded library, every decode call
+# creates its own libjpeg-turbo handle, so a single instance is shared by all the
+# PixmapReader threads. This is set in main() if use_turbojpeg
+g_turbojpeg = None
 
 # Use a QStyledItemDelegate to draw scalable icons as thumbnails. The other
 # option is to have the model return the scaled up icon, but that means all the
@@ -2149,10 +2478,12 @@ def qTabWidgetFromPage(pageWidget):
 
     return tab
     
-def qResizePixmap(pixmap, target_width, target_height):
+def qResizePixmap(pixmap, target_width, target_height, smooth=True):
     """
         Scale the given pixmap to the target size, preserving aspect ratio, and
         centering the image by adding any necessary simmetric padding.
+
+        Use smooth=False for a faster but lower quality scaling.
     """
     assert None is logger.debug("Resizing from %dx%d to %dx%d", pixmap.width(), pixmap.height(), target_width, target_height)
     
@@ -2160,6 +2491,10 @@ def qResizePixmap(pixmap, target_width, target_height):
     orig_width = pixmap.width()
     orig_height = pixmap.height()
 
+    if ((orig_width == target_width) and (orig_height == target_height)):
+        # Already the target size, nothing to scale or pad
+        return pixmap
+
     # Calculate the scaling factor to preserve aspect ratio
     scale_factor_width = float(target_width) / orig_width
     scale_factor_height = float(target_height) / orig_height
@@ -2169,8 +2504,13 @@ def qResizePixmap(pixmap, target_width, target_height):
     new_width = int(orig_width * scale_factor)
     new_height = int(orig_height * scale_factor)
 
-    # Scale the image to the new size
-    scaled_pixmap = pixmap.scaled(new_width, new_height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    # Scale the image to the new size, skip it if the image already fits (eg
+    # PIL thumbnails), only padding is necessary in that case
+    if ((new_width == orig_width) and (new_height == orig_height)):
+        scaled_pixmap = pixmap
+    else:
+        scaled_pixmap = pixmap.scaled(new_width, new_height, Qt.KeepAspectRatio, 
+            Qt.SmoothTransformation if smooth else Qt.FastTransformation)
     
     # Create a new pixmap of the target size
     result_pixmap = QPixmap(target_width, target_height)
@@ -2185,6 +2525,32 @@ def qResizePixmap(pixmap, target_width, target_height):
 
     return result_pixmap
 
+# LRU cache of (source cacheKey, width, height, smooth) to scaled QIcon, see
+# qScaledIcon
+SCALED_ICON_CACHE_MAX_ENTRIES = 256
+g_scaled_icons = collections.OrderedDict()
+def qScaledIcon(source, target_width, target_height, smooth=True):
+    """
+    Return a QIcon with the QPixmap or QIcon source resized to the target size
+    as qResizePixmap does.
+
+    Views repaint the same items over and over, the result is cached by the
+    source's cacheKey, which is the same for copies of the same pixmap and
+    changes when the pixmap is modified
+    """
+    key = (source.cacheKey(), target_width, target_height, smooth)
+    # Python 2.7 OrderedDict has no move_to_end, pop and re-insert so cache
+    # hits become the most recently used
+    icon = g_scaled_icons.pop(key, None)
+    if (icon is None):
+        pixmap = source.pixmap(target_width, target_height) if isinstance(source, QIcon) else source
+        icon = QIcon(qResizePixmap(pixmap, target_width, target_height, smooth))
+        if (len(g_scaled_icons) >= SCALED_ICON_CACHE_MAX_ENTRIES):
+            g_scaled_icons.popitem(last=False)
+    g_scaled_icons[key] = icon
+
+    return icon
+
 g_shell32 = CTypesHelper("windows.h", "shell32.dll")
 def qGetSystemIcon(filepath, default=None, small=True, fake_filename=True, is_dir = False, is_system=False, is_hidden=False, is_link=False):
     """
@@ -2342,6 +2708,43 @@ def qRateLimitCall(fn, delay_ms):
         #     and restarts?
         g_rate_limited_call_timers[key] = (timer, rate_limited_calls + 1) 
 
+def qWaitForCondition(condition, signals, timeout_ms):
+    """
+    Process events in a local event loop until condition() is True or
+    timeout_ms expire, checking the condition every time one of the signals is
+    emitted.
+
+    This returns as soon as the condition is met instead of sleeping a fixed
+    time and then processing events.
+
+    Returns the final value of condition()
+    """
+    if (condition()):
+        return True
+
+    loop = QEventLoop()
+    def check(*args):
+        if (condition()):
+            loop.quit()
+
+    # Use a timer owned here instead of QTimer.singleShot so it can be stopped
+    # and doesn't fire on the loop after returning
+    timer = QTimer()
+    timer.setSingleShot(True)
+    timer.timeout.connect(loop.quit)
+    for signal in signals:
+        signal.connect(check)
+    try:
+        timer.start(timeout_ms)
+        loop.exec_()
+
+    finally:
+        timer.stop()
+        for signal in signals:
+            signal.disconnect(check)
+
+    return condition()
+
 def qEnumToStr(enum_type, enum_value):
     # Note type(enum_value) is QtCore.Type, so enum_type cannot be obtained from
     # enum_value and has to be provided as parameter
@@ -2766,7 +3169,13 @@ class Win32FileInfoIterator(FileInfoIterator):
                 abs_dirpath = os.path.join(self.dirpath, dirpath)
                 assert None is logger.debug("Reading first entry for %r %r %r", dirpath, self.dirpath, abs_dirpath)
                 # Add wildcard, required by FindFirstFile
-                handle = c.FindFirstFileW(os.path.join(abs_dirpath, "*"), ctypes.byref(find_data))
+                # Use the Ex version to skip fetching the short 8.3 name
+                # (FindExInfoBasic) and to fetch the entries in larger batches
+                # per kernel call (FIND_FIRST_EX_LARGE_FETCH), which makes a
+                # noticeable difference for recursive size calculations
+                handle = c.FindFirstFileExW(os.path.join(abs_dirpath, "*"), 
+                    c.FindExInfoBasic, ctypes.byref(find_data), c.FindExSearchNameMatch, 
+                    None, c.FIND_FIRST_EX_LARGE_FETCH)
                 
                 if (handle == WIN32_INVALID_HANDLE_VALUE):
                     logger.warn("Unable to open directory or invalid path %r %r %r" % (dirpath, self.dirpath, abs_dirpath))
@@ -2832,7 +3241,7 @@ class Win32FileInfoIterator(FileInfoIterator):
         # This is modified when recursing, save
         self.current_dirpath = dirpath
 
-        file_infos = list(dir_infos_set) + file_infos 
+        file_infos = fileinfos_combine(dir_infos_set, file_infos)
 
         self.done = (len(file_infos) == 0)
 
@@ -3163,7 +3572,7 @@ class WFXFileInfoIterator(FileInfoIterator):
             if ((batch_size > 0) and ((len(file_infos) + len(dir_infos_set)) > batch_size)):
                 break
         
-        file_infos = list(dir_infos_set) + file_infos 
+        file_infos = fileinfos_combine(dir_infos_set, file_infos)
 
         # Update the resume values in case any was modified in the loop (no need
         # to update dirpath_stack since it's a reference to self.dirpath_stack)
@@ -3225,12 +3634,9 @@ class WFXFileInfoIterator(FileInfoIterator):
         relpath = filepath[len(arcpath)+1:]
         # Entries in WCX use backward slashes with no starting forward slash
         entrypath = relpath
-        temp_subdir = "%x" % (hash(arcpath) + (sys.maxint - 1))
-        temp_relpath = os.path.join(temp_subdir, relpath)
-        temp_dir = os.path.join(TEMP_DIR, temp_subdir)
+        temp_dir = temp_extract_dirpath(arcpath)
 
-        filepath = os.path.join(temp_dir, relpath)
-        filepath = os.path.abspath(filepath)
+        filepath = temp_dir + os.sep + relpath
         dirpath = os.path.dirname(filepath)
         
         os_makedirs(dirpath)
@@ -3280,6 +3686,11 @@ class WCXFileInfoIterator(FileInfoIterator):
         self.done = False
 
         self.c = None
+        # Set to abort an ongoing extraction, see process_data in extract
+        self.abort_extract = False
+        # True while extract is waiting for the extraction, see
+        # DirectoryModel.reloadWatchedDirectory
+        self.extracting = False
         
     def getFileInfos(self, batch_size = 0):
         file_infos = []
@@ -3341,6 +3752,11 @@ class WCXFileInfoIterator(FileInfoIterator):
 
         c = self.c()
         header = c.tHeaderDataXX()
+        # Archives created in one go have many entries with the same FileTime,
+        # memoize the FileTime to timestamp conversion for this batch. 0 is
+        # used by some .iso files (eg boot.images dir from Linux images) which
+        # make datetime.datetime raise, ignore it by mapping it to 0
+        filetime_to_mtime = { 0 : 0 }
         
         # Some wcx files wrap around once res returns E_END_ARCHIVE, skip afer
         # the first listing 
@@ -3373,21 +3789,21 @@ class WCXFileInfoIterator(FileInfoIterator):
                 )):
                 relpath = filename[len(self.dirpath):]
 
-                mtime = 0
-                # Some .iso files have 0 as date (eg boot.images dir from Linux
-                # images) which make datetime.datetime raise, ignore
-                if (header.FileTime != 0):
+                filetime = header.FileTime
+                mtime = filetime_to_mtime.get(filetime, None)
+                if (mtime is None):
                     # FileTime = (year - 1980) << 25 | month << 21 | day << 16 | hour << 11 | minute << 5 | second/2;
                     mtime = datetime.datetime(
-                        (header.FileTime >> 25) + 1980, 
-                        (header.FileTime >> 21) & 0xF, 
-                        (header.FileTime >> 16) & 0x1F, 
-                        (header.FileTime >> 11) & 0x1F, 
-                        (header.FileTime >> 5) & 0x1F, 
-                        (header.FileTime & 0x1F) * 2
+                        (filetime >> 25) + 1980, 
+                        (filetime >> 21) & 0xF, 
+                        (filetime >> 16) & 0x1F, 
+                        (filetime >> 11) & 0x1F, 
+                        (filetime >> 5) & 0x1F, 
+                        (filetime & 0x1F) * 2
                     )
                     
                     mtime = datetime_to_utctimestamp(mtime)
+                    filetime_to_mtime[filetime] = mtime
                 # See https://ghisler.github.io/WCX-SDK/theaderdata.htm
                 is_dir = ((header.FileAttr & 0x10) != 0)
                 attr = fileinfo_build_attr(is_dir, (header.FileAttr & 0x2) != 0, (header.FileAttr & 0x1) != 0, False)
@@ -3403,22 +3819,70 @@ class WCXFileInfoIterator(FileInfoIterator):
                 if ((batch_size > 0) and (len(file_infos) + len(dir_infos_set)) > batch_size):
                     break
 
-        file_infos = list(dir_infos_set) + file_infos 
+        file_infos = fileinfos_combine(dir_infos_set, file_infos)
 
         self.done = (self.done or (len(file_infos) == 0))
 
         return dir_infos_set, file_infos
 
+    def abortExtract(self):
+        logger.info("Aborting extraction")
+        self.abort_extract = True
+
     def extract(self, filepath):
+        """
+        Extract in a worker thread, processing events meanwhile so the UI is
+        repainted while the plugin decompresses. This works because ctypes
+        releases the GIL while calling into the plugin.
+
+        If the extraction takes long, show a modal progress dialog that allows
+        cancelling it, returns None if cancelled.
+
+        XXX This still waits for the extraction to finish, return a handle and
+            signal completion to the caller instead?
+        """
+        thread = CallableThread(self.extractBlocking, filepath)
+        self.abort_extract = False
+        self.extracting = True
+        progress = None
+        start_time = time.time()
+        try:
+            thread.start()
+            while (not thread.wait(50)):
+                if ((progress is None) and ((time.time() - start_time) * 1000 > EXTRACT_PROGRESS_DELAY_MS)):
+                    # Busy progress dialog, Cancel and Escape abort
+                    progress = QProgressDialog("Extracting %r" % os.path.basename(filepath), "Cancel", 0, 0, qFindMainWindow())
+                    progress.setWindowTitle("Extracting")
+                    progress.setWindowModality(Qt.ApplicationModal)
+                    progress.setMinimumDuration(0)
+                    progress.canceled.connect(self.abortExtract)
+                    progress.show()
+
+                if (progress is None):
+                    # Exclude user input events so this is not re-entered
+                    qApp.processEvents(QEventLoop.ExcludeUserInputEvents)
+
+                else:
+                    # The dialog is application modal, user input can only go to
+                    # the dialog
+                    qApp.processEvents()
+
+        finally:
+            self.extracting = False
+            if (progress is not None):
+                progress.canceled.disconnect(self.abortExtract)
+                progress.close()
+
+        return thread.getResult()
+
+    def extractBlocking(self, filepath):
         # XXX This preamble is common between zip and wcx, probably others, find
         #     a way to refactor to the caller, but it needs the arcpath,
         #     which createIterator already calculates, store it there?
         relpath = filepath[len(self.arcpath)+1:]
         # Entries in WCX use backward slashes with no starting forward slash
         entrypath = relpath
-        temp_subdir = "%x" % (hash(self.arcpath) + (sys.maxint - 1))
-        temp_relpath = os.path.join(temp_subdir, relpath)
-        temp_dir = os.path.join(TEMP_DIR, temp_subdir)
+        temp_dir = temp_extract_dirpath(self.arcpath)
 
         c = self.c()
         
@@ -3445,12 +3909,11 @@ class WCXFileInfoIterator(FileInfoIterator):
 
             See https://ghisler.github.io/WCX-SDK/tprocessdataproc.htm
             """
-            # XXX Actually do something with this, extract() should run in a
-            #     thread and send signals to the caller, with the thread abort
-            #     that connects to that process_data callback
+            # XXX Actually do something with this, send signals to the caller
+            #     to display progress
             logger.info("%r %d", filename, size)
             # Return 0 to abort
-            return 1
+            return 0 if self.abort_extract else 1
 
         # Store in a variable to prevent crashes because of being garbage
         # collected
@@ -3480,8 +3943,7 @@ class WCXFileInfoIterator(FileInfoIterator):
                 break
 
         if (res == c.PK_OK):
-            filepath = os.path.join(temp_dir, relpath)
-            filepath = os.path.abspath(filepath)
+            filepath = temp_dir + os.sep + relpath
             dirpath = os.path.dirname(filepath)
             
             os_makedirs(dirpath)
@@ -3527,7 +3989,7 @@ class QtFileInfoIterator(FileInfoIterator):
             # seem to fail with "unknown keyword argument"?
             self.it = QDirIterator(
                 unicode(self.dirpath), 
-                [("*%s" % ext) for ext in IMAGE_EXTENSIONS] if (len(FILTERED_EXTENSIONS) > 0) else ["*"], 
+                QDIR_NAME_FILTERS, 
                 QDir.Files | QDir.AllDirs | QDir.NoDot | QDir.Hidden | QDir.System, 
                 QDirIterator.Subdirectories if self.recurse else QDirIterator.NoIteratorFlags)
 
@@ -3551,8 +4013,11 @@ class QtFileInfoIterator(FileInfoIterator):
                 filename = os.path.relpath(it.filePath(), self.dirpath)
             else:
                 filename = it.fileName()
+            # Every it.fileInfo() call creates a new QFileInfo wrapper, fetch
+            # it once per entry
+            qfile_info = it.fileInfo()
             #logger.info("isDiring")
-            is_dir = it.fileInfo().isDir()
+            is_dir = qfile_info.isDir()
 
             #logger.info("read entry %r %s", filename, is_dir)
 
@@ -3563,11 +4028,11 @@ class QtFileInfoIterator(FileInfoIterator):
                 # of the .lnk file, but it's involved having to read the
                 # file, etc
                 # https://stackoverflow.com/questions/53411886/qfileinfo-size-is-returning-shortcut-target-size
-                os.path.getsize(it.fileInfo().filePath()) if it.fileInfo().isSymLink() else it.fileInfo().size(), 
+                os.path.getsize(qfile_info.filePath()) if qfile_info.isSymLink() else qfile_info.size(), 
                 # XXX Check if this is also returning the wrong date for .lnk files
                 # XXX Find out if this is UTC, fix UTC elsewhere
-                it.fileInfo().lastModified().toMSecsSinceEpoch() / 1000, 
-                fileinfo_build_attr(is_dir, it.fileInfo().isHidden(), it.fileInfo().isWritable(), it.fileInfo().isSymbolicLink())
+                qfile_info.lastModified().toMSecsSinceEpoch() / 1000, 
+                fileinfo_build_attr(is_dir, qfile_info.isHidden(), qfile_info.isWritable(), qfile_info.isSymbolicLink())
             )
 
             if (is_dir):
@@ -3595,7 +4060,7 @@ class QtFileInfoIterator(FileInfoIterator):
             if ((not it.hasNext()) or ((batch_size > 0) and (len(file_infos) + len(dir_infos_set)) > batch_size)):
                 break
 
-        file_infos = list(dir_infos_set) + file_infos 
+        file_infos = fileinfos_combine(dir_infos_set, file_infos)
         self.done = (len(file_infos) == 0)
                
         return dir_infos_set, file_infos
@@ -3667,7 +4132,7 @@ class ListdirFileInfoIterator(FileInfoIterator):
             if (((batch_size > 0) and ((len(dir_infos_set) + len(file_infos)) >= batch_size)) or (len(l) == 0)):
                 break
 
-        file_infos = list(dir_infos_set) + file_infos 
+        file_infos = fileinfos_combine(dir_infos_set, file_infos)
         
         return dir_infos_set, file_infos
 
@@ -3717,15 +4182,7 @@ class ZipFileInfoIterator(FileInfoIterator):
         file_infos = []
 
         if (self.zip is None):
-            # XXX Split the path into path to the zip file and path inside the
-            #     zip file
-            # XXX This locks the file and other processes cannot write to it,
-            #     open and close on demand? Open passing the file object?
-            #     This seems to a python open() issue on Windows where it uses
-            #     default sharing attributes, the solution is to
-            #       fh = os.open('data.txt', os.O_RDONLY | os.O_SHARE_WRITE)
-            #       f = os.fdopen(fh, 'r')
-            self.zip = zipfile.ZipFile(self.arcpath)
+            self.openZip()
             self.current_file = 0
             logger.info("filelisting")
             self.namelist = self.zip.namelist()
@@ -3733,6 +4190,9 @@ class ZipFileInfoIterator(FileInfoIterator):
             # being listed
             # XXX This should use the parent directory mtime, if present
             dir_infos_set = set([FileInfo("..", 0, 0, fileinfo_build_attr(True, False, True, False))])
+            # Relative paths of the directories already returned, including the
+            # trailing slash, used to skip entries inside those directories
+            # without having to look them up in the zip again
             self.dir_names = set([".."])
 
         # XXX Is doing filelist first and then info more efficient?
@@ -3740,6 +4200,10 @@ class ZipFileInfoIterator(FileInfoIterator):
         logger.info("processing")
         z = self.zip
         l = self.namelist
+        # dirpath is fixed for the lifetime of the iterator, hoist it and its
+        # length out of the per entry filter below
+        dirpath = self.dirpath
+        dirpath_len = len(dirpath)
         
         while (len(l) > 0):
             # Filenames inside zip
@@ -3753,8 +4217,8 @@ class ZipFileInfoIterator(FileInfoIterator):
             # filename use forward slashes and directories end in forward slash
             
             # Allow only files inside dirpath (no / or direct subdirectories, ie / at the end)
-            if (filename.startswith(self.dirpath) and (filename != self.dirpath)):
-                relpath = filename[len(self.dirpath):]
+            if ((len(filename) > dirpath_len) and filename.startswith(dirpath)):
+                relpath = filename[dirpath_len:]
                 i = index_of(relpath, "/")
                 if ((i != -1) and (i != (len(relpath) - 1))):
                     # If recursing, fall through to create this entry, otherwise
@@ -3768,19 +4232,19 @@ class ZipFileInfoIterator(FileInfoIterator):
                         relpath = relpath[:i+1] 
                         # Recreate the theoretical entry filename for this
                         # subdirectory
-                        filename = self.dirpath + relpath
+                        filename = dirpath + relpath
                         if (relpath not in self.dir_names):
                             assert None is logger.debug("Adding subdirpath %r filename %r", relpath, filename)
                             # Fall through below to create this subdirpath
 
                         else:
-                            assert None is logger.debug("Discarding relpath %r deep inside dirpath %r filename %r", relpath, self.dirpath, filename)
+                            assert None is logger.debug("Discarding relpath %r deep inside dirpath %r filename %r", relpath, dirpath, filename)
                             continue
             else:
-                assert None is logger.debug("Discarding filename %r not inside dirpath %r", filename, self.dirpath)
+                assert None is logger.debug("Discarding filename %r not inside dirpath %r", filename, dirpath)
                 continue
             
-            assert None is logger.debug("Accepting filename %r in dirpath %r relpath %r", filename, self.dirpath, relpath)
+            assert None is logger.debug("Accepting filename %r in dirpath %r relpath %r", filename, dirpath, relpath)
 
             if (filename.endswith("/")):
                 # Fetch the directory mtime if there's an entry for this
@@ -3800,7 +4264,9 @@ class ZipFileInfoIterator(FileInfoIterator):
                     attr = fileinfo_build_attr(True, False, True, False)
                     file_info = FileInfo(filename, 0, mtime, attr)
                     dir_infos_set.add(file_info)
-                    self.dir_names.add(filename)
+                    # Store with the final slash, which is how it's looked up
+                    # above
+                    self.dir_names.add(relpath)
 
             else:
                 zipinfo = z.getinfo(filename)
@@ -3818,7 +4284,7 @@ class ZipFileInfoIterator(FileInfoIterator):
             if (((batch_size > 0) and ((len(dir_infos_set) + len(file_infos)) >= batch_size)) or (len(l) == 0)):
                 break
 
-        file_infos = list(dir_infos_set) + file_infos 
+        file_infos = fileinfos_combine(dir_infos_set, file_infos)
         
         self.done = (len(file_infos) == 0)
 
@@ -3835,18 +4301,48 @@ class ZipFileInfoIterator(FileInfoIterator):
         # XXX Using .extract() is simple but has several issues: no progress
         #     report, no cancel, no background, hardcoded destination path
         # Put each file in a semi unique temp subdirectory
-        temp_subdir = "%x" % (hash(self.arcpath) + (sys.maxint - 1))
-        temp_relpath = os.path.join(temp_subdir, relpath)
-        temp_dir = os.path.join(TEMP_DIR, temp_subdir)
-        # Extract with stored path to the unique temp subdirectory
+        temp_dir = temp_extract_dirpath(self.arcpath)
+        # Extract with stored path to the unique temp subdirectory, reuse the
+        # ZipFile opened when listing so the central directory is not parsed
+        # again
+        if (self.zip is None):
+            self.openZip()
         self.zip.extract(entrypath, temp_dir)
-        filepath = os.path.join(temp_dir, relpath)
-        filepath = os.path.abspath(filepath)
+        filepath = temp_dir + os.sep + relpath
         return filepath
 
+    def openZip(self):
+        logger.info("%r", self.arcpath)
+        # XXX Split the path into path to the zip file and path inside the
+        #     zip file
+        # XXX This locks the file and other processes cannot write to it,
+        #     open and close on demand? Open passing the file object?
+        #     This seems to a python open() issue on Windows where it uses
+        #     default sharing attributes, the solution is to
+        #       fh = os.open('data.txt', os.O_RDONLY | os.O_SHARE_WRITE)
+        #       f = os.fdopen(fh, 'r')
+        # Use a larger buffer than the default to reduce the number of reads
+        # on slow (network, HDD) drives
+        self.zip_file = open(self.arcpath, "rb", 2**20)
+        self.zip = zipfile.ZipFile(self.zip_file, allowZip64=True)
+
+    def close(self):
+        logger.info("%r", self.arcpath)
+        if (self.zip is not None):
+            self.zip.close()
+            self.zip_file.close()
+            self.zip = None
+
     def isDone(self):
         return self.done
 
+    def __del__(self):
+        logger.info("")
+        try:
+            self.close()
+        except Exception as e:
+            logger.warn("Error closing zip %r", e)
+
 class CsvFileInfoIterator(FileInfoIterator):
     """
     XXX This is slow in CSV files with many rows, and even slower in
@@ -3958,7 +4454,7 @@ class CsvFileInfoIterator(FileInfoIterator):
                 time.sleep(1)
                 break
 
-        file_infos = list(dir_infos_set) + file_infos 
+        file_infos = fileinfos_combine(dir_infos_set, file_infos)
         self.done = (len(file_infos) == 0)
             
         return dir_infos_set, file_infos
@@ -4124,6 +4620,10 @@ class ElidableLabel(QLabel):
 
     def setText(self, text):
         """Store the full text and update display."""
+        # updateDirectoryLabel sets the same text on every summary/model
+        # change, don't repaint (and re-elide) in that case
+        if (text == self._full_text):
+            return
         self._full_text = text
         self.update()
 
@@ -4215,12 +4715,19 @@ class EditablePopupMenu(QMenu):
             active_action = self.activeAction()
             data = active_action.data()
             if (data is not None):
-                i = index_of(self.actions(), active_action)
+                # actions() builds a new list of wrappers on every call, fetch
+                # it once and use it to find the next action too
+                actions = self.actions()
+                i = index_of(actions, active_action)
 
                 self.deleted_datas.append(data)
                 self.removeAction(active_action)
-                # Focus on the next action
-                self.setActiveAction(self.actions()[min(i, len(self.actions())-1)])
+                # Focus on the next action, or the previous if this was the
+                # last one
+                if (i + 1 < len(actions)):
+                    self.setActiveAction(actions[i + 1])
+                elif (i > 0):
+                    self.setActiveAction(actions[i - 1])
         
         # For all other key events, let the base class handle them
         super(EditablePopupMenu, self).keyPressEvent(event)
@@ -4239,6 +4746,35 @@ class EditablePopupMenu(QMenu):
         super(EditablePopupMenu, self).mousePressEvent(event)
 
 
+class CallableThread(QThread):
+    """
+    Thread that calls the given function with the given arguments, use
+    getResult() once finished to get the return value or reraise the exception
+    in the caller thread
+    """
+    def __init__(self, fn, *args, **kwargs):
+        super(CallableThread, self).__init__(kwargs.pop("parent", None))
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.exc_info = None
+
+    def run(self):
+        logger.info("Starting %r", self.fn)
+        try:
+            self.result = self.fn(*self.args, **self.kwargs)
+
+        except:
+            self.exc_info = sys.exc_info()
+        logger.info("Ended")
+
+    def getResult(self):
+        if (self.exc_info is not None):
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
 class DirectoryReader(QThread):
     direntryRead = pyqtSignal(set, list)
     def __init__(self, dirpath, batch_size = 0, parent=None, it=None, loop=True):
@@ -4302,10 +4838,456 @@ class DirectoryReader(QThread):
         if (not self.single_thread):
             self.quit()
 
+class SubdirSizeReader(DirectoryReader):
+    """
+    Calculate the size of several subdirectories concurrently, each worker
+    thread walks a whole subdirectory and sums the sizes there, so only one
+    signal per subdirectory needs to cross to the UI thread instead of every
+    entry.
+
+    The walk is dominated by filesystem latency, and the iterators release the
+    GIL while waiting on the filesystem, so walking several subdirectories at
+    the same time is faster than the single recursive walk.
+
+    subdirSizeRead is emitted with size -2 when a subdirectory starts being
+    walked and with the total size once done. direntryRead is never emitted.
+    """
+    subdirSizeRead = pyqtSignal(unicode, object)
+    def __init__(self, dirpath, subdir_its, batch_size = 0, max_threads = SIZE_READING_THREADS, parent=None):
+        """
+        @param subdir_its list of (subdir, recursive iterator for that subdir),
+               processed in order
+        """
+        logger.info("dirpath %r subdirs %d batch_size %d max_threads %d", dirpath, len(subdir_its), batch_size, max_threads)
+        super(SubdirSizeReader, self).__init__(dirpath, batch_size, parent)
+        # Reversed so the workers can pop from the end while keeping the
+        # order, list.pop is atomic under the GIL
+        self.subdir_its = list(reversed(subdir_its))
+        self.max_threads = max_threads
+
+    def readSubdirSizes(self):
+        while (not self.mustAbort()):
+            try:
+                subdir, it = self.subdir_its.pop()
+
+            except IndexError:
+                break
+
+            self.subdirSizeRead.emit(subdir, -2)
+            size = 0
+            while (not self.mustAbort()):
+                dir_infos_set, file_infos = it.getFileInfos(self.batch_size)
+                if (len(file_infos) == 0):
+                    break
+                size += sum([file_info.size for file_info in file_infos if (file_info.filename != "..")])
+
+            if (not self.mustAbort()):
+                assert None is logger.debug("Subdir %r size %d", subdir, size)
+                self.subdirSizeRead.emit(subdir, size)
+
+    def run(self):
+        logger.info("Starting %r", self.dirpath)
+
+        if (self.single_thread):
+            try:
+                self.readSubdirSizes()
+
+            except Exception as e:
+                logger.error("Error reading subdir sizes %r %s", self.dirpath, e)
+
+        else:
+            threads = [CallableThread(self.readSubdirSizes) for _ in xrange(min(self.max_threads, len(self.subdir_its)))]
+            for thread in threads:
+                thread.start()
+            # Join all the workers before collecting errors, an exception in
+            # one worker shouldn't leave the others running after finished is
+            # emitted. Log the errors instead of raising, the subdirs that
+            # didn't finish are reset by the finished handler
+            for thread in threads:
+                thread.wait()
+            for thread in threads:
+                try:
+                    thread.getResult()
+
+                except Exception as e:
+                    logger.error("Error reading subdir sizes %r %s", self.dirpath, e)
+
+        logger.info("Aborted" if (self.mustAbort()) else "Ended" )
+
+# See ExifTags.TAGS
+EXIF_TAG_ORIENTATION = 0x0112
+def pil_exif_rotation(img):
+    """
+    Return the PIL rotation angle in degrees counterclockwise required to
+    display the image upright according to its EXIF orientation tag, 0 if none
+    """
+    # Not all file formats have exif (eg PNG), guard against. Note the exif
+    # data is parsed from the header read by Image.open, this doesn't decode
+    # the image
+    exif_data = img._getexif() if hasattr(img, "_getexif") else None
+    angle = 0
+    if (exif_data is not None):
+        value = exif_data.get(EXIF_TAG_ORIENTATION, None)
+        if (value is not None):
+            logger.info("Found exif orientation %r", value)
+            if (value == 3):
+                angle = 180
+            elif (value == 6):
+                angle = -90
+            elif (value == 8):
+                angle = 90
+    return angle
+
+# Transpose operation equivalent to the pil_exif_rotation angles, transposing is
+# a plain pixel copy as opposed to rotate's affine transform
+PIL_ROTATION_TRANSPOSES = {
+    90 : Image.ROTATE_90,
+    180 : Image.ROTATE_180,
+    -90 : Image.ROTATE_270,
+}
+
+def pil_to_qimage(img):
+    """
+    Convert a PIL image to QImage, faster than ImageQt.toqimage since it lets
+    PIL pack the pixels straight into the QImage layout and doesn't go through
+    the intermediate ImageQt image.
+
+    Returns the QImage and the pixel data the QImage points to, which needs to
+    be kept alive as long as the QImage is used
+    """
+    if (img.mode == "RGB"):
+        # BGRX and BGRA is QImage.Format_RGB32 and Format_ARGB32 on little
+        # endian
+        rawmode, image_format = "BGRX", QImage.Format_RGB32
+    else:
+        if (img.mode != "RGBA"):
+            img = img.convert("RGBA")
+        rawmode, image_format = "BGRA", QImage.Format_ARGB32
+    
+    w, h = img.size
+    data = img.tobytes("raw", rawmode)
+    image = QImage(data, w, h, w * 4, image_format)
+    
+    return image, data
+
+def image_cache_entry_bytes(image):
+    """
+    Return the estimated memory used by a QPixmap or QIcon in the image cache
+    """
+    if (isinstance(image, QPixmap)):
+        return image.width() * image.height() * image.depth() // 8
+
+    return ICON_CACHE_ENTRY_BYTES
+
+class ReadConcurrencyLimiter(object):
+    """
+    Limit the number of reads in flight to a volume, adjusting the limit with
+    additive increase, multiplicative decrease (AIMD) on the read latency.
+
+    Too many reads in flight to slow volumes (eg network shares) make every
+    read slower, including the reads for the visible rows, while fast volumes
+    want as many as possible. The limit is increased by one while the 99th
+    percentile latency of the last READ_LATENCY_SAMPLES reads is under
+    READ_LATENCY_TARGET and reduced by 20% otherwise
+    """
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = min(READ_CONCURRENCY_INITIAL, max_limit)
+        self.in_flight = 0
+        self.latencies = []
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while (self.in_flight >= self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency):
+        """
+        @param latency seconds the read took
+        """
+        with self.cond:
+            self.in_flight -= 1
+            latencies = self.latencies
+            latencies.append(latency)
+            if (len(latencies) >= READ_LATENCY_SAMPLES):
+                latencies.sort()
+                p99 = latencies[int(0.99 * (len(latencies) - 1))]
+                if (p99 > READ_LATENCY_TARGET):
+                    self.limit = max(1, int(self.limit * 0.8))
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                logger.info("read p99 %0.3f limit %d", p99, self.limit)
+                del latencies[:]
+            # The limit may have been increased, wake all the waiters
+            self.cond.notify_all()
+
+# ReadConcurrencyLimiters indexed by volume, see get_read_limiter
+g_read_limiters = {}
+g_read_limiters_lock = threading.Lock()
+def get_read_limiter(filepath):
+    """
+    Return the ReadConcurrencyLimiter for the volume (drive or network share)
+    of filepath
+    """
+    volume = os.path.splitdrive(filepath)[0].lower()
+    with g_read_limiters_lock:
+        limiter = g_read_limiters.get(volume, None)
+        if (limiter is None):
+            limiter = ReadConcurrencyLimiter(RETRIEVING_THREADS)
+            g_read_limiters[volume] = limiter
+
+    return limiter
+
+def queue_put_many(q, items):
+    """
+    Put all the items in the unbounded queue q acquiring the queue lock once,
+    instead of once per item, and wake up as many consumers as items.
+
+    For a LIFO queue the last item is the first to be consumed
+    """
+    # This uses Queue.Queue internals, but Python 2.7 Queue.Queue is not
+    # going to change
+    assert q.maxsize == 0, "only unbounded queues are supported"
+    with q.not_empty:
+        for item in items:
+            q._put(item)
+        q.unfinished_tasks += len(items)
+        q.not_empty.notify(len(items))
+
+def queue_trim(q, max_entries):
+    """
+    Remove and return the items that were put first in the queue q so it has
+    at most max_entries items. For a LIFO queue these are the items that would
+    be consumed last
+    """
+    # See queue_put_many
+    with q.mutex:
+        count = len(q.queue) - max_entries
+        if (count <= 0):
+            return []
+        items = q.queue[:count]
+        del q.queue[:count]
+        q.unfinished_tasks -= count
+        q.not_full.notify(count)
+
+    return items
+
+def thumbnail_cache_filepath(filepath, size, mtime):
+    """
+    Return the path of the on disk thumbnail for the given file, the size and
+    mtime are part of the name so modified files miss the cache.
+
+    The thumbnail is stored as raw IMAGE_WIDTH x IMAGE_HEIGHT
+    QImage.Format_RGB32 pixels, which is as fast to load as a memcpy, instead
+    of having to read and decode the original image again, possibly from a slow
+    network drive
+    """
+    key = repr((filepath, size, mtime))
+    return os.path.join(THUMBNAIL_CACHE_DIR_ABS, hashlib.sha1(key).hexdigest() + ".rgb32")
+
+def thumbnail_cache_read(cache_filepath):
+    """
+    Return the raw thumbnail pixels stored in cache_filepath or None if not
+    cached
+    """
+    try:
+        data = os_read(cache_filepath)
+    
+    except (IOError, OSError):
+        return None
+
+    # Ignore truncated files, eg written by an older version with a different
+    # thumbnail size
+    if (len(data) != IMAGE_WIDTH * IMAGE_HEIGHT * 4):
+        return None
+
+    # Touch the file so pruning removes the least recently used thumbnails
+    # first
+    try:
+        os.utime(cache_filepath, None)
+
+    except OSError as e:
+        logger.warning("Unable to touch thumbnail %r %s", cache_filepath, e)
+
+    return data
+
+# Bytes of thumbnails stored on disk, None until the first write scans the
+# directory, protected by g_thumbnail_cache_lock since thumbnails are written
+# from the PixmapReader threads
+g_thumbnail_cache_bytes = None
+g_thumbnail_cache_lock = threading.Lock()
+def thumbnail_cache_prune():
+    """
+    Remove the least recently used (oldest mtime) thumbnails until the disk
+    cache is under THUMBNAIL_CACHE_MAX_BYTES_WATERMARK, return the bytes
+    remaining.
+
+    Must be called with g_thumbnail_cache_lock held
+    """
+    entries = []
+    try:
+        filenames = os.listdir(THUMBNAIL_CACHE_DIR_ABS)
+
+    except OSError:
+        filenames = []
+    for filename in filenames:
+        # Ignore the temporary files of writes in progress
+        if (not filename.endswith(".rgb32")):
+            continue
+        filepath = os.path.join(THUMBNAIL_CACHE_DIR_ABS, filename)
+        try:
+            st = os.stat(filepath)
+
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, filepath))
+
+    total_bytes = sum([entry[1] for entry in entries])
+    if (total_bytes > THUMBNAIL_CACHE_MAX_BYTES_WATERMARK):
+        logger.info("Pruning %d bytes of thumbnails", total_bytes)
+        entries.sort()
+        for _, size, filepath in entries:
+            if (total_bytes <= THUMBNAIL_CACHE_MAX_BYTES_WATERMARK):
+                break
+            try:
+                os.remove(filepath)
+                total_bytes -= size
+
+            except OSError as e:
+                logger.warning("Unable to remove thumbnail %r %s", filepath, e)
+        logger.info("Pruned to %d bytes of thumbnails", total_bytes)
+
+    return total_bytes
+
+def thumbnail_cache_write(cache_filepath, image):
+    """
+    Store the raw pixels of the IMAGE_WIDTH x IMAGE_HEIGHT QImage.Format_RGB32
+    image in cache_filepath
+    """
+    assert image.size() == QSize(IMAGE_WIDTH, IMAGE_HEIGHT)
+    assert image.format() == QImage.Format_RGB32
+    # Write to a temporary file and rename so other threads never read a
+    # partial file
+    temp_filepath = "%s.%x.tmp" % (cache_filepath, id(image))
+    try:
+        os_makedirs(THUMBNAIL_CACHE_DIR_ABS)
+        with open(temp_filepath, "wb") as f:
+            f.write(image.constBits().asstring(image.byteCount()))
+        # On Windows rename fails if the file exists, that can only happen if
+        # some other thread stored the same thumbnail, ignore
+        os.rename(temp_filepath, cache_filepath)
+
+    except (IOError, OSError) as e:
+        logger.warning("Unable to store thumbnail %r %s", cache_filepath, e)
+        if (os.path.exists(temp_filepath)):
+            os.remove(temp_filepath)
+        return
+
+    # Keep the disk cache bounded, the directory is only scanned on the first
+    # write and when the cap is exceeded
+    global g_thumbnail_cache_bytes
+    with g_thumbnail_cache_lock:
+        if (g_thumbnail_cache_bytes is None):
+            g_thumbnail_cache_bytes = thumbnail_cache_prune()
+        else:
+            g_thumbnail_cache_bytes += image.byteCount()
+            if (g_thumbnail_cache_bytes > THUMBNAIL_CACHE_MAX_BYTES):
+                g_thumbnail_cache_bytes = thumbnail_cache_prune()
+
+class PixmapRetriever(QThread):
+    """
+    Thread in charge of reading the image file data, possibly from a slow
+    network drive, and passing it to the PixmapReader threads for decoding.
+
+    Reading and decoding are done in different threads so slow reads don't
+    hold the decoding of images already read and vice versa.
+
+    Requests for rows that were scrolled far away from the visible rows are
+    cancelled without reading, emitting requestCancelled so the UI thread can
+    request them again if they become visible.
+
+    Thumbnails already stored on disk (see thumbnail_cache_filepath) are read
+    instead of the image file, and don't need decoding.
+    """
+    requestCancelled = pyqtSignal(int, str)
+    def __init__(self, request_queue, decode_queue, get_request_generation, get_visible_rows, parent=None):
+        """
+        @param get_request_generation see PixmapReader
+        @param get_visible_rows function returning the (first, last) rows
+               currently visible, or None if unknown
+        """
+        super(PixmapRetriever, self).__init__(parent)
+        self.request_queue = request_queue
+        self.decode_queue = decode_queue
+        self.get_request_generation = get_request_generation
+        self.get_visible_rows = get_visible_rows
+
+    def run(self):
+        request_queue = self.request_queue
+        decode_queue = self.decode_queue
+        while (True):
+            # The request queue is LIFO so the most recent requests, which are
+            # the ones most likely to still be in view, are serviced first
+            # (requests from previous directories are discarded below)
+            request = request_queue.get()
+            if (request is None):
+                break
+            generation, row, filepath, size, mtime = request
+            if (generation != self.get_request_generation()):
+                logger.info("Discarding stale request %d %r", row, filepath)
+                continue
+            
+            # Allow prefetching a page worth of rows before and after the
+            # visible ones
+            visible_rows = self.get_visible_rows()
+            if (visible_rows is not None):
+                first, last = visible_rows
+                margin = last - first + 1
+                if ((row < first - margin) or (row > last + margin)):
+                    logger.info("Cancelling scrolled away request %d %r", row, filepath)
+                    self.requestCancelled.emit(row, filepath)
+                    continue
+                
+            logger.info("%d %r", row, filepath)
+            cache_filepath = thumbnail_cache_filepath(filepath, size, mtime)
+            data = thumbnail_cache_read(cache_filepath)
+            if (data is not None):
+                logger.info("Thumbnail cache hit %d %r", row, filepath)
+                decode_queue.put((generation, row, filepath, data, None))
+                data = None
+                continue
+            
+            limiter = get_read_limiter(filepath)
+            limiter.acquire()
+            start = time.time()
+            try:
+                # XXX On slow connections visible items can be behind stale
+                #     items. The read could chunk and check if the request
+                #     became stale
+                data = os_read(filepath)
+
+            except Exception as e:
+                # XXX This is normally hit when trying to fetch images for stale
+                #     direntries on the non-stale image directory, fix that case
+                #     since it fills the thumbs with stale error thumgs, but
+                #     still handle exceptions since network could be down, etc
+                logger.error("Open Error loading %r %s", filepath, e)
+                data = None
+            # Release before queueing so waiting for the decoders doesn't
+            # count as read latency
+            limiter.release(time.time() - start)
+
+            # This blocks if the decoders are behind, which bounds the memory
+            # used by read but not yet decoded files
+            decode_queue.put((generation, row, filepath, data, cache_filepath))
+            data = None
+
 class PixmapReader(QThread):
     """
-    Thread in charge of reading an image, possibly from a slow network drive,
-    decoding and scaling it, allowing the UI thread to be responsive.
+    Thread in charge of decoding and scaling an image read by PixmapRetriever,
+    allowing the UI thread to be responsive.
 
     Care was taken to find the best operations found that release the GIL and
     don't block the UI thread.
@@ -4317,139 +5299,366 @@ class PixmapReader(QThread):
     used
 
     The only shared resource with the UI thread this thread modifies is the
-    request queue, emitting a signal when done which will be handled in the UI
+    decode queue, emitting a signal when done which will be handled in the UI
     thread.
+
+    XXX On slow sources throughput is bound by the number of reads in flight,
+        which is one per retriever thread. Batching reads with io_uring would
+        allow many reads in flight from a single thread, but there are no
+        io_uring bindings for Python 2.7 and the main platform is Windows, use
+        more reader threads or overlapped IO via ctypes instead?
     """
     pixmapRead = pyqtSignal(int, str, QPixmap)
-    def __init__(self, request_queue, parent=None):
+    def __init__(self, decode_queue, get_request_generation, parent=None):
+        """
+        @param decode_queue queue of (generation, row, filepath, data,
+               cache_filepath) filled by PixmapRetriever, data is None if the
+               file couldn't be read. cache_filepath is where to store the
+               decoded thumbnail, or None if data is already the raw thumbnail
+               read from there
+        @param get_request_generation function returning the current request
+               generation, requests from other generations are stale and are
+               discarded
+        """
         super(PixmapReader, self).__init__(parent)
-        self.request_queue = request_queue
+        self.decode_queue = decode_queue
+        self.get_request_generation = get_request_generation
+        # Shared decoder, the decoding releases the GIL so readers don't block
+        # each other or the UI thread
+        self.tj = g_turbojpeg
+        # Thumbnail sized image reused across requests of this thread, holds
+        # the last thumbnail returned by toThumbnailPixmap
+        self.canvas = None
+
+    def toThumbnailPixmap(self, image):
+        """
+        Scale the image to fit the IMAGE_WIDTH x IMAGE_HEIGHT thumbnail
+        preserving the aspect ratio and center it with padding, same as
+        qResizePixmap.
+
+        This works on QImages and pads into a canvas reused across requests
+        instead of allocating intermediate QPixmaps, fromImage copies the
+        canvas so the returned pixmap doesn't alias it. The canvas is left
+        with the thumbnail so it can be stored in the thumbnail cache
+        """
+        if (image.isNull()):
+            return QPixmap()
+        
+        size = image.size()
+        new_size = size.scaled(IMAGE_WIDTH, IMAGE_HEIGHT, Qt.KeepAspectRatio)
+        if (new_size != size):
+            image = image.scaled(new_size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+        if (self.canvas is None):
+            self.canvas = QImage(IMAGE_WIDTH, IMAGE_HEIGHT, QImage.Format_RGB32)
+        canvas = self.canvas
+        canvas.fill(QColor(255, 255, 255))
+        painter = QPainter(canvas)
+        painter.drawImage((IMAGE_WIDTH - new_size.width()) // 2, (IMAGE_HEIGHT - new_size.height()) // 2, image)
+        painter.end()
+
+        return QPixmap.fromImage(canvas)
+
+    def readTurboJpeg(self, data):
+        """
+        Decode the jpeg data to a QPixmap at the smallest libjpeg-turbo DCT
+        scaling factor that is still larger than the IMAGE_WIDTH x
+        IMAGE_HEIGHT thumbnail
+        """
+        logger.info("headering")
+        width, height, _, _ = self.tj.decode_header(data)
+        min_factor = min(IMAGE_WIDTH / float(width), IMAGE_HEIGHT / float(height))
+        scaling_factor = (1, 1)
+        for num, denom in sorted(self.tj.scaling_factors, key=lambda f: f[0] / float(f[1])):
+            if ((num / float(denom)) >= min_factor):
+                scaling_factor = (num, denom)
+                break
+        
+        logger.info("decoding at %r", scaling_factor)
+        # BGRX is QImage.Format_RGB32 on little endian
+        arr = self.tj.decode(data, pixel_format=turbojpeg.TJPF_BGRX, scaling_factor=scaling_factor)
+        h, w = arr.shape[:2]
+        image = QImage(arr.data, w, h, arr.strides[0], QImage.Format_RGB32)
+
+        logger.info("exifing")
+        # PIL only parses the header on open, use it to fetch the orientation
+        img = Image.open(StringIO.StringIO(data))
+        angle = pil_exif_rotation(img)
+        img.close()
+
+        # Finish the downscaling here while the image is still wrapping the
+        # decoded buffer so the rotation, the conversion to QPixmap and
+        # qResizePixmap only need to deal with the thumbnail sized image (and
+        # the latter only needs to pad)
+        target_width, target_height = (IMAGE_HEIGHT, IMAGE_WIDTH) if (angle in [90, -90]) else (IMAGE_WIDTH, IMAGE_HEIGHT)
+        if ((w > target_width) or (h > target_height)):
+            logger.info("scaling")
+            image = image.scaled(target_width, target_height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+        if (angle != 0):
+            # PIL angles are counterclockwise, QTransform clockwise
+            image = image.transformed(QTransform().rotate(-angle))
+
+        logger.info("fromimaging")
+        # fromImage copies the data so arr can be freed after this
+        pixmap = self.toThumbnailPixmap(image)
+
+        return pixmap
+        
+    def decode(self, filepath, data, qbuffer, reader):
+        """
+        Decode the image file data into a thumbnail sized QPixmap, padded as
+        necessary, a null QPixmap on error
+        """
+        # XXX On slow connections visible items can be behind stale items, but
+        #     the data is already read at this point so decoding is bounded
+        is_jpeg = ((self.tj is not None) and data.startswith("\xff\xd8\xff"))
+
+        if (is_jpeg):
+            try:
+                pixmap = self.readTurboJpeg(data)
+
+            except Exception as e:
+                # XXX Fall-back to PIL on failure?
+                logger.error("TurboJPEG Error loading %r %s", filepath, e)
+                pixmap = QPixmap()
+
+        elif (use_pil):
+            try:
+                # Note open doesn't load the image need to call .load()
+                # or some other function that causes the load, eg
+                # .thumbnail()
+                
+                # XXX Investigate if the exif information reads the
+                #     whole image or only the header so PIL could be
+                #     used efficiently for exif only and Qt for
+                #     decoding?
+                logger.info("opening")
+                img = Image.open(StringIO.StringIO(data))
+
+                # Get the orientation from the header before the
+                # image is decoded
+                logger.info("exifing")
+                angle = pil_exif_rotation(img)
+
+                # Reduce size before rotating and, more importantly,
+                # before converting to QPixmap, since that seems to take
+                # a very long time and blocks the UI. This puts the PIL
+                # path in comparable time and memory than the Qt path
+
+                # XXX Not clear the above is true wrt speed, it was done
+                #     using a slow source which masks UI blocking
+
+                # XXX Investigate why QPixmap conversion takes a long
+                #     time?
+                # Note thumbnail() already calls draft() so jpegs
+                # are decoded by libjpeg at the smallest DCT scale
+                # that is larger than the thumbnail instead of at
+                # full resolution
+                logger.info("thumbnailing")
+                img.thumbnail((IMAGE_WIDTH, IMAGE_HEIGHT))
+
+                if (angle != 0):
+                    img = img.transpose(PIL_ROTATION_TRANSPOSES[angle])
+
+                logger.info("toqpixmapping")
+                image, pixels = pil_to_qimage(img)
+                pixmap = self.toThumbnailPixmap(image)
+                image = None
+                pixels = None
+                logger.info("closing")
+                img.close()
+                img = None
+            except Exception as e: 
+                # - PIL sometimes errors with broken data stream
+                # IOError: broken data stream when reading image file
+                # - PIL sometimes errors with "unsupported image mode 'CMYK'"
+                # XXX Fall-back to image-reader on failure, at least
+                #     CMYK jpeg is supported there
+                # XXX Merge this with the external exception?
+                logger.error("PIL Error loading %r %s", filepath, e)
+                pixmap = QPixmap()
+
+        elif (use_image_reader):
+            qbuffer.setData(data)
+            # XXX There are known bugs reusing QImageReader, switch
+            #     back to one per request if they show up
+            reader.setDevice(qbuffer)
+            # Use the extension as hint so the right plugin is tried
+            # first, the content is still probed if it fails
+            reader.setFormat(os.path.splitext(filepath)[1][1:].lower())
+            reader.setScaledSize(QSize())
+            # Request the thumbnail size before reading, some image
+            # plugins can decode directly to a smaller size (eg
+            # jpeg uses libjpeg DCT scaling), which is much faster
+            # than decoding full resolution and resizing after
+            size = reader.size()
+            if (size.isValid() and ((size.width() > IMAGE_WIDTH) or (size.height() > IMAGE_HEIGHT))):
+                reader.setScaledSize(size.scaled(IMAGE_WIDTH, IMAGE_HEIGHT, Qt.KeepAspectRatio))
+            logger.info("readering")
+            image = reader.read()
+            logger.info("fromimaging")
+            pixmap = self.toThumbnailPixmap(image)
+            # Don't hold on to these while blocking for requests and
+            # garbage collection. With 10 threads and ~3MB jpegs, this
+            # reduces memory consumption from ~500MB to ~70MB
+            reader.setDevice(None)
+            qbuffer.close()
+            qbuffer.setData("")
+            image = None
+            
+        else:
+            image = QImage()
+            # This seems to cause more UI blocking, UI is less
+            # responsive, probably there's a single QImageReader?
+            image.loadFromData(data)
+            pixmap = self.toThumbnailPixmap(image)
+
+        return pixmap
         
     def run(self):
-        request_queue = self.request_queue
+        decode_queue = self.decode_queue
+        # Recycle the buffer and reader across requests of this thread,
+        # setDevice() resets the reader state
+        qbuffer = QBuffer()
+        reader = QImageReader()
         while (True):
-            # XXX Arguably this should fetch from the end of the queue which has
-            #     the most recent items in case initial items were made stale by
-            #     scrolling away? (but the request queue is cleared in
-            #     receive_pixmap and new requests issued for visible items, so
-            #     most of the time it should only contain non-stale items)
-            data = request_queue.get()
-            if (data is None):
+            # The decode queue is LIFO for the same reasons as the request
+            # queue, see PixmapRetriever
+            request = decode_queue.get()
+            if (request is None):
                 break
-            row, filepath = data
+            generation, row, filepath, data, cache_filepath = request
+            request = None
+            if (generation != self.get_request_generation()):
+                logger.info("Discarding stale request %d %r", row, filepath)
+                continue
             logger.info("%d %r", row, filepath)
-            try:
-                with open(filepath, "rb") as f:
-                    # XXX On slow connections visible items can be behind stale
-                    #     items. read() could chunk and check for a flag stating
-                    #     whether this is a stale item and it should be discarded.
-                    #     But note detecting when an item is stale is not trivial.
-                    if (use_pil):
-                        try:
-                            # Note open doesn't load the image need to call .load()
-                            # or some other function that causes the load, eg
-                            # .thumbnail()
-                            
-                            # XXX Investigate if the exif information reads the
-                            #     whole image or only the header so PIL could be
-                            #     used efficiently for exif only and Qt for
-                            #     decoding?
-                            logger.info("opening")
-                            img = Image.open(f)
-
-                            # Reduce size before rotating and, more importantly,
-                            # before converting to QPixmap, since that seems to take
-                            # a very long time and blocks the UI. This puts the PIL
-                            # path in comparable time and memory than the Qt path
-
-                            # XXX Not clear the above is true wrt speed, it was done
-                            #     using a slow source which masks UI blocking
-
-                            # XXX Investigate why QPixmap conversion takes a long
-                            #     time?
-                            # This takes 7s on remote drives
-                            logger.info("thumbnailing")
-                            img.thumbnail((IMAGE_WIDTH, IMAGE_HEIGHT))
-
-                            logger.info("exifing")
-                            # Not all file formats have exif (eg PNG), guard against
-                            exif_data = img._getexif() if hasattr(img, "_getexif") else None
-                            if (exif_data is not None):
-                                for tag, value in exif_data.items():
-                                    decoded_tag = ExifTags.TAGS.get(tag, tag)
-                                    if (decoded_tag == 'Orientation'):
-                                        logger.info("Found exif orientation %r", value)
-                                        if (value == 3):
-                                            img = img.rotate(180, expand=True)
-                                        elif (value == 6):
-                                            img = img.rotate(-90, expand=True)
-                                        elif (value == 8):
-                                            img = img.rotate(90, expand=True)
-
-                            logger.info("toqpixmapping")
-                            pixmap = ImageQt.toqpixmap(img)
-                            logger.info("closing")
-                            img.close()
-                            img = None
-                        except Exception as e: 
-                            # - PIL sometimes errors with broken data stream
-                            # IOError: broken data stream when reading image file
-                            # - PIL sometimes errors with "unsupported image mode 'CMYK'"
-                            # XXX Fall-back to image-reader on failure, at least
-                            #     CMYK jpeg is supported there
-                            # XXX Merge this with the external exception?
-                            logger.error("PIL Error loading %r %s", filepath, e)
-                            pixmap = QPixmap()
-
-                    elif (use_image_reader):
-                        logger.info("reading")
-                        data = f.read()
-                        buffer = QBuffer()
-                        buffer.setData(data)
-                        # XXX Recycle QImageReaders in this thread? Not clear how
-                        #     slow it is to create on every request and there are
-                        #     known bugs reusing QImageReader
-                        reader = QImageReader(buffer)
-                        logger.info("readering")
-                        image = reader.read()
-                        logger.info("fromimaging")
-                        pixmap = QPixmap.fromImage(image)
-                        # Don't hold on to these while blocking for requests and
-                        # garbage collection. With 10 threads and ~3MB jpegs, this
-                        # reduces memory consumption from ~500MB to ~70MB
-                        reader = None
-                        image = None
-                        data = None
-                        
-                    else:
-                        data = f.read()
-                        pixmap = QPixmap()
-                        # This seems to cause more UI blocking, UI is less
-                        # responsive, probably there's a single QImageReader?
-                        pixmap.loadFromData(data)
-                        data = None
             
-            except Exception as e:
-                # XXX This is normally hit when trying to fetch images for stale
-                #     direntries on the non-stale image directory, fix that case
-                #     since it fills the thumbs with stale error thumgs, but
-                #     still handle exceptions since network could be down, etc
-                logger.error("Open Error loading %r %s", filepath, e)
+            if (data is None):
+                # The retriever failed to read the file
                 pixmap = QPixmap()
 
-            if (not pixmap.isNull()):
-                # XXX Resizing here is good for multithreading, but may want to
-                #     return the full size pixmap, get a size parameter with the
-                #     request?
-                # XXX Also, storing borders is wasted memory in the cache
-                # XXX Skip resizing if it's already the target size
-                #pixmap = pixmap.scaled(IMAGE_WIDTH, IMAGE_HEIGHT, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
-                # XXX This is not needed on the PIL path
-                pixmap = qResizePixmap(pixmap, IMAGE_WIDTH, IMAGE_HEIGHT)
+            elif (cache_filepath is None):
+                # Raw thumbnail from the thumbnail cache, fromImage copies the
+                # data so it can be freed after this
+                image = QImage(data, IMAGE_WIDTH, IMAGE_HEIGHT, IMAGE_WIDTH * 4, QImage.Format_RGB32)
+                pixmap = QPixmap.fromImage(image)
+                image = None
+                data = None
+
+            else:
+                try:
+                    pixmap = self.decode(filepath, data, qbuffer, reader)
+
+                except Exception as e:
+                    logger.error("Error decoding %r %s", filepath, e)
+                    pixmap = QPixmap()
+                data = None
+
+                # Store successful decodes only, so errors are retried next
+                # time. The canvas contains the thumbnail just decoded
+                if (not pixmap.isNull()):
+                    thumbnail_cache_write(cache_filepath, self.canvas)
+
+            # XXX Resizing in decode is good for multithreading, but may want to
+            #     return the full size pixmap, get a size parameter with the
+            #     request?
+            # XXX Also, storing borders is wasted memory in the cache
             logger.info("done with %d %r", row, filepath)
 
             self.pixmapRead.emit(row, filepath, pixmap)
 
+# Sizes of previously calculated subdirectories, indexed by absolute path, with
+# the mtimes of all the directories in that subtree so a later calculation can
+# tell if any entry was added, deleted or renamed
+# XXX Modifying a file in place doesn't update the mtime of its directory, so
+#     this can return a stale size in that case, DirectoryModel.reloadDirectory
+#     with clear_cache clears this cache
+# Each entry can hold the mtimes of thousands of directories, keep few entries
+SUBDIR_SIZE_CACHE_MAX_ENTRIES = 2**8
+g_subdir_size_cache = {}
+def subdir_size_cache_get(dirpath):
+    """
+    Return the cached size of dirpath if none of the directories in the subtree
+    changed since the size was calculated, None otherwise
+
+    This stats all the directories in the subtree, call it from a worker thread
+    since it can take a long time on network drives
+    """
+    entry = g_subdir_size_cache.get(dirpath, None)
+    if (entry is None):
+        return None
+
+    size, dir_mtimes = entry
+    try:
+        # Stating the directories is much cheaper than listing all the files
+        # in the subtree again
+        for subdirpath, mtime in dir_mtimes.iteritems():
+            if (os.stat(subdirpath).st_mtime != mtime):
+                logger.info("Stale cached size for %r due to %r", dirpath, subdirpath)
+                return None
+
+    except OSError:
+        return None
+
+    return size
+
+def subdir_size_cache_put(dirpath, size, dir_mtimes):
+    """
+    Cache the size of dirpath given the mtimes of all the directories in the
+    subtree, which have to be fetched before the subtree is listed
+    """
+    if (len(g_subdir_size_cache) >= SUBDIR_SIZE_CACHE_MAX_ENTRIES):
+        g_subdir_size_cache.clear()
+    g_subdir_size_cache[dirpath] = (size, dir_mtimes)
+
+g_pinned_images = None
+def create_pinned_images():
+    """
+    Create the dict of default images and icons used by DirectoryModel, the
+    keys are prefixed with ":" so they don't collide with filepaths
+    """
+    pinned_images = {}
+    
+    for key, color in [(":error", Qt.red), (":requesting", Qt.yellow), (":requested", Qt.blue), (":purged", Qt.blue)]:
+        pixmap = QPixmap(IMAGE_WIDTH, IMAGE_HEIGHT)
+        pixmap.fill(color)
+        pinned_images[key] = pixmap
+
+    # Each entry is the key, the filename to get the system icon for (None
+    # to use the style icon directly), the style icon, the qGetSystemIcon
+    # flags and whether to also create the IMAGE_WIDTH pixmap for the key 
+    style = qApp.style()
+    for key, filename, standard_pixmap, flags, create_pixmap in [
+        (":directory", "test", QStyle.SP_DirIcon, { "is_dir" : True }, True),
+        (":file_link", ".lnk", QStyle.SP_FileLinkIcon, { "is_link" : True }, True),
+        (":directory_link", "test", QStyle.SP_DirLinkIcon, { "is_dir" : True, "is_link" : True }, True),
+        # XXX SP_FileDialogNewFolder was also tried for this one
+        (":directory_sizing", None, QStyle.SP_BrowserReload, {}, False),
+        (":file_system", ".sys", QStyle.SP_MessageBoxCritical, { "is_system" : True }, True),
+        #dir_icon = qGetSystemIcon("", qApp.style().standardIcon(QStyle.SP_MessageBoxWarning), is_hidden=True)
+        (":file_hidden", None, QStyle.SP_MessageBoxWarning, {}, True),
+        (":file_packed", ".zip", QStyle.SP_DialogOpenButton, {}, True),
+        (":directory_up", None, QStyle.SP_DialogOkButton, {}, True),
+        (":file", None, QStyle.SP_FileIcon, {}, True),
+    ]:
+        icon = style.standardIcon(standard_pixmap)
+        if (filename is not None):
+            icon = qGetSystemIcon(filename, icon, **flags)
+        pinned_images[key + "_icon"] = icon
+        if (create_pixmap):
+            pinned_images[key] = qResizePixmap(icon.pixmap(256, 256), IMAGE_WIDTH, IMAGE_WIDTH)
+
+    return pinned_images
+
+# Roles passed to markDirtyRow, created once instead of on every call
+DECORATION_ROLES = [Qt.DecorationRole]
+SUBDIR_SIZE_ROLES = [Qt.DisplayRole, Qt.UserRole, Qt.DecorationRole]
+
+# Roles DirectoryModel.data returns data for
+DIRECTORY_MODEL_DATA_ROLES = frozenset([Qt.TextAlignmentRole, Qt.EditRole, Qt.ToolTipRole, Qt.DisplayRole, Qt.UserRole, Qt.DecorationRole])
+
 class DirectoryModel(QAbstractTableModel):
     """
     - incremental loading by returning loaded rows from rowCount and
@@ -4459,19 +5668,44 @@ class DirectoryModel(QAbstractTableModel):
     XXX Look into QFileSystemModel
     
     """
+    # Emitted once per event loop iteration after any number of rows were
+    # inserted, removed, moved or reset
+    rowsChanged = pyqtSignal()
+    # Same as rowsChanged but also emitted after data changes
+    contentsChanged = pyqtSignal()
     def __init__(self, page_size=10):
         super(DirectoryModel, self).__init__()
 
         self.page_size = page_size
         self.directoryReader = None
+        # Threads validating cached subdirectory sizes, referenced here until
+        # finished so they are not destroyed while running
+        self.subdir_size_cache_threads = set()
         self.watcher = None
 
         # Create the bare minimum so things don't crash
         self.file_dir = None
         self.loaded_rows = 0
         self.file_infos = []
-        self.dir_infos_set = set()
+        # Filename to row dict for file_infos, built on demand by
+        # findFileInfoRow and invalidated (set to None) whenever rows are
+        # inserted, removed or reordered
+        self.row_by_filename = None
+        # Filenames in file_infos, updated incrementally on inserts and
+        # removals so findFileInfoRow can fail fast without rebuilding
+        # row_by_filename, eg when polled while the directory is being read
+        self.filenames_set = set()
+        # Filenames of the directories in file_infos. Store the filenames
+        # instead of the FileInfos so FileInfo updates (eg directory sizes)
+        # don't need to rehash and update this set
+        self.dir_filenames_set = set()
         self.is_search_string = False
+        # Font metrics and width used for eliding in data() when not using the
+        # delegate, fetched on first use and whenever DISPLAY_WIDTH changes
+        # (it's shared by all the models), see elide_display_width
+        self.elide_font_metrics = None
+        self.elide_width = None
+        self.elide_display_width = None
 
         # Filter string regexp pattern (call re.escape to provide a non-pattern)
         self.filter_string = ""
@@ -4488,6 +5722,60 @@ class DirectoryModel(QAbstractTableModel):
         self.loop_it = True
 
         self.initCache()
+
+        # Rows and roles pending a dataChanged emit. Emitting a dataChanged per
+        # row is slow on bulk updates (directory sizes, pixmap storms),
+        # coalesce them and flush them at most once per timer interval
+        self.dirty_rows = set()
+        self.dirty_roles = set()
+        self.dirty_rows_timer = QTimer()
+        self.dirty_rows_timer.setSingleShot(True)
+        self.dirty_rows_timer.setInterval(16)
+        self.dirty_rows_timer.timeout.connect(self.flushDirtyRows)
+
+        # Thumbnail requests pending submission to the retrievers. data() is
+        # called once per visible cell on every paint, collect the requests of
+        # a whole paint and submit them at once when returning to the event
+        # loop
+        self.pending_requests = []
+        self.pending_requests_timer = QTimer()
+        self.pending_requests_timer.setSingleShot(True)
+        self.pending_requests_timer.setInterval(0)
+        self.pending_requests_timer.timeout.connect(self.flushPendingRequests)
+
+        # Listeners that ignore the signal parameters and only need to know
+        # that something changed use the coalesced rowsChanged and
+        # contentsChanged signals instead, so they are not called once per
+        # emit on bulk updates
+        self.rows_changed_timer = QTimer()
+        self.rows_changed_timer.setSingleShot(True)
+        self.rows_changed_timer.setInterval(0)
+        self.rows_changed_timer.timeout.connect(self.rowsChanged.emit)
+        self.contents_changed_timer = QTimer()
+        self.contents_changed_timer.setSingleShot(True)
+        self.contents_changed_timer.setInterval(0)
+        self.contents_changed_timer.timeout.connect(self.contentsChanged.emit)
+        self.rowsInserted.connect(self.scheduleRowsChanged)
+        self.rowsRemoved.connect(self.scheduleRowsChanged)
+        self.rowsMoved.connect(self.scheduleRowsChanged)
+        self.modelReset.connect(self.scheduleRowsChanged)
+        self.dataChanged.connect(self.scheduleContentsChanged)
+
+        # System icons pending prefetch, by image cache key, see
+        # prefetchExtensionIcons
+        self.pending_icons = collections.OrderedDict()
+        self.pending_icons_timer = QTimer()
+        self.pending_icons_timer.setSingleShot(True)
+        self.pending_icons_timer.setInterval(0)
+        self.pending_icons_timer.timeout.connect(self.prefetchNextExtensionIcon)
+
+        # A single file operation can trigger several watcher notifications (eg
+        # copying a large file), coalesce them into one reload after the
+        # notifications stop for the timer interval
+        self.watcher_reload_timer = QTimer()
+        self.watcher_reload_timer.setSingleShot(True)
+        self.watcher_reload_timer.setInterval(WATCHER_RELOAD_DELAY_MS)
+        self.watcher_reload_timer.timeout.connect(self.reloadWatchedDirectory)
         
         def receive_pixmap(row_hint, filepath, pixmap):
             """
@@ -4520,69 +5808,175 @@ class DirectoryModel(QAbstractTableModel):
                     index = self.createIndex(row, 0) if (row != -1) else QModelIndex()
 
             if (index.isValid()):
-                self.dataChanged.emit(index, index, [Qt.DecorationRole])
+                self.markDirtyRow(index.row(), DECORATION_ROLES)
             
             # Arguably this could skip the cache if the row is no longer valid,
             # but since it did the work of fetching the image, let the cache
             # purging take care of that
             key = filepath
-            self.request_set.remove(key)
+            # The request set is cleared when the request generation changes,
+            # so this may no longer be there
+            self.request_set.discard(key)
             
             if (pixmap.isNull()):
                 logger.error("Error receiving %r", filepath)
-                pixmap = self.image_cache[":error"]
+                pixmap = self.pinned_images[":error"]
                 
             self.cacheImage(key, pixmap)
                 
-            # Empty the request queue to discard stale requests from items no
-            # longer in view. By emitting a datachanged for each discarded item,
-            # the current Qt implementation will ignore the datachanged for
-            # items scrolled out and will re-issue data() calls for items in
-            # view. This is a simple solution to the hard problem of only
-            # servicing requests for items in view, since there's no easy way to
-            # do that, and even less from the model.
-
-            # XXX This has two drawbacks, none of them fatal:
-            #     - Causes redundant calls to data() for the items in view until
-            #       the items in view have been fetched. This is a minor problem.
-            #     - Causes items that are displaying the right image to
-            #       momentarily show the requesting placeholder. This is
-            #       empirically happening, but it's not clear the full reason, in
-            #       theory an item can only be here if there's a request for it,
-            #       and there should only be a request for it if it has the
-            #       requesting placeholder?
-            
-            # XXX Could use a heuristic that only removes requests "away" from
-            #     the last queued request, since that should be the the most
-            #     recent data() call
-
-            try:
-                while (True):
-                    row, filepath = self.request_queue.get_nowait()
-                    key = filepath
-                    logger.info("purging request row %d %r", row, filepath)
-                    assert key in self.request_set
-                    assert key not in self.image_cache
-                    self.request_set.remove(key)
-
-                    # Trigger new requests, ignore stale requests
-                    if ((os.path.dirname(filepath) == self.file_dir) or self.is_search_string):
-                        index = self.createIndex(row, 0)
-                        self.dataChanged.emit(index, index, [Qt.DecorationRole])
-
-                    else:
-                        logger.info("Ignoring purged stale request %r vs. %r", filepath, self.file_dir)
-
-            except Queue.Empty:
-                pass
-            
-        self.request_queue = Queue.Queue()
+        # LIFO so items that were scrolled away don't delay the items in view.
+        # request_set prevents duplicated requests
+        self.request_queue = Queue.LifoQueue()
         self.request_set = set()
-        self.pixmapReaders = [PixmapReader(self.request_queue) for _ in xrange(READING_THREADS)] 
+        # Requests are tagged with the generation at request time, the readers
+        # discard requests from older generations. This invalidates all the
+        # queued requests at once when the directory changes, without having
+        # to drain the queue
+        self.request_generation = 0
+        # Files are read by the retrievers and decoded by the readers, the
+        # decode queue is bounded so retrievers don't read far ahead of the
+        # decoders
+        self.decode_queue = Queue.LifoQueue(DECODE_QUEUE_MAX_ENTRIES)
+        get_request_generation = lambda : self.request_generation
+        # (first, last) visible rows as set by the view, used to cancel the
+        # requests for rows scrolled away. None if unknown, in which case no
+        # request is cancelled
+        self.visible_rows = None
+        get_visible_rows = lambda : self.visible_rows
+        def cancel_request(row, filepath):
+            # Remove from the request set so it's requested again when
+            # visible
+            key = filepath
+            self.request_set.discard(key)
+            # The row could have been scrolled back into view after the
+            # request was cancelled but before this signal was received, in
+            # which case data() saw the key still in the request set and
+            # didn't request it again. Mark the row dirty so the view calls
+            # data() again if the row is visible. This is also the only way
+            # a request can be in flight without being in the request set,
+            # data() and receive_pixmap run in the UI thread so there's no
+            # race between checking and adding to the request set that could
+            # duplicate a request
+            self.markDirtyRow(row, DECORATION_ROLES)
+        self.pixmapRetrievers = [PixmapRetriever(self.request_queue, self.decode_queue, get_request_generation, get_visible_rows) for _ in xrange(RETRIEVING_THREADS)]
+        for pixmapRetriever in self.pixmapRetrievers:
+            pixmapRetriever.requestCancelled.connect(cancel_request)
+            pixmapRetriever.start()
+        self.pixmapReaders = [PixmapReader(self.decode_queue, get_request_generation) for _ in xrange(READING_THREADS)] 
         for pixmapReader in self.pixmapReaders:
             pixmapReader.pixmapRead.connect(receive_pixmap)
             pixmapReader.start()
 
+    def setVisibleRows(self, first, last):
+        """
+        Set the range of rows currently visible in the view, or None if
+        unknown, thumbnail requests far from these rows are cancelled
+        """
+        assert None is logger.debug("%r %r", first, last)
+        # Assign a tuple so the reader threads see both values consistently
+        self.visible_rows = None if ((first is None) or (last is None)) else (first, last)
+
+    def scheduleRowsChanged(self, *args):
+        """
+        Schedule emitting rowsChanged and contentsChanged, ignores the
+        parameters of the signal that triggered it
+        """
+        if (not self.rows_changed_timer.isActive()):
+            self.rows_changed_timer.start()
+        self.scheduleContentsChanged()
+
+    def scheduleContentsChanged(self, *args):
+        """
+        Schedule emitting contentsChanged, ignores the parameters of the signal
+        that triggered it
+        """
+        if (not self.contents_changed_timer.isActive()):
+            self.contents_changed_timer.start()
+
+    def flushPendingRequests(self):
+        """
+        Submit the thumbnail requests collected by data()
+        """
+        logger.info("pending requests %d", len(self.pending_requests))
+        # The request queue is LIFO, reverse so the rows are serviced in the
+        # order they were requested, which is the painting order
+        self.pending_requests.reverse()
+        queue_put_many(self.request_queue, self.pending_requests)
+        self.pending_requests = []
+
+        # Drop the oldest requests so the queue and the request set stay
+        # bounded. Those are normally for rows that were scrolled away, mark the
+        # rows dirty so they are requested again only if they are visible.
+        # Always leave room for all the visible rows, otherwise visible rows
+        # would push each other out on every flush
+        visible_rows = self.visible_rows
+        max_entries = REQUEST_QUEUE_MAX_ENTRIES
+        if (visible_rows is not None):
+            first, last = visible_rows
+            max_entries = max(max_entries, last - first + 1)
+        dropped_requests = queue_trim(self.request_queue, max_entries)
+        if (len(dropped_requests) > 0):
+            logger.info("dropped requests %d", len(dropped_requests))
+        for generation, row, filepath, size, mtime in dropped_requests:
+            if (generation != self.request_generation):
+                continue
+            key = filepath
+            self.request_set.discard(key)
+            if ((visible_rows is None) or (first <= row <= last)):
+                self.markDirtyRow(row, DECORATION_ROLES)
+
+    def markDirtyRow(self, row, roles):
+        """
+        Schedule a dataChanged emit for the given row and roles, see
+        flushDirtyRows
+        """
+        self.dirty_rows.add(row)
+        self.dirty_roles.update(roles)
+        if (not self.dirty_rows_timer.isActive()):
+            self.dirty_rows_timer.start()
+
+    def flushDirtyRows(self):
+        """
+        Emit the pending dataChanged signals, one per run of consecutive dirty
+        rows
+        """
+        logger.info("dirty rows %d", len(self.dirty_rows))
+        # Rows may have been removed since they were marked dirty, ignore those
+        row_count = self.rowCount()
+        rows = [row for row in self.dirty_rows if (row < row_count)]
+        roles = list(self.dirty_roles)
+        self.dirty_rows.clear()
+        self.dirty_roles.clear()
+
+        if (len(rows) == 0):
+            return
+
+        last_column = self.columnCount() - 1
+        # The rows are unique, so if the range spans exactly as many rows as
+        # there are, they are a single run and there's no need to sort or
+        # to look for run boundaries (the common case when sizing all the
+        # subdirectories or receiving thumbnails for the visible rows)
+        min_row = min(rows)
+        max_row = max(rows)
+        if ((max_row - min_row + 1) == len(rows)):
+            assert None is logger.debug("datachanged [%d, %d]", min_row, max_row)
+            self.dataChanged.emit(self.createIndex(min_row, 0), self.createIndex(max_row, last_column), roles)
+            return
+
+        rows.sort()
+        # The rows are known to be valid, use createIndex directly instead of
+        # going through index()
+        createIndex = self.createIndex
+        emit = self.dataChanged.emit
+        start_run = 0
+        for i, row in enumerate(rows):
+            # Spill a run when the next row is not consecutive or this is the
+            # last row
+            if ((i == (len(rows) - 1)) or (rows[i + 1] != row + 1)):
+                assert None is logger.debug("datachanged [%d, %d]", rows[start_run], row)
+                emit(createIndex(rows[start_run], 0), createIndex(row, last_column), roles)
+                start_run = i + 1
+
     def needsExtracting(self):
         # XXX is self.it ever None?
         return ((self.it is not None) and hasattr(self.it, "extract"))
@@ -4592,7 +5986,11 @@ class DirectoryModel(QAbstractTableModel):
         Return the row number for the given filename, -1 if the filename is 
         not in the model
         """
-        return index_of([f.filename for f in self.file_infos], filename)
+        if (filename not in self.filenames_set):
+            return -1
+        if (self.row_by_filename is None):
+            self.row_by_filename = { f.filename : row for row, f in enumerate(self.file_infos) }
+        return self.row_by_filename.get(filename, -1)
 
     def createIterator(self, file_dir_or_search=None, is_search_string=False, recurse=False):
         """
@@ -4794,7 +6192,7 @@ class DirectoryModel(QAbstractTableModel):
             #     fetchMoreIfVisible? (the bugfix is currently only applied when
             #     use_incremental_row_loading but is probably needed whenever a
             #     DirectoryModel can be updated?)
-            if (self.rowCount() < len(self.dir_infos_set)):
+            if (self.rowCount() < len(self.dir_filenames_set)):
                 self.fetchMore(QModelIndex())
             
         if ((self.directoryReader is not None) and self.directoryReader.isRunning()):
@@ -4803,7 +6201,12 @@ class DirectoryModel(QAbstractTableModel):
             # fail to load due to the changed path
             logger.info("Disconnecting signal from old DirectoryReader finished %s running %s", 
                 self.directoryReader.isFinished(), self.directoryReader.isRunning())
-            self.directoryReader.direntryRead.disconnect()
+            # This fails with TypeError when there are no connections (eg
+            # SubdirSizeReader), trap and ignore
+            try:
+                self.directoryReader.direntryRead.disconnect()
+            except TypeError:
+                logger.warn("Unable to disconnect, probably no connections")
             self.directoryReader.abort()
 
         # Batch and deletions are incompatible since, it cannot detect deletions
@@ -4827,23 +6230,68 @@ class DirectoryModel(QAbstractTableModel):
         )
         self.directoryReader.start(single_thread)
 
-    def calculateSubdirSizes(self, subdir_index=QModelIndex()):
+    def calculateSubdirSizes(self, subdir_index=QModelIndex(), use_cache=True):
         """
         - subdir_index is a directory then calculate sizes for that subdir
         - subdir_index is invalid then calculate sizes for all subdirs in the
           table view
         - subdir_index is a file, do nothing
+
+        @param use_cache: reuse the size cached by a previous calculation of
+               the subdir if the subtree didn't change, see
+               subdir_size_cache_get
         """
         logger.info("reading dir")
 
-        # XXX Allow queueing multiple single directory requests?
-        
-        if (subdir_index.isValid()):
-            subdir_fileinfo = self.file_infos[subdir_index.row()]
-            if (not fileinfo_is_dir(self.file_infos[subdir_index.row()])):
-                # This gets called for non-directories, ignore those
+        # XXX Allow queueing multiple single directory requests?
+        
+        if (subdir_index.isValid()):
+            subdir_fileinfo = self.file_infos[subdir_index.row()]
+            if (not fileinfo_is_dir(self.file_infos[subdir_index.row()])):
+                # This gets called for non-directories, ignore those
+                return
+            subdir = subdir_fileinfo.filename
+            
+            # Reuse the size calculated previously if the subtree didn't
+            # change, only for plain filesystem directories. Validating the
+            # cached size stats the whole subtree, do it in a thread and
+            # calculate the size if the cached one is stale
+            dirpath = os.path.join(self.file_dir, subdir)
+            if (use_cache and (not self.is_search_string) and (not self.needsExtracting()) and 
+                (dirpath in g_subdir_size_cache)):
+                file_dir = self.file_dir
+                thread = CallableThread(subdir_size_cache_get, dirpath)
+                def receive_cached_size():
+                    self.subdir_size_cache_threads.discard(thread)
+                    # Ignore if the directory changed in the meantime
+                    row = self.findFileInfoRow(subdir)
+                    if ((self.file_dir != file_dir) or (row == -1)):
+                        return
+                    try:
+                        size = thread.getResult()
+                    
+                    except Exception as e:
+                        logger.error("Error %s", e)
+                        size = None
+
+                    if (size is None):
+                        index = self.index(row, 0)
+                        if (index.isValid()):
+                            self.calculateSubdirSizes(index, False)
+
+                    else:
+                        logger.info("Using cached size %d for %r", size, subdir)
+                        self.file_infos[row] = self.file_infos[row]._replace(size = size)
+                        self.markDirtyRow(row, SUBDIR_SIZE_ROLES)
+
+                # Show the size as being calculated in the meantime
+                self.file_infos[subdir_index.row()] = subdir_fileinfo._replace(size = -1)
+                self.markDirtyRow(subdir_index.row(), SUBDIR_SIZE_ROLES)
+                thread.finished.connect(receive_cached_size)
+                self.subdir_size_cache_threads.add(thread)
+                thread.start()
                 return
-            subdir = subdir_fileinfo.filename
+                    
         else:
             # Search string doesn't have a "parent directory" to list and find
             # subdirectory sizes for, ignore
@@ -4861,28 +6309,17 @@ class DirectoryModel(QAbstractTableModel):
 
         def set_fileinfo_size(row, size):
             assert None is logger.debug("row %d, size %d", row, size)
-            # XXX Remove dir_infos_set completely? use nameddicts so file_info
-            #     can be modified vs. recreated?
-
-            file_info = self.file_infos[row]
-            self.dir_infos_set.remove(file_info)
-            file_info = file_info._replace(size = size)
-            self.dir_infos_set.add(file_info)
+            # XXX Use nameddicts so file_info can be modified vs. recreated?
+            file_info = self.file_infos[row]._replace(size = size)
             self.file_infos[row] = file_info
 
-            index = self.index(row, 3)
-            # XXX This emit is really slow with 10s of directories, coalesce?
-            #     debounce? rate limit?
-            # self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.UserRole, Qt.DecorationRole])
+            self.markDirtyRow(row, SUBDIR_SIZE_ROLES)
             
             return file_info
 
-        current_state = {}
-        current_state["subdir_row"] = None
-        current_state["subdir"] = None
-        # XXX This probably doesn't need a set since directories are sequential
-        #     and should be added only once?
-        dirty_rows = set()
+        # [subdir_row, subdir] of the subdir currently being updated, a list
+        # so it can be modified from inside the local function
+        current_state = [None, None]
         def receive_direntry(dir_infos_set, file_infos):
             # DirIterator issues
             # - recurse sends dot even if nodot is set
@@ -4900,26 +6337,43 @@ class DirectoryModel(QAbstractTableModel):
             #     the search?
             # XXX Calculate one with WCXFileInfoIterator seems to set the parent
             #     size the single subdir, calculate all works
+            # This is called once per batch of entries, hoist the state and
+            # the functions to locals so the per entry loop doesn't do
+            # attribute and dict lookups, and accumulate the size of
+            # consecutive entries of the same subdir in a local, only updating
+            # subdir_sizes when the subdir changes
+            state_subdir_row, state_subdir = current_state
+            state_size = 0
+            findFileInfoRow = self.findFileInfoRow
+            local_os_path_root = os_path_root
+            dir_filenames_set = self.dir_filenames_set
             for file_info in file_infos:
-                if (file_info.filename == ".."):
+                filename = file_info.filename
+                if (filename == ".."):
                     continue
                 #relpath = os.path.relpath(file_info.filename, self.file_dir)
                 # XXX This assumes filename is relative, which won't be for
                 #     search results
                 
                 # Get the subdirectory for this entry, relative to the root, ie
-                # the topmost dir being iterated
-                this_subdir = os_path_root(file_info.filename)
-                # When this_subdir is None, it means this is an entry in the
-                # topmost dir being iterated, which shouldn't be included in the
-                # calculation
-                this_subdir = subdir if (subdir is not None) else this_subdir 
+                # the topmost dir being iterated. When this_subdir is None, it
+                # means this is an entry in the topmost dir being iterated,
+                # which shouldn't be included in the calculation. Also ignore
+                # entries whose subdir is not in the table, there's no row to
+                # update for them
+                if (subdir is not None):
+                    this_subdir = subdir
+
+                else:
+                    this_subdir = local_os_path_root(filename)
+                    if (this_subdir not in dir_filenames_set):
+                        this_subdir = None
                 # Note this will store the current dir size in the None entry
                 # XXX This could update the model incrementally with a negative
                 #     size but this is faster than emitting signals etc and the "?"
                 #     indicator is good enough?
                 if (this_subdir is not None):
-                    if (current_state["subdir"] != this_subdir):
+                    if (state_subdir != this_subdir):
                         # This is the first time this directory is updated,
                         # change icon to being updated and finalize the size for
                         # the subdir previously being updated
@@ -4930,117 +6384,209 @@ class DirectoryModel(QAbstractTableModel):
                         #     order, not in table order, this should find the
                         #     directories and queue them in table order instead
                         #     of recursing at the top?
-                        if (current_state["subdir_row"] is not None):
-                            set_fileinfo_size(current_state["subdir_row"], subdir_sizes[current_state["subdir"]])
-                            current_state["subdir"] = subdir
-                        row = self.findFileInfoRow(this_subdir)
-                        current_state["subdir_row"] = row
-                        current_state["subdir"] = this_subdir
-                        set_fileinfo_size(current_state["subdir_row"], -2)
-
-                        dirty_rows.add(row)
-
-                        if (len(dirty_rows) > 100000):
-                            refresh_rows(list(dirty_rows))
-                            dirty_rows.clear()
-
-                    subdir_sizes[this_subdir] += file_info.size
-
-        def refresh_rows(rows):
-            """
-            Given a list of rows, find runs inside it and emit the minimum
-            number of dataChanged signals
-            """
-            # Most of the time this is called for rows of directories, which are
-            # consecutive and form a single consecutive run, use min and max
-            # instead of run searching. 
-            rows = sorted(rows)
-
-            min_row = rows[0]
-            max_row = rows[-1]
-            if ((max_row - min_row + 1) == len(rows)):
-                start_run= min_row
-                end_run = max_row
-                logger.info("datachanged minmax [%d, %d]", start_run, end_run)
-                index_start = self.index(start_run, 3)
-                index_end = self.index(end_run, 3)
-                self.dataChanged.emit(index_start, index_end, [Qt.DisplayRole, Qt.UserRole, Qt.DecorationRole])
-                return
-            
-            # Set end < start and end != 0 so it starts by recording the start
-            # of the initial run
-            start_run = 0
-            end_run = -1
-            for i, row in enumerate(rows):
-                # Spill a run when non consecutive row is found or if this is
-                # the last row
-                if (row != end_run + 1) or (i == (len(rows) - 1)):
-                    if (end_run >= start_run):
-                        logger.info("datachanged [%d, %d]", start_run, end_run)
-                        index_start = self.index(start_run, 3)
-                        index_end = self.index(end_run, 3)
-                        
-                        self.dataChanged.emit(index_start, index_end, [Qt.DisplayRole, Qt.UserRole, Qt.DecorationRole])
+                        if (state_subdir_row is not None):
+                            subdir_sizes[state_subdir] += state_size
+                            set_fileinfo_size(state_subdir_row, subdir_sizes[state_subdir])
+                        state_size = 0
+                        state_subdir_row = findFileInfoRow(this_subdir)
+                        state_subdir = this_subdir
+                        set_fileinfo_size(state_subdir_row, -2)
 
-                    start_run = row
+                    state_size += file_info.size
 
-                end_run = row
+            if (state_subdir_row is not None):
+                subdir_sizes[state_subdir] += state_size
+            current_state[:] = [state_subdir_row, state_subdir]
 
         def finish_size_calculation():
             assert None is logger.debug("subdir_sizes %s file_infos %s", subdir_sizes, self.file_infos)
-            rows = []
             for key, size in subdir_sizes.iteritems():
                 # Ignore the sum for the current directory stored in [None]
                 if (key is not None):
                     row = self.findFileInfoRow(key)
-                    # XXX This causes an emit that seems to be pretty slow looking
-                    #     at the logs, all the directories should be lumped
-                    #     together, try to coalesce all the emits?
+                    # The dataChanged emits are coalesced by the model, see
+                    # markDirtyRow
                     set_fileinfo_size(row, size)
-                    rows.append(row)
             # XXX Empty directories won't have an entry in subdir_sizes, need to 
             #     clear them, but why no ".." entry in empty directories?
-            refresh_rows(rows)
 
         if ((self.directoryReader is not None) and self.directoryReader.isRunning()):
             # Stop signals from the old thread, they are probably form a
             # previous directory listing and they would to the current grid but
             # fail to load due to the changed path
             logger.info("Disconnecting signal from old DirectoryReader finished %s running %s", self.directoryReader.isFinished(), self.directoryReader.isRunning())
-            self.directoryReader.direntryRead.disconnect()
+            # This fails with TypeError when there are no connections (eg
+            # SubdirSizeReader), trap and ignore
+            try:
+                self.directoryReader.direntryRead.disconnect()
+            except TypeError:
+                logger.warn("Unable to disconnect, probably no connections")
             self.directoryReader.abort()
 
         
-        for row in xrange(self.file_infos):
-            file_info = self.file_infos[row]
-            # Clear all directory sizes but for ".." if subdir is None, only
-            # subdir otherwise
-            if (fileinfo_is_dir(file_info) and (
-                (not subdir_index.isValid() and (file_info.filename != "..")) or (file_info.filename == subdir)
-                )):
-                # Force create entries for all root directories, DirIterator
-                # won't create and then they fail to be reset below
-                subdir_sizes[file_info.filename] = 0
-                # XXX This causes an emit that seems to be pretty slow looking
-                #     at the logs, all the directories should be lumped
-                #     together, try to coalesce all the emits?
-                set_fileinfo_size(row, -1) 
+        # Clear all directory sizes but for ".." if subdir is None, only subdir
+        # otherwise. Force create entries for all root directories, DirIterator
+        # won't create and then they fail to be reset below
+        if (subdir is not None):
+            subdir_sizes[subdir] = 0
+            set_fileinfo_size(subdir_index.row(), -1)
+
+        else:
+            # The directory names are already known from mergeDirEntries, no
+            # need to check every row
+            for filename in self.dir_filenames_set:
+                row = self.findFileInfoRow(filename)
+                if ((filename != "..") and (row != -1)):
+                    subdir_sizes[filename] = 0
+                    set_fileinfo_size(row, -1)
 
         subdir_sizes[None] = 0
 
+        # Only plain filesystem directories are walked concurrently, plugins
+        # and archives are not guaranteed to be thread-safe
+        if ((subdir is None) and isinstance(self.it, (Win32FileInfoIterator, QtFileInfoIterator))):
+            # Walk each subdirectory in its own iterator so they can be walked
+            # concurrently, in table order so sizes tend to appear top to
+            # bottom
+            subdir_its = []
+            for filename in sorted([key for key in subdir_sizes if (key is not None)], key=self.findFileInfoRow):
+                it, loop = self.createIterator(os.path.join(self.file_dir, filename), self.is_search_string, recurse=True)
+                subdir_its.append((filename, it))
+
+            file_dir = self.file_dir
+            subdirSizeReader = SubdirSizeReader(file_dir, subdir_its, 256)
+            finished_subdirs = set()
+            
+            def receive_subdir_size(subdir, size):
+                # Ignore stale signals if the directory changed, the rows
+                # belong to a different directory now. Note the reader can also
+                # be replaced in the same directory (eg reloading or
+                # calculating a single subdir), the sizes are still valid then
+                if (self.file_dir != file_dir):
+                    return
+                subdir_sizes[subdir] = size
+                if (size >= 0):
+                    finished_subdirs.add(subdir)
+                row = self.findFileInfoRow(subdir)
+                if (row != -1):
+                    set_fileinfo_size(row, size)
+
+            def finish_subdir_sizes():
+                if (self.file_dir != file_dir):
+                    return
+                # Clear the sizes of the subdirectories that didn't finish
+                # because of aborting. Only the ones still showing as being
+                # calculated, a later calculation may have set them already
+                for key in subdir_sizes:
+                    if ((key is not None) and (key not in finished_subdirs)):
+                        row = self.findFileInfoRow(key)
+                        if ((row != -1) and (self.file_infos[row].size < 0)):
+                            set_fileinfo_size(row, 0)
+            
+            self.directoryReader = subdirSizeReader
+            self.directoryReader.subdirSizeRead.connect(receive_subdir_size)
+            self.directoryReader.finished.connect(finish_subdir_sizes)
+            self.directoryReader.start(force_single_thread)
+            
+            return
+
         # XXX This gets blocked behind image load, pause image loading while
         #     entries are being read
         dirpath = self.file_dir if subdir is None else os.path.join(self.file_dir, subdir)
+        
+        # When calculating the size of a single plain filesystem subdir, collect
+        # the subtree directories so the size can be cached, see
+        # subdir_size_cache_get. The subdir mtime needs to be fetched before
+        # listing so changes while listing invalidate the cached size
+        subtree_dirpaths = None
+        if ((subdir is not None) and (not self.is_search_string) and (not self.needsExtracting())):
+            subtree_dirpaths = []
+        
         it, loop = self.createIterator(dirpath, self.is_search_string, recurse=True)
-        self.directoryReader = DirectoryReader(dirpath, 100, it=it, loop=loop)
+        # Use large batches, the entries are only accumulated so the per signal
+        # and per call overhead dominates
+        directoryReader = DirectoryReader(dirpath, 256, it=it, loop=loop)
+        self.directoryReader = directoryReader
+        
+        if (subtree_dirpaths is not None):
+            # The subtree directories are collected and stated in the reader
+            # thread (direct connections), stating them can take a long time on
+            # network drives. Note the finished signal is emitted from the
+            # reader thread, and the direct connection is made before the
+            # queued ones below so the mtimes are ready by the time
+            # cache_subdir_size runs
+            # [subdir mtime, dir_mtimes], a list so it can be modified from
+            # inside the local functions
+            subtree_state = [None, None]
+            def stat_subdir():
+                try:
+                    subtree_state[0] = os.stat(dirpath).st_mtime
+
+                except OSError:
+                    pass
+
+            def receive_subtree_direntry(dir_infos_set, file_infos):
+                subtree_dirpaths.extend([file_info.filename for file_info in dir_infos_set])
+
+            def stat_subtree_dirs():
+                # The finished signal is also emitted when aborted, don't cache
+                # partial sizes
+                subdir_mtime = subtree_state[0]
+                if (directoryReader.mustAbort() or (subdir_mtime is None)):
+                    return
+                
+                # XXX The subtree directories are stated after being listed,
+                #     so a change between listing and here goes unnoticed
+                try:
+                    dir_mtimes = { os.path.join(dirpath, filename) : os.stat(os.path.join(dirpath, filename)).st_mtime
+                        for filename in subtree_dirpaths if (os.path.basename(filename) not in [".", ".."]) }
+
+                except OSError:
+                    return
+                dir_mtimes[dirpath] = subdir_mtime
+                subtree_state[1] = dir_mtimes
+
+            def cache_subdir_size():
+                dir_mtimes = subtree_state[1]
+                if (dir_mtimes is not None):
+                    subdir_size_cache_put(dirpath, subdir_sizes[subdir], dir_mtimes)
+                
+            self.directoryReader.started.connect(stat_subdir, Qt.DirectConnection)
+            self.directoryReader.direntryRead.connect(receive_subtree_direntry, Qt.DirectConnection)
+            self.directoryReader.finished.connect(stat_subtree_dirs, Qt.DirectConnection)
+            self.directoryReader.finished.connect(cache_subdir_size)
+
         self.directoryReader.direntryRead.connect(receive_direntry)
         self.directoryReader.finished.connect(finish_size_calculation)
         single_thread = (force_single_thread or (force_wfx_single_thread and isinstance(self.it, WFXFileInfoIterator)))
         self.directoryReader.start(single_thread)
         
+    def reloadWatchedDirectory(self):
+        """
+        Reload the directory after the watcher notifications have settled
+        """
+        if ((self.directoryReader is not None) and self.directoryReader.isRunning()):
+            # Reloading would abort the reader (eg a size calculation), the
+            # reload will pick up any changes once the reader is done, so
+            # retry later
+            logger.info("Delaying watcher reload, reader still running")
+            self.watcher_reload_timer.start()
+            return
+
+        if (getattr(self.it, "extracting", False)):
+            # This was called from the events processed while waiting for an
+            # extraction, don't reload the iterator under the extraction, retry
+            # later
+            logger.info("Delaying watcher reload, extraction in progress")
+            self.watcher_reload_timer.start()
+            return
+
+        self.reloadDirectory()
+
     def reloadDirectory(self, clear_cache=False):
         if (clear_cache):
             self.clearCache()
+            g_subdir_size_cache.clear()
             # Clearing the caches is not enough to refresh the visible items,
             # since Qt may have its own DecorationRole cache, emit a dataChanged
             topleft = self.createIndex(0, 0)
@@ -5067,15 +6613,26 @@ class DirectoryModel(QAbstractTableModel):
         # self.blockSignals(True)
         logger.info("num dirs %d num files %d insert only %s", len(new_dir_infos_set), len(new_file_infos), insert_only)
         #logger.info("%s %s", new_dir_infos_set, new_file_infos)
+        # Walk both sorted lists once recording runs of consecutive removals
+        # and insertions, then apply each run with a single slice operation,
+        # calling list.insert/pop per entry is quadratic on large directories
+        # Runs are (row, removed_count, inserted_fileinfos) where row is the
+        # position in the list after all the previous runs have been applied
+        old_file_infos = self.file_infos
+        runs = []
+        deleted_file_infos = []
+        # (row, old fileinfo, new fileinfo) of the entries that compare equal
+        # but changed, eg modified files when sorting by name. Rows are in the
+        # merged list
+        modified_file_infos = []
+        run_row = -1
+        run_removed = 0
+        run_inserted = []
         i_old = 0
         i_new = 0
-        # XXX This will fail to load the rows if there are less than one screen
-        #     worth of entries in some getFiles codepath, gets fixed if history
-        #     is navigated back and forth or even ctrl+r, so some other path is ok?
-        incremental_loading = use_incremental_row_loading or self.use_incremental_row_loading
-        dummy_inserts = 0
+        i_merged = 0
         while (True):
-            f_old = self.file_infos[i_old] if (i_old < len(self.file_infos)) else None
+            f_old = old_file_infos[i_old] if (i_old < len(old_file_infos)) else None
             f_new = new_file_infos[i_new] if (i_new < len(new_file_infos)) else None
 
             if ((f_old is None) and (f_new is None)):
@@ -5095,40 +6652,74 @@ class DirectoryModel(QAbstractTableModel):
                 # Pick new if old is none, old if new is none, compare if both are not none
                 c = 1 if (f_old is None) else (-1 if (f_new is None) else fileinfo_cmp(f_old, f_new, self.sort_field, self.sort_order == Qt.DescendingOrder))
 
-            if (c == 0):
-                # Matching fileinfos, no need to insert
-                # XXX Update date/attribs if different? Then it will need to
-                #     send a datachanged?
+            if ((c == 0) or ((c == -1) and insert_only)):
+                # Matching fileinfos (or kept because insert only), no need to
+                # insert, close the current run, if any
+                if ((c == 0) and (f_old != f_new)):
+                    assert None is logger.debug("Modified %r", f_new)
+                    modified_file_infos.append((i_merged, f_old, f_new))
+                if (run_row != -1):
+                    runs.append((run_row, run_removed, run_inserted))
+                    run_row = -1
+                    run_removed = 0
+                    run_inserted = []
                 i_old += 1
-                i_new += 1
+                if (c == 0):
+                    i_new += 1
+                i_merged += 1
             
-            elif (c == -1):
-                if (insert_only):
-                    i_old += 1
-
-                else:
+            else:
+                if (run_row == -1):
+                    run_row = i_merged
+                    
+                if (c == -1):
                     # f_old was deleted
                     assert None is logger.debug("Deleted %r", f_old)
-                    # Prevent triggering "Invalid index", only report removal if
-                    # row was loaded, but report if all the rows have been loaded
-                    is_loaded_row = (i_old < self.loaded_rows)
-                    if (is_loaded_row):
-                        self.beginRemoveRows(QModelIndex(), i_old, i_old)
-                    self.file_infos.pop(i_old)
+                    deleted_file_infos.append(f_old)
+                    # Removals precede insertions in the same run, which
+                    # matches the merge order since old entries are only
+                    # deleted when they compare before the new one
+                    if (len(run_inserted) > 0):
+                        runs.append((run_row, run_removed, run_inserted))
+                        run_row = i_merged
+                        run_removed = 0
+                        run_inserted = []
+                    run_removed += 1
+                    i_old += 1
                     
-                    if (is_loaded_row):
-                        self.loaded_rows -= 1
-                        self.endRemoveRows()
-
-                    if (f_old in self.image_cache):
-                        filepath = os.path.join(self.file_dir, f_old)
-                        key = filepath
-                        del self.image_cache[key]
-                        self.lru_image_keys.remove(key)
-            else:
-                # f_new was added
-                assert None is logger.debug("Inserted %r", f_new)
-                
+                else:
+                    # f_new was added
+                    assert None is logger.debug("Inserted %r", f_new)
+                    run_inserted.append(f_new)
+                    i_new += 1
+                    i_merged += 1
+                    
+        if (run_row != -1):
+            runs.append((run_row, run_removed, run_inserted))
+
+        # XXX This will fail to load the rows if there are less than one screen
+        #     worth of entries in some getFiles codepath, gets fixed if history
+        #     is navigated back and forth or even ctrl+r, so some other path is ok?
+        incremental_loading = use_incremental_row_loading or self.use_incremental_row_loading
+        dummy_inserts = 0
+        if (len(runs) > 0):
+            self.row_by_filename = None
+        # Discard before the insertions below, a file can be both deleted and
+        # inserted when its sort key changed
+        self.filenames_set.difference_update([f.filename for f in deleted_file_infos])
+        for row, removed_count, inserted_file_infos in runs:
+            if (removed_count > 0):
+                # Prevent triggering "Invalid index", only report removal of
+                # the rows that were loaded
+                loaded_count = max(0, min(row + removed_count, self.loaded_rows) - row)
+                if (loaded_count > 0):
+                    self.beginRemoveRows(QModelIndex(), row, row + loaded_count - 1)
+                del self.file_infos[row:row + removed_count]
+                if (loaded_count > 0):
+                    self.loaded_rows -= loaded_count
+                    self.endRemoveRows()
+
+            if (len(inserted_file_infos) > 0):
                 # Prevent triggering "Invalid index", only report insertion if
                 # row was loaded, including after the last loaded row, which
                 # takes care of forcing a refresh when file_infos increase
@@ -5138,31 +6729,56 @@ class DirectoryModel(QAbstractTableModel):
                 # row, otherwise incrementing loaded_rows below will defeat
                 # incremental loading
                 is_loaded_row = (
-                    (i_old <= self.loaded_rows) and (
+                    (row <= self.loaded_rows) and (
                         (not incremental_loading)
                     )
                 )
                 dummy_inserts = 1
+                inserted_count = len(inserted_file_infos)
                 if (is_loaded_row):
                     dummy_inserts += 1
-                    self.beginInsertRows(QModelIndex(), i_old, i_old)
-                self.file_infos.insert(i_old, f_new)
+                    self.beginInsertRows(QModelIndex(), row, row + inserted_count - 1)
+                self.file_infos[row:row] = inserted_file_infos
+                self.filenames_set.update([f.filename for f in inserted_file_infos])
                 if (is_loaded_row):
-                    self.loaded_rows += 1
+                    self.loaded_rows += inserted_count
                     self.endInsertRows()
-                
-                # Increment the old index as well as the new, since it has been
-                # inserted in the old list
-                i_new += 1
-                i_old += 1
+
+        # Evict the images of deleted entries
+        for f_old in deleted_file_infos:
+            key = os.path.join(self.file_dir, f_old.filename)
+            self.uncacheImage(key)
+
+        # Update the modified entries in place, once all the runs have been
+        # applied the merged rows match the rows in file_infos
+        for row, f_old, f_new in modified_file_infos:
+            if (fileinfo_is_dir(f_new) and (f_old.size >= 0)):
+                # The listing doesn't have directory sizes, keep the ones
+                # calculated by set_fileinfo_size. Don't keep the negative
+                # sizes of calculations in progress, they would stick if the
+                # calculation is aborted
+                f_new = f_new._replace(size=f_old.size)
+                if (f_new == f_old):
+                    continue
+            self.file_infos[row] = f_new
+            if (f_old.filename != f_new.filename):
+                # Case-only rename
+                self.row_by_filename = None
+                self.filenames_set.discard(f_old.filename)
+                self.filenames_set.add(f_new.filename)
+                self.invalidateThumbnail(os.path.join(self.file_dir, f_old.filename))
+            self.invalidateThumbnail(os.path.join(self.file_dir, f_new.filename))
+            if (row < self.loaded_rows):
+                self.dataChanged.emit(self.createIndex(row, 0), self.createIndex(row, self.columnCount() - 1))
 
         # assert len(self.file_infos) == len(new_file_infos)
         # assert self.file_infos == new_file_infos
         
+        new_dir_filenames_set = set([file_info.filename for file_info in new_dir_infos_set])
         if (insert_only):
-            self.dir_infos_set |= new_dir_infos_set
+            self.dir_filenames_set |= new_dir_filenames_set
         else:
-            self.dir_infos_set = new_dir_infos_set
+            self.dir_filenames_set = new_dir_filenames_set
 
         if (incremental_loading and (dummy_inserts > 0)):
             if (self.canFetchMore(QModelIndex())):
@@ -5192,72 +6808,26 @@ class DirectoryModel(QAbstractTableModel):
         # XXX Should the cache be preserved across directory changes?
         # XXX Should the cache be shared across models?
         # XXX Needs a way to force cache invalidation, eg when reloading the dir?
-        self.image_cache = {}
-        self.lru_image_keys = []
-
-        # Note these special images don't have LRU entries, so they will never
-        # be deleted
-        self.image_cache[":error"] = QPixmap(IMAGE_WIDTH, IMAGE_HEIGHT)
-        self.image_cache[":error"].fill(Qt.red)
-
-        self.image_cache[":requesting"] = QPixmap(IMAGE_WIDTH, IMAGE_HEIGHT)
-        self.image_cache[":requesting"].fill(Qt.yellow)
-
-        self.image_cache[":requested"] = QPixmap(IMAGE_WIDTH, IMAGE_HEIGHT)
-        self.image_cache[":requested"].fill(Qt.blue)
-
-        self.image_cache[":purged"] = QPixmap(IMAGE_WIDTH, IMAGE_HEIGHT)
-        self.image_cache[":purged"].fill(Qt.blue)
-
-        icon = qGetSystemIcon("test", qApp.style().standardIcon(QStyle.SP_DirIcon), is_dir=True)
-        self.image_cache[":directory_icon"] = icon
-        pixmap = qResizePixmap(icon.pixmap(256, 256), IMAGE_WIDTH, IMAGE_WIDTH)
-        self.image_cache[":directory"] = pixmap
-
-        icon = qGetSystemIcon(".lnk", qApp.style().standardIcon(QStyle.SP_FileLinkIcon), is_link = True)
-        self.image_cache[":file_link_icon"] = icon
-        pixmap = qResizePixmap(icon.pixmap(256, 256), IMAGE_WIDTH, IMAGE_WIDTH)
-        self.image_cache[":file_link"] = pixmap
-
-        icon = qGetSystemIcon("test", qApp.style().standardIcon(QStyle.SP_DirLinkIcon), is_dir = True, is_link=True)
-        self.image_cache[":directory_link_icon"] = icon
-        pixmap = qResizePixmap(icon.pixmap(256, 256), IMAGE_WIDTH, IMAGE_WIDTH)
-        self.image_cache[":directory_link"] = pixmap
-
-        icon = qApp.style().standardIcon(QStyle.SP_FileDialogNewFolder)
-        icon = qApp.style().standardIcon(QStyle.SP_BrowserReload)
-        self.image_cache[":directory_sizing_icon"] = icon
-
-        icon = qGetSystemIcon(".sys", qApp.style().standardIcon(QStyle.SP_MessageBoxCritical), is_system=True)
-        self.image_cache[":file_system_icon"] = icon
-        pixmap = qResizePixmap(icon.pixmap(256, 256), IMAGE_WIDTH, IMAGE_WIDTH)
-        self.image_cache[":file_system"] = pixmap
-
-        #dir_icon = qGetSystemIcon("", qApp.style().standardIcon(QStyle.SP_MessageBoxWarning), is_hidden=True)
-        icon = qApp.style().standardIcon(QStyle.SP_MessageBoxWarning)
-        self.image_cache[":file_hidden_icon"] = icon
-        pixmap = qResizePixmap(icon.pixmap(256, 256), IMAGE_WIDTH, IMAGE_WIDTH)
-        self.image_cache[":file_hidden"] = pixmap
-
-        icon = qGetSystemIcon(".zip", qApp.style().standardIcon(QStyle.SP_DialogOpenButton))
-        self.image_cache[":file_packed_icon"] = icon
-        pixmap = qResizePixmap(icon.pixmap(256, 256), IMAGE_WIDTH, IMAGE_WIDTH)
-        self.image_cache[":file_packed"] = pixmap
-
-        icon = qApp.style().standardIcon(QStyle.SP_DialogOkButton)
-        self.image_cache[":directory_up_icon"] = icon
-        pixmap = qResizePixmap(icon.pixmap(256, 256), IMAGE_WIDTH, IMAGE_WIDTH)
-        self.image_cache[":directory_up"] = pixmap
-
-        icon = qApp.style().standardIcon(QStyle.SP_FileIcon)
-        self.image_cache[":file_icon"] = icon
-        pixmap = qResizePixmap(icon.pixmap(256, 256), IMAGE_WIDTH, IMAGE_WIDTH)
-        self.image_cache[":file"] = pixmap
+        # The OrderedDict keeps the insertion order so the least recently used
+        # entries can be evicted with popitem(last=False) instead of
+        # maintaining a parallel list of keys
+        self.image_cache = collections.OrderedDict()
+        # Estimated memory used by the images in image_cache, see
+        # image_cache_entry_bytes
+        self.image_cache_bytes = 0
+
+        # Note these special images are not in the image cache, so they will
+        # never be evicted. They are the same for all the models, create them
+        # once and share them (QPixmap and QIcon are implicitly shared)
+        global g_pinned_images
+        if (g_pinned_images is None):
+            g_pinned_images = create_pinned_images()
+        self.pinned_images = g_pinned_images
 
     def clearCache(self):
-        self.image_cache = { key: entry for key, entry in self.image_cache.iteritems() if key.startswith(":") }
-        # Keep only the default entries
-        self.lru_image_keys = []
+        # The default entries are kept in pinned_images
+        self.image_cache = collections.OrderedDict()
+        self.image_cache_bytes = 0
 
     def setDirectory(self, file_dir, is_search_string=False):
         # XXX This needs to idle the threads
@@ -5277,7 +6847,20 @@ class DirectoryModel(QAbstractTableModel):
         self.use_incremental_row_loading = self.is_search_string or (self.filter_string != "")
         self.loaded_rows = 0
         self.file_infos = []
-        self.dir_infos_set = set()
+        self.row_by_filename = None
+        self.filenames_set = set()
+        self.dir_filenames_set = set()
+        # Pending rows and requests are stale after the reset
+        self.dirty_rows.clear()
+        self.dirty_roles.clear()
+        self.request_generation += 1
+        self.request_set.clear()
+        del self.pending_requests[:]
+        self.pending_icons.clear()
+        self.pending_icons_timer.stop()
+        # Any pending reload is for the previous directory
+        self.watcher_reload_timer.stop()
+        self.visible_rows = None
         if (self.is_search_string):
             logger.info("Not watching search string")
             self.watcher = None
@@ -5295,7 +6878,7 @@ class DirectoryModel(QAbstractTableModel):
             # XXX What if the directory (or file in case of archives) is
             #     removed? or generally if the directory is invalid? Should
             #     setDirectory to the deepest valid path
-            self.watcher.directoryChanged.connect(lambda : self.reloadDirectory())
+            self.watcher.directoryChanged.connect(lambda : self.watcher_reload_timer.start())
             
         # XXX getFiles can fail for eg permission errors, don't set file_dir
         #     until getFiles works and return error or raise
@@ -5307,6 +6890,21 @@ class DirectoryModel(QAbstractTableModel):
         logger.info("%r", search_string)
         self.setDirectory(search_string, True)
 
+    def invalidateThumbnail(self, filepath):
+        """
+        Evict the thumbnail of the given file from the image cache so it's
+        requested again next time it's displayed, eg because the file was
+        modified.
+
+        The on disk thumbnail cache doesn't need invalidating since its key
+        includes the file size and mtime, see thumbnail_cache_filepath
+        """
+        # XXX A request in flight for the old file contents will still put a
+        #     stale thumbnail in the cache when received
+        key = filepath
+        self.uncacheImage(key)
+        self.request_set.discard(key)
+
     def cacheImage(self, key, pixmap):
         """
         Put the image with the given key in the cache, possibliy evicting older
@@ -5317,20 +6915,107 @@ class DirectoryModel(QAbstractTableModel):
         #     perf?
         logger.info("key %s, index %d/%d cached %d %d loaded %d", 
             key, self.findFileInfoRow(key) if key in self.file_infos else -1, len(self.file_infos),
-            len(self.image_cache), len(self.lru_image_keys), 
+            len(self.image_cache), len(self.pinned_images), 
             self.loaded_rows
         )
-        if (len(self.image_cache) > MAX_CACHE_ENTRIES):
-            logger.info("cache_keys %s", self.image_cache.keys())
-            logger.info("lru_image_keys %s", self.lru_image_keys)
-            logger.info("purging cache rows %s", [self.findFileInfoRow(purge_key) for purge_key in self.lru_image_keys[:MAX_CACHE_ENTRIES_WATERMARK]])
-            for purge_key in self.lru_image_keys[:MAX_CACHE_ENTRIES_WATERMARK]:
-                #self.image_cache[purge_key].fill(Qt.blue)
-                del self.image_cache[purge_key]
-            self.lru_image_keys[:] = self.lru_image_keys[MAX_CACHE_ENTRIES_WATERMARK:]
-
-        self.lru_image_keys.append(key)
+        # Re-inserting an existing key doesn't update its position, remove it
+        # first so it becomes the most recently used
+        self.uncacheImage(key)
         self.image_cache[key] = pixmap
+        self.image_cache_bytes += image_cache_entry_bytes(pixmap)
+
+        if (self.image_cache_bytes > MAX_CACHE_BYTES):
+            logger.info("cache_keys %s", self.image_cache.keys())
+            # Don't evict the image just inserted
+            while ((self.image_cache_bytes > MAX_CACHE_BYTES - MAX_CACHE_BYTES_WATERMARK) and (len(self.image_cache) > 1)):
+                purge_key, purge_pixmap = self.image_cache.popitem(last=False)
+                self.image_cache_bytes -= image_cache_entry_bytes(purge_pixmap)
+                logger.info("purging cache row %d", self.findFileInfoRow(purge_key))
+
+    def uncacheImage(self, key):
+        """
+        Remove the image with the given key from the cache, if present
+        """
+        pixmap = self.image_cache.pop(key, None)
+        if (pixmap is not None):
+            self.image_cache_bytes -= image_cache_entry_bytes(pixmap)
+
+    def cacheExtensionIcon(self, filename, icon_key):
+        """
+        Get the system small icon for the extension of filename and cache it
+        with the given key, see file_image_keys
+        """
+        icon = qGetSystemIcon(filename, self.pinned_images[":file_icon"])
+        self.cacheImage(icon_key, icon)
+
+        return icon
+
+    def cacheExtensionPixmap(self, filename, key):
+        """
+        Get the system large icon for the extension of filename as a thumbnail
+        sized pixmap and cache it with the given key, see file_image_keys
+        """
+        icon = qGetSystemIcon(filename, None, False)
+        if (icon is None):
+            pixmap = self.pinned_images[":file"]
+        else:
+            pixmap = qResizePixmap(icon.pixmap(256, 256), IMAGE_WIDTH, IMAGE_WIDTH)
+        self.cacheImage(key, pixmap)
+
+        return pixmap
+
+    def prefetchExtensionIcons(self, file_infos):
+        """
+        Schedule getting the system icons for the extensions in file_infos that
+        are not cached yet, see prefetchNextExtensionIcon
+        """
+        needs_extracting = self.needsExtracting()
+        for file_info in file_infos:
+            if (fileinfo_is_dir(file_info)):
+                continue
+            key, icon_key, is_pinned, is_image = file_image_keys(file_info)
+            if (is_pinned):
+                continue
+            if ((icon_key not in self.image_cache) and (icon_key not in self.pending_icons)):
+                self.pending_icons[icon_key] = (file_info.filename, False)
+            # Image files use thumbnails instead of the pixmap version
+            if (((not is_image) or needs_extracting) and 
+                (key not in self.image_cache) and (key not in self.pending_icons)):
+                self.pending_icons[key] = (file_info.filename, True)
+
+        if ((len(self.pending_icons) > 0) and (not self.pending_icons_timer.isActive())):
+            self.pending_icons_timer.start()
+
+    def prefetchNextExtensionIcon(self):
+        """
+        Get one pending system icon, getting the icons from the shell is slow,
+        get one per event loop iteration so it happens in the idle time between
+        user interactions without blocking the UI
+        """
+        key, (filename, is_pixmap) = self.pending_icons.popitem(last=False)
+        logger.info("prefetching %r", key)
+        # data() could have cached it in the meantime
+        if (key not in self.image_cache):
+            if (is_pixmap):
+                self.cacheExtensionPixmap(filename, key)
+            else:
+                self.cacheExtensionIcon(filename, key)
+
+        if (len(self.pending_icons) > 0):
+            self.pending_icons_timer.start()
+
+    def getCachedImage(self, key):
+        """
+        Return the image with the given key from the cache, making it the most
+        recently used, or None if not cached
+        """
+        # Python 2.7 OrderedDict has no move_to_end, pop and re-insert so cache
+        # hits become the most recently used
+        pixmap = self.image_cache.pop(key, None)
+        if (pixmap is not None):
+            self.image_cache[key] = pixmap
+
+        return pixmap
 
     def headerData(self, section, orientation, role=Qt.DisplayRole):
         logger.debug("section %d orientation %d role %d", section, orientation, role)
@@ -5384,24 +7069,33 @@ class DirectoryModel(QAbstractTableModel):
         2025-09-18 11:55:15,917 INFO:twin.py(1562):[13680] data: index 0,2 role DisplayRole
 
         """
-        if (not index.isValid() or (index.row() >= self.rowCount())):
+        # Most of the calls are for roles not handled below (see above), filter
+        # them out with a single set lookup before doing any other work
+        if (role not in DIRECTORY_MODEL_DATA_ROLES):
+            return None
+            
+        if (not index.isValid()):
+            return None
+        
+        row = index.row()
+        column = index.column()
+        if (row >= self.rowCount()):
             return None
-        assert None is logger.debug("index %d,%d role %s", index.row(), index.column(), EnumString(Qt, Qt.ItemDataRole(role)))
+        assert None is logger.debug("index %d,%d role %s", row, column, EnumString(Qt, Qt.ItemDataRole(role)))
 
-        file_info = self.file_infos[index.row()]
+        if ((column > 1) and (role == Qt.DecorationRole)):
+            return None
 
-        if (index.column() > 1):
-            if (role == Qt.DecorationRole):
-                return None
+        file_info = self.file_infos[row]
 
         if (role == Qt.TextAlignmentRole):
             # Align filename, extension to the left, size to the right
-            if ((index.column() == 2) and (fileinfo_is_dir(file_info))):
+            if ((column == 2) and (fileinfo_is_dir(file_info))):
                 # On directories extension (column 2) and size (column 3) are
                 # joined and only the first is requested, align "<DIR>" and
                 # directory size to the right
                 return Qt.AlignRight
-            elif (index.column() == 3):
+            elif (column == 3):
                 return Qt.AlignRight
             
 
@@ -5429,14 +7123,14 @@ class DirectoryModel(QAbstractTableModel):
             if (is_dir):
                 t = "[%s]" % t
                 
-            if (index.column() == 0):
+            if (column == 0):
                 pass
 
-            elif (index.column() == 1):
+            elif (column == 1):
                 if (not is_dir):
                     t = os.path.splitext(t)[0]
             
-            elif (index.column() == 2):
+            elif (column == 2):
                 if (is_dir):
                     # Directory sizes span the extension and size columns and
                     # the data is associated to the extension
@@ -5452,13 +7146,13 @@ class DirectoryModel(QAbstractTableModel):
                     elif (file_info.size == 0):
                         t = "<DIR>"
                     else: 
-                        t = QLocale().toString(file_info.size)
+                        t = size_to_string(file_info.size)
                     # t = "12345678901234567890"
 
                 else:
                     t = os.path.splitext(t)[1]
 
-            elif (index.column() == 3):
+            elif (column == 3):
                 if (is_dir):
                     # XXX Looks like this is taking some space in the spanned column, investigate?
                     # XXX Make sure this doesn't break code that relies on size being 3
@@ -5469,19 +7163,17 @@ class DirectoryModel(QAbstractTableModel):
 
                 else:
                     size = file_info.size
-                    t = QLocale().toString(size)
+                    t = size_to_string(size)
 
-            elif (index.column() == 4):
+            elif (column == 4):
                 # XXX Fix UTC?
                 try:
-                    t = datetime.datetime.fromtimestamp(file_info.mtime)
-                    # XXX Get this from locale
-                    t = t.strftime("%Y-%m-%d %H:%M:%S")
+                    t = mtime_to_string(file_info.mtime)
                 except ValueError:
                     logger.error("Bad mtime %d", file_info.mtime)
                     t = "1980-01-01 00:00:00"
                 
-            elif (index.column() == 5):
+            elif (column == 5):
                 t = "-%s-%s"  % ("r" if (not fileinfo_is_writable(file_info)) else "-", "h" if fileinfo_is_hidden(file_info) else "-")
             
             # Cap the length so they are guaranteed to have uniform sizes
@@ -5490,9 +7182,16 @@ class DirectoryModel(QAbstractTableModel):
             # Getting this wrong over DISPLAY_WITH causes layout issues when
             # enabling uniformsizes
             if (not use_delegate):
-                main_window = qFindMainWindow()
+                # Finding the main window, the font metrics and the style metric
+                # is expensive to do for every cell, cache them
+                # XXX This doesn't track font or style changes
+                if ((self.elide_font_metrics is None) or (self.elide_display_width != DISPLAY_WIDTH)):
+                    main_window = qFindMainWindow()
+                    self.elide_font_metrics = main_window.list_view.fontMetrics()
+                    self.elide_width = DISPLAY_WIDTH - 2 * qApp.style().pixelMetric(QStyle.PM_FocusFrameHMargin)
+                    self.elide_display_width = DISPLAY_WIDTH
                 # t = main_window.list_view.fontMetrics().elidedText(t, Qt.ElideMiddle, DISPLAY_WIDTH - 50)
-                t = main_window.list_view.fontMetrics().elidedText(t, Qt.ElideMiddle, DISPLAY_WIDTH - 2 * qApp.style().pixelMetric(QStyle.PM_FocusFrameHMargin))
+                t = self.elide_font_metrics.elidedText(t, Qt.ElideMiddle, self.elide_width)
                 # t = str(index.row())
 
             return t
@@ -5502,95 +7201,71 @@ class DirectoryModel(QAbstractTableModel):
         
         elif (role == Qt.DecorationRole):
             file_name = file_info.filename
-            filepath = os.path.join(self.file_dir, file_name)
-            key = filepath
             is_dir = fileinfo_is_dir(file_info)
+            if (not is_dir):
+                key, icon_key, is_pinned, is_image = file_image_keys(file_info)
 
-            if (index.column() == 1):
+            if (column == 1):
                 # Use the small icons so they fit and get transparency, don't
                 # use pixmaps, which are opaque. Don't bother using thumbnails
                 # since they are too small
                 if (is_dir):
                     if (file_info.size == -2):
                         # Size being calculated
-                        return self.image_cache[":directory_sizing_icon"]
+                        return self.pinned_images[":directory_sizing_icon"]
 
                     elif (file_name == ".."):
-                        return self.image_cache[":directory_up_icon"]
+                        return self.pinned_images[":directory_up_icon"]
 
                     elif (fileinfo_is_link(file_info)):
-                        return self.image_cache[":directory_link_icon"]
+                        return self.pinned_images[":directory_link_icon"]
 
                     else:
-                        return self.image_cache[":directory_icon"]
+                        return self.pinned_images[":directory_icon"]
 
-                else:
-                    if (fileinfo_is_link(file_info)):
-                        return self.image_cache[":file_link_icon"]
-                        
-                    elif (fileinfo_is_hidden(file_info)):
-                        return self.image_cache[":file_hidden_icon"]
+                elif (is_pinned):
+                    return self.pinned_images[icon_key]
 
-                    elif (not fileinfo_is_writable(file_info)):
-                        return self.image_cache[":file_system_icon"]
-                    
-                    elif (fileinfo_is_packed(file_info)):
-                        return self.image_cache[":file_packed_icon"]
-                    
-                    else:
-                        ext = os.path.splitext(file_info.filename)[1]
-                        key = ":%s_icon" % ext
-                        icon = self.image_cache.get(key, None)
-                        if (icon is None):
-                            icon = qGetSystemIcon(file_info.filename, self.image_cache[":file_icon"])
-                            self.cacheImage(key, icon)
-                        return icon
+                else:
+                    icon = self.getCachedImage(icon_key)
+                    if (icon is None):
+                        icon = self.cacheExtensionIcon(file_info.filename, icon_key)
+                    return icon
 
             if (is_dir):
                 if (file_name == ".."):
-                    pixmap = self.image_cache[":directory_up"]
+                    pixmap = self.pinned_images[":directory_up"]
                 elif (fileinfo_is_link(file_info)):
-                    pixmap = self.image_cache[":directory_link"]
+                    pixmap = self.pinned_images[":directory_link"]
                 else:
-                    pixmap = self.image_cache[":directory"]
+                    pixmap = self.pinned_images[":directory"]
 
-            elif ((not file_name.lower().endswith(IMAGE_EXTENSIONS)) or 
+            elif ((not is_image) or 
                 # XXX Don't do thumbnails inside packed archives for now, implement?
                 self.needsExtracting()):
-                # XXX This is similar to the _icon above but it uses the pixmap
-                #     versions which pixmaps and properly scaled, refactor?
-                if (fileinfo_is_link(file_info)):
-                    pixmap = self.image_cache[":file_link"]
-                elif (fileinfo_is_hidden(file_info)):
-                    pixmap = QPixmap(self.image_cache[":file_hidden"])
-
-                elif (not fileinfo_is_writable(file_info)):
-                    pixmap = QPixmap(self.image_cache[":file_system"])
-                
-                elif (fileinfo_is_packed(file_info)):
-                    pixmap = QPixmap(self.image_cache[":file_packed"])
+                # Same keys as the icons above but using the pixmap versions,
+                # which are properly scaled
+                if (is_pinned):
+                    pixmap = self.pinned_images[key]
                 
                 else:
-                    ext = os.path.splitext(file_info.filename)[1]
-                    key = ":%s" % ext
-                    pixmap = self.image_cache.get(key, None)
+                    pixmap = self.getCachedImage(key)
                     if (pixmap is None):
-                        icon = qGetSystemIcon(file_info.filename, None, False)
-                        if (icon is None):
-                            pixmap = self.image_cache[":file"]
-                        else:
-                            pixmap = qResizePixmap(icon.pixmap(256, 256), IMAGE_WIDTH, IMAGE_WIDTH)
-                        self.cacheImage(key, pixmap)
+                        pixmap = self.cacheExtensionPixmap(file_info.filename, key)
             else:
-                # pixmap = self.image_cache[":requesting"]
-                pixmap = self.image_cache.get(key, None)
+                # Only thumbnails need the filepath, don't build it for the
+                # other cases since this is called on every repaint
+                filepath = os.path.join(self.file_dir, file_name)
+                key = filepath
+                # pixmap = self.pinned_images[":requesting"]
+                pixmap = self.getCachedImage(key)
 
             # Only load the image if it is not cached
             if (pixmap is None):
                 if (True) and False:
                     pixmap = QPixmap(os.path.join(self.file_dir, file_name))
                     if (pixmap.isNull()):
-                        pixmap = self.image_cache[":error"]
+                        pixmap = self.pinned_images[":error"]
                         
                     else:
                         pixmap = pixmap.scaled(IMAGE_WIDTH, IMAGE_HEIGHT, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
@@ -5598,17 +7273,19 @@ class DirectoryModel(QAbstractTableModel):
                     self.cacheImage(file_name, pixmap)
                 else:
                     if (key not in self.request_set):
-                        pixmap = self.image_cache[":requesting"]
-                        logger.debug("requesting index %d %r ", index.row(), key)
+                        pixmap = self.pinned_images[":requesting"]
+                        logger.debug("requesting index %d %r ", row, key)
                         self.request_set.add(key)
-                        self.request_queue.put((index.row(), filepath))
+                        self.pending_requests.append((self.request_generation, row, filepath, file_info.size, file_info.mtime))
+                        if (not self.pending_requests_timer.isActive()):
+                            self.pending_requests_timer.start()
                     
                     else:
-                        #pixmap = self.image_cache[":requested"]
-                        pixmap = self.image_cache[":requesting"]
-                        logger.info("ignoring already requested index %d %r", index.row(), file_name)
+                        #pixmap = self.pinned_images[":requested"]
+                        pixmap = self.pinned_images[":requesting"]
+                        logger.info("ignoring already requested index %d %r", row, file_name)
                 
-            if (index.column() == 0):
+            if (column == 0):
                 if (DISPLAY_HEIGHT != pixmap.height()) and False:
                     pixmap = qResizePixmap(pixmap, DISPLAY_WIDTH, DISPLAY_HEIGHT)
             else:
@@ -5635,11 +7312,17 @@ class DirectoryModel(QAbstractTableModel):
     
     def canFetchMore(self, index):
         """ Return True if there are more rows to load """
-        logger.info("loaded_rows %d file_infos %d dir_infos_set %d page_size %d", self.loaded_rows, len(self.file_infos), len(self.dir_infos_set), self.page_size)
+        logger.info("loaded_rows %d file_infos %d dir_filenames_set %d page_size %d", self.loaded_rows, len(self.file_infos), len(self.dir_filenames_set), self.page_size)
         return ((self.rowCount() < len(self.file_infos)) or ((self.it is not None) and (not self.it.isDone())))
 
-    def fetchMore(self, index):
-        """ Load more rows when the user scrolls to the end """
+    def fetchMore(self, index, min_rows=0):
+        """
+        Load more rows when the user scrolls to the end
+
+        @param min_rows: load at least this many rows (if available) in a
+               single beginInsertRows/endInsertRows, instead of requiring one
+               fetchMore call per page
+        """
         logger.info("loaded_rows before %d total %d", self.loaded_rows, len(self.file_infos))
         if (self.canFetchMore(QModelIndex())):
             if (self.rowCount() < len(self.file_infos)):
@@ -5652,14 +7335,21 @@ class DirectoryModel(QAbstractTableModel):
                     #     rightmost items.
                 
                     # Always load the directories
-                    next_loaded_rows = min(max(self.loaded_rows, len(self.dir_infos_set)) + self.page_size - (self.loaded_rows % self.page_size), len(self.file_infos))
+                    next_loaded_rows = max(self.loaded_rows, len(self.dir_filenames_set)) + self.page_size - (self.loaded_rows % self.page_size)
+                    # Round up min_rows to the page size, see above
+                    next_loaded_rows = max(next_loaded_rows, ((min_rows + self.page_size - 1) // self.page_size) * self.page_size)
+                    next_loaded_rows = min(next_loaded_rows, len(self.file_infos))
                 else:
                     next_loaded_rows = len(self.file_infos)
 
                 self.beginInsertRows(index, self.loaded_rows, next_loaded_rows - 1)
+                prev_loaded_rows = self.loaded_rows
                 self.loaded_rows = next_loaded_rows
                 self.endInsertRows()
                 logger.info("loaded_rows after %d", self.loaded_rows)
+                # Get the icons of the new rows ahead of them being scrolled
+                # into view
+                self.prefetchExtensionIcons(self.file_infos[prev_loaded_rows:next_loaded_rows])
             elif ((self.it is not None) and (not self.it.isDone()) and (not self.directoryReader.isRunning())):
                 self.getFiles(True, create_it = False)
         
@@ -5698,21 +7388,25 @@ class DirectoryModel(QAbstractTableModel):
             # selection model)
             
             persistent_indices = self.persistentIndexList()
-            logger.info("Building before sort %d persistent index mapping", len(persistent_indices))
-            row_mapping = {i: row for i, row in enumerate(self.file_infos)}
 
-            sort_fileinfos(self.file_infos, self.sort_field, self.sort_order)
+            old_rows = sort_fileinfos(self.file_infos, self.sort_field, self.sort_order)
+            self.row_by_filename = None
             
-            logger.info("Building after sort %d persistent index mapping", len(self.file_infos))
-            new_order = {id(row): i for i, row in enumerate(self.file_infos)}
-
-            # Rebuild persistent indexes
-            logger.info("Rebuilding %d persistent indices", len(persistent_indices))
-            for idx in persistent_indices:
-                old_row = idx.row()
-                new_row = new_order[id(row_mapping[old_row])]
-                idx_internal = self.index(new_row, idx.column())
-                self.changePersistentIndex(idx, idx_internal)
+            if (len(persistent_indices) > 0):
+                # Invert the permutation, sorting the new rows by their old row
+                # is done at C speed vs. a Python loop over all the rows
+                logger.info("Building %d persistent index mapping", len(self.file_infos))
+                new_rows = sorted(xrange(old_rows), key=old_rows.__getitem__)
+
+                # Rebuild persistent indexes, changing them all in a single
+                # call is faster than one call per index
+                logger.info("Rebuilding %d persistent indices", len(persistent_indices))
+                # Use index() instead of createIndex() so rows sorted past
+                # loaded_rows (incremental loading) map to invalid indices
+                # instead of indices beyond rowCount()
+                index = self.index
+                new_indices = [index(new_rows[idx.row()], idx.column()) for idx in persistent_indices]
+                self.changePersistentIndexList(persistent_indices, new_indices)
             
             # XXX The currentitem index is still valid, but the view is now showing
             #     the old position (pressing cursors will bring the new index into
@@ -5763,7 +7457,7 @@ class FixedWidthStyle(QCommonStyle):
             # Adjust the rect using the growth value, expanding equally
             rect.adjust(-growth // 2, -growth // 2, growth // 2, growth // 2)
             
-            option.icon = QIcon(qResizePixmap(option.icon.pixmap(target_width, target_height), target_width, target_height))
+            option.icon = qScaledIcon(option.icon, target_width, target_height)
             # option.icon = QIcon(option.icon.pixmap(target_width, target_height))
 
         return rect
@@ -5804,6 +7498,9 @@ class ScaledIconDelegate(QStyledItemDelegate):
         super(ScaledIconDelegate, self).__init__(*args, **kwargs)
         # Requested width
         self.width = None
+        # Requested width as decoration size, so paint doesn't create a QSize
+        # per cell
+        self.decoration_size = None
         # Cached size
         self.size = None
         
@@ -5816,13 +7513,24 @@ class ScaledIconDelegate(QStyledItemDelegate):
         # QStyleOptionViewItem opt = option;    
         opt = QStyleOptionViewItem(option)
         # initStyleOption(&opt, index);
-        self.initStyleOption(opt, index)
-
-        # Override the calculated option icon and decorationSize with the scaled
-        # one
+        # initStyleOption is a hotspot since it calls data() for every role
+        # (font, alignment, brushes, check state...), but DirectoryModel only
+        # provides display and decoration roles for the list view, set those
+        # directly on top of the view's options
+        opt.index = index
+        text = index.data(Qt.DisplayRole)
+        if (text is not None):
+            opt.features |= QStyleOptionViewItem.HasDisplay
+            opt.text = text
+        opt.features |= QStyleOptionViewItem.HasDecoration
+
+        # Set the option icon and decorationSize with the scaled one. This is
+        # called on every paint, only use the slower smooth scaling on selected
+        # items
         pixmap = index.data(Qt.DecorationRole)
-        opt.icon = QIcon(qResizePixmap(pixmap, self.size.width(), self.size.height()))
-        opt.decorationSize = QSize(self.width, self.width)
+        smooth = ((option.state & QStyle.State_Selected) != 0)
+        opt.icon = qScaledIcon(pixmap, self.size.width(), self.size.height(), smooth)
+        opt.decorationSize = self.decoration_size
         
         #const QWidget *widget = QStyledItemDelegatePrivate::widget(option);
         #QStyle *style = widget ? widget->style() : QApplication::style();
@@ -5839,6 +7547,7 @@ class ScaledIconDelegate(QStyledItemDelegate):
         logger.info("%d", width)
         # Set the new requested width
         self.width = width
+        self.decoration_size = QSize(width, width)
         # Invalidate the cached size
         self.size = None
 
@@ -5919,12 +7628,37 @@ class CurrentRowHighlightDelegate(QStyledItemDelegate):
     """
     def __init__(self, selection_model, *args, **kwargs):
         super(CurrentRowHighlightDelegate, self).__init__(*args, **kwargs)
+        # Brushes for the highlighted cells, created once instead of per cell
+        # XXX This could use Q_PROPERTY defined in the stylesheet?
+        self.focused_brush = QBrush(QColor("#cceeff"))
+        self.unfocused_brush = QBrush(Qt.white)
+        self.highlighted_text_color = QColor(Qt.red)
         
-        def currentChanged(current, previous):
-            logger.info("")
-            
-            # Force redraw of the table
-            self.parent().scheduleDelayedItemsLayout()
+        self.selection_model = None
+        self.setSelectionModel(selection_model)
+
+    def currentChanged(self, current, previous):
+        logger.info("")
+        
+        # Force redraw of the table
+        self.parent().scheduleDelayedItemsLayout()
+
+    def setSelectionModel(self, selection_model):
+        """
+        Track the current row of a different selection model, this allows
+        reusing the delegate when the view's models are swapped instead of
+        creating a new one
+        """
+        logger.info("")
+        if (selection_model is self.selection_model):
+            return
+        if (self.selection_model is not None):
+            try:
+                self.selection_model.currentChanged.disconnect(self.currentChanged)
+            except (TypeError, RuntimeError) as e:
+                # Already disconnected or the old selection model was deleted
+                logger.warning("Unable to disconnect selection model %s", e)
+        self.selection_model = selection_model
 
         # Qt by default only highlights the current cell, in order to extend the
         # highlight to the whole row, it's necessary to invalidate all the cells
@@ -5942,14 +7676,18 @@ class CurrentRowHighlightDelegate(QStyledItemDelegate):
 
         # Note this also triggers when the view loses/gains focus, which is
         # necessary to remove the highlight at that time
-        selection_model.currentChanged.connect(currentChanged)
+        selection_model.currentChanged.connect(self.currentChanged)
         
     def paint(self, painter, option, index):
         # See https://github.com/qt/qtbase/blob/5.3/src/widgets/itemviews/qstyleditemdelegate.cpp#L440
         
         view = option.widget
+        # Note the current row can't be cached from currentChanged, since the
+        # current index moves without that signal on sorts and model resets
+        row = index.row()
+        current_row = view.currentIndex().row()
         if (
-            ((index.row() != view.currentIndex().row()) and 
+            ((row != current_row) and 
             # Would like to use the fast path for selected items too, but
             # setting a selected item style (focused or not) in the stylesheet
             # causes the backgroundbrush and palette brush below to be
@@ -5975,19 +7713,18 @@ class CurrentRowHighlightDelegate(QStyledItemDelegate):
         # Note there's no need to check if the widget is focused for the
         # selected color since the selected color doesn't change when focus is
         # lost
-        if (index.row() == view.currentIndex().row()) and (view.hasFocus()):
+        if ((row == current_row) and view.hasFocus()):
             # drawControl QStyle.CE_ItenViewITem sometimes uses backgroundBrush
             # and sometimes the palette brush, set both
-            # XXX This could use Q_PROPERTY defined in the stylesheet?
-            opt.backgroundBrush = QBrush(QColor("#cceeff"))
-            opt.palette.setBrush(QPalette.Highlight, QColor("#cceeff"))
+            opt.backgroundBrush = self.focused_brush
+            opt.palette.setBrush(QPalette.Highlight, self.focused_brush)
             # Remove State_HasFocus so the focus rectangle is not drawn
             opt.state = opt.state & ~QStyle.State_HasFocus
 
         else:
-            opt.palette.setBrush(QPalette.Highlight, Qt.white)
+            opt.palette.setBrush(QPalette.Highlight, self.unfocused_brush)
 
-        opt.palette.setColor(QPalette.HighlightedText, Qt.red)
+        opt.palette.setColor(QPalette.HighlightedText, self.highlighted_text_color)
         
         #const QWidget *widget = QStyledItemDelegatePrivate::widget(option);
         #QStyle *style = widget ? widget->style() : QApplication::style();
@@ -6060,6 +7797,9 @@ class FilePane(QWidget):
         self.old_file_dir = os.getcwd()
 
         self.search_string = ""
+        # Last text emitted in directoryLabelChanged, used to skip redundant
+        # emits (and tab title updates) when only the summary changed
+        self.last_label_text = None
         self.search_string_display_ms = SEARCH_STRING_DISPLAY_TIME_MS
         self.search_string_timer = QTimer()
         self.search_string_timer.setSingleShot(True)
@@ -6096,6 +7836,14 @@ class FilePane(QWidget):
         #     which need to update these, think about the right way of structuring
         #     this
         self.disk_info_label = QLabel("C:\ 0000 k of 00000 k free")
+        # The disk info is refreshed in a thread when the directory changes and
+        # periodically, see refreshDiskInfo
+        self.disk_info_dir = None
+        self.disk_info_thread = None
+        self.disk_info_timer = QTimer()
+        self.disk_info_timer.setInterval(DISK_INFO_REFRESH_MS)
+        self.disk_info_timer.timeout.connect(self.refreshDiskInfo)
+        # The timer only runs while the pane is visible, see showEvent
         self.summary_label = QLabel("0k / 0k in 0 / 0 files, 0 / 0 dirs")
         # Without elision the window won't resize below the label's width
         self.directory_label = ElidableLabel(self.file_dir)
@@ -6120,6 +7868,10 @@ class FilePane(QWidget):
             self.list_view.setItemDelegate(delegate)
             self.list_view.setSpacing(10)
             self.list_view.setTextElideMode(Qt.ElideMiddle)
+            # The delegate's size is fixed by design, so uniform sizes are
+            # safe here too, and prevent the layout from calling the Python
+            # sizeHint once per row
+            self.list_view.setUniformItemSizes(True)
         else:
             # UniformItemSizes requires text to be either wrapped or elided, so
             # the size remains constant no matter the text length, but wrapping
@@ -6155,17 +7907,29 @@ class FilePane(QWidget):
         # This causes relayout on resize, the other option is to
         # self.model.layoutChanged.emit() from the app's resizeEvent
         self.list_view.setResizeMode(QListView.Adjust)
+        # Lay out big directories in batches, processing events in between,
+        # instead of blocking the UI until all the items are laid out
+        self.list_view.setLayoutMode(QListView.Batched)
+        self.list_view.setBatchSize(LIST_VIEW_LAYOUT_BATCH_SIZE)
         self.list_view.activated.connect(self.itemActivated)
 
+        # Keep the model informed of the visible rows so it can cancel
+        # thumbnail requests of rows scrolled away, the range changes on
+        # resize and when rows are inserted
+        for view in [self.list_view, self.table_view]:
+            view.verticalScrollBar().valueChanged.connect(lambda value: self.updateVisibleRows())
+            view.verticalScrollBar().rangeChanged.connect(lambda min_value, max_value: self.updateVisibleRows())
+
         # Don't bold headers when there are rows selected
         self.table_view.horizontalHeader().setHighlightSections(False)
         # Make the Name column take all remaining horizontal space, the others
         # to be as small as possible
         # XXX This needs to be done on very load because the current contents of
         #     the table are the headers, which are too small for some fields
-        self.table_view.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
-        for i in xrange(4):
-            self.table_view.horizontalHeader().setSectionResizeMode(i + 2, QHeaderView.ResizeToContents)
+        self.setupHeaderSections()
+        # Size the columns to contents looking at the visible rows plus a
+        # sample of the others, instead of the default 1000 rows
+        self.table_view.horizontalHeader().setResizeContentsPrecision(TABLE_RESIZE_CONTENTS_PRECISION)
         
         # setSortingEnabled and sortByColumn below cause a double call to sort
         # but here doesn't seem to be a way of avoding it
@@ -6177,6 +7941,9 @@ class FilePane(QWidget):
         self.table_view.verticalHeader().setVisible(False)
         # Shrink the row height to roughly font height
         self.table_view.verticalHeader().setDefaultSectionSize(self.table_view.fontMetrics().height() + 6)
+        # All the rows have the same height, fix it so the view never needs to
+        # query the row size hints
+        self.table_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         # Don't display the big thumbnail column
         self.table_view.hideColumn(0)
         self.table_view.setIconSize(QSize(16, 16))
@@ -6234,27 +8001,35 @@ class FilePane(QWidget):
         self.table_view.setSelectionMode(QAbstractItemView.MultiSelection)
         self.table_view.setSelectionBehavior(QAbstractItemView.SelectRows)
         
+        # The columns are fixed, build the header chooser menu on first use and
+        # reuse it, only updating the checked state
+        self.header_menu = None
         def headerChooser(pos):
             logger.info("Header chooser for %s", pos)
             table = self.table_view
             model = table.model()
             
-            menu = QMenu()
-            for col in xrange(model.columnCount()):
-                header = model.headerData(col, Qt.Horizontal)
-                action = menu.addAction(header)
-                action.setData(col)
-                action.setCheckable(True)
-                action.setChecked(not table.isColumnHidden(col))
+            if (self.header_menu is None):
+                self.header_menu = QMenu(self)
+                for col in xrange(model.columnCount()):
+                    header = model.headerData(col, Qt.Horizontal)
+                    action = self.header_menu.addAction(header)
+                    action.setData(col)
+                    action.setCheckable(True)
+            menu = self.header_menu
+            for action in menu.actions():
+                action.setChecked(not table.isColumnHidden(action.data()))
             
             action = menu.exec_(table.viewport().mapToGlobal(pos))
             if (action is not None):
                 col = action.data()
                 if (table.isColumnHidden(col)):
                     table.showColumn(col)
+                    # Only the shown column needs sizing, the others keep
+                    # their width
+                    table.resizeColumnToContents(col)
                 else:
                     table.hideColumn(col)
-                table.resizeColumnsToContents()
                     
         # Note the column order and visibility already get automatically
         # restored with the headerview save and restoreState and saveState
@@ -6316,6 +8091,29 @@ class FilePane(QWidget):
         # the widgets are created
         self.setupActions()
 
+    def setupHeaderSections(self):
+        """
+        Make the Name column stretch, size the extension and size columns to
+        contents and the date and attribute columns to their fixed-length text
+        """
+        header = self.table_view.horizontalHeader()
+        header.setSectionResizeMode(1, QHeaderView.Stretch)
+        for i in xrange(2, 4):
+            header.setSectionResizeMode(i, QHeaderView.ResizeToContents)
+
+        # The date and attribute strings always have the same length, size them
+        # from a sample instead of letting ResizeToContents query the rows on
+        # every load. The margins match the ones QStyledItemDelegate and
+        # QTableView add to the text width
+        # XXX This doesn't track font or style changes
+        table = self.table_view
+        font_metrics = table.fontMetrics()
+        margin = 2 * (table.style().pixelMetric(QStyle.PM_FocusFrameHMargin, None, table) + 1) + (1 if table.showGrid() else 0)
+        for col, sample in [(4, "0000-00-00 00:00:00"), (5, "-r-h")]:
+            width = max(font_metrics.width(sample) + margin, header.sectionSizeHint(col))
+            header.setSectionResizeMode(col, QHeaderView.Fixed)
+            header.resizeSection(col, width)
+
     def setupModels(self):
         logger.info("")
 
@@ -6327,11 +8125,9 @@ class FilePane(QWidget):
 
         # Call setspan on rowsinserted/deleted to make directory sizes span
         # extension and size columns
-        # Rate-limit since it ignores the parameters for simplicity
-        self.model.rowsInserted.connect(self.rateLimitedMergeDirSizeExt)
-        self.model.rowsMoved.connect(self.rateLimitedMergeDirSizeExt)
-        self.model.rowsRemoved.connect(self.rateLimitedMergeDirSizeExt)
-        self.model.modelReset.connect(self.rateLimitedMergeDirSizeExt)
+        # Rate-limit since it ignores the parameters for simplicity, use the
+        # coalesced signal so row insertions in bulk call this once
+        self.model.rowsChanged.connect(self.rateLimitedMergeDirSizeExt)
         
         self.model.rowsInserted.connect(self.fetchMoreIfVisible)
 
@@ -6339,24 +8135,29 @@ class FilePane(QWidget):
         # inserting/removing rows or calculating directory sizes, rate-limit the
         # update
         self.selection_model.selectionChanged.connect(self.rateLimitedUpdateSummary)
-        self.model.rowsInserted.connect(self.rateLimitedUpdateSummary)
-        self.model.rowsRemoved.connect(self.rateLimitedUpdateSummary)
-        self.model.dataChanged.connect(self.rateLimitedUpdateSummary)
-        self.model.modelReset.connect(self.rateLimitedUpdateSummary)
+        self.model.contentsChanged.connect(self.rateLimitedUpdateSummary)
 
         self.model.modelReset.connect(self.updateDirectoryLabel)
 
-        # Set an item delegate to do proper row-aware focus 
-        self.table_view.setItemDelegate(CurrentRowHighlightDelegate(self.selection_model, self.table_view))
+        # Set an item delegate to do proper row-aware focus, reuse it when the
+        # models are swapped instead of leaking a delegate connected to the
+        # old selection model
+        delegate = self.table_view.itemDelegate()
+        if (isinstance(delegate, CurrentRowHighlightDelegate)):
+            delegate.setSelectionModel(self.selection_model)
+        else:
+            self.table_view.setItemDelegate(CurrentRowHighlightDelegate(self.selection_model, self.table_view))
 
     def mergeDirSizeExt(self):
         model = self.table_view.model()
-        self.table_view.clearSpans()
-        for row in xrange(model.rowCount()):
-            file_info = model.index(row, 0).data(Qt.UserRole)
+        table_view = self.table_view
+        table_view.clearSpans()
+        # Read the fileinfos directly instead of going through index() and
+        # data() for every directory row
+        for row, file_info in enumerate(itertools.islice(model.file_infos, model.rowCount())):
             if (fileinfo_is_dir(file_info)):
                 assert None is logger.debug("Merging %d", row)
-                self.table_view.setSpan(row, 2, 1, 2)
+                table_view.setSpan(row, 2, 1, 2)
             else:
                 # This assumes directories go first and there are no spans in
                 # files
@@ -6406,9 +8207,14 @@ class FilePane(QWidget):
                         logger.info("Too early, 0 rowheight")
                         break
 
-                    min_loaded_rows = round(view.viewport().height() * 1.0 / rowHeight) + 1
-                    # XXX Have a version of fetchMore that gets the number of
-                    #     rows as parameter instead of looping here
+                    min_loaded_rows = int(round(view.viewport().height() * 1.0 / rowHeight) + 1)
+                    # Insert all the missing rows in one go, this causes a
+                    # single rowsInserted instead of one per page
+                    if (self.model.rowCount() < min_loaded_rows):
+                        self.model.fetchMore(QModelIndex(), min_loaded_rows)
+                    # The view's model may be a proxy filtering rows out or the
+                    # rows may not have been read yet, fall back to fetching
+                    # page by page
                     while ((view.model().rowCount() < min_loaded_rows) and (view.model().canFetchMore(QModelIndex()))):
                         logger.info("Loading extra rows rowHeight %d min_loaded_rows %d rowCount %d ", 
                             rowHeight, min_loaded_rows, view.model().rowCount())
@@ -6482,12 +8288,13 @@ class FilePane(QWidget):
 
         self.setupModels()
 
-        # XXX Emitting a signal instead of calling the size/ext column spans,
-        #     summary and header label redraw prevents having to create the
-        #     widgets beforehand at __init__ time and replicating the calls the
-        #     signal handlers make, but has a UI delay when updating that is bad
-        #     UX?
-        self.model.modelReset.emit()
+        # Don't emit modelReset to refresh the above, that resets all the views
+        # connected to the model (including the other pane's when swapping)
+        # and recalculates everything connected to it. setModel already reset
+        # these views, call the handlers directly instead
+        self.mergeDirSizeExt()
+        self.updateDirectoryLabel()
+        self.rateLimitedUpdateSummary()
 
 
     def filterFiles(self):
@@ -6562,14 +8369,26 @@ class FilePane(QWidget):
         # sorting and the model is invalidated, restore
         # XXX This should hook into header.sectionClicked.connect(save_and_restore_hidden_columns)
         #     since the fix here won't fix it eg when clicking on column headers
-        hidden = [i for i in range(self.model.columnCount()) if self.table_view.isColumnHidden(i)]
+        # Don't use header saveState/restoreState, that would also restore the
+        # old sort indicator and section sizes
+        header = self.table_view.horizontalHeader()
+        hidden = [i for i in xrange(header.count()) if header.isSectionHidden(i)]
 
         self.table_view.sortByColumn(col, order)
 
+        # Only restore the columns that were actually forgotten, hiding a
+        # column emits header signals and relayouts the table even if the
+        # column is already hidden
         for i in hidden:
-            self.table_view.setColumnHidden(i, True)
+            if (not header.isSectionHidden(i)):
+                header.setSectionHidden(i, True)
 
-    def updateDirectoryLabel(self):
+    def updateDirectoryLabel(self, force_emit=False):
+        """
+        @param force_emit: emit directoryLabelChanged even if the text didn't
+               change, eg when the pane was moved to a different tab and the
+               new tab title needs to be set
+        """
         logger.info("")
         # XXX Move the focusin/focusout setstyle here too
         if (self.search_mode):
@@ -6595,7 +8414,10 @@ class FilePane(QWidget):
         # Don't emit None as it will crash silently
         # XXX file_dir is None at initialization because of the two step
         #     initialization performed when starting the app, fix?
-        self.directoryLabelChanged.emit(label_text or "")
+        label_text = label_text or ""
+        if (force_emit or (label_text != self.last_label_text)):
+            self.last_label_text = label_text
+            self.directoryLabelChanged.emit(label_text)
 
     def updateSummary(self):
         logger.info("Starting")
@@ -6604,92 +8426,40 @@ class FilePane(QWidget):
         if (self.file_dir is None):
             return
 
-        locale = QLocale()
+        # Getting the free space can take a long time on network drives, it's
+        # done in a thread, only refresh when the directory changed, otherwise
+        # it's periodically refreshed by disk_info_timer
+        if (self.disk_info_dir != self.file_dir):
+            self.refreshDiskInfo()
 
-        # XXX There's no QStorageInfo until 5.4 and and no shutil.disk_usage in
-        #     python 2.7
-        if (False):
-            info = QStorageInfo(self.file_dir)
-            self.disk_info_label.setText("%s %s k of %s k free" % (
-                info.displayName(),
-                locale.toString(info.bytesAvailable() / 2**10), 
-                locale.toString(info.bytesTotal() / 2**10))
-            )
-        else:
-            total_bytes = 0
-            free_bytes = 0
-            # Ignore for SHARE_ROOT, it's possible it confuses XP and takes a
-            # long time to return
-            # XXX Not clear, verify
-            if (os_path_contains(SHARE_ROOT, self.file_dir)):
-                drive = SHARE_ROOT
-            else:
-                drive = os.path.splitdrive(self.file_dir)[0]
-                unc = os.path.splitunc(self.file_dir)[0]
-                drive = unc if (drive == "") else (drive + "\\")
-                try:
-                    GetDiskFreeSpaceExW = ctypes.windll.kernel32.GetDiskFreeSpaceExW
-
-                    root_path = ctypes.c_wchar_p(drive)
-                    free_bytes_available = ctypes.c_ulonglong(0)
-                    total_number_of_bytes = ctypes.c_ulonglong(0)
-                    total_number_of_free_bytes = ctypes.c_ulonglong(0)
-
-                    # Call GetDiskFreeSpaceExW to get the disk space details
-                    logger.info("Calling GetDiskFreeSpaceExW")
-                    result = GetDiskFreeSpaceExW(
-                        root_path, 
-                        ctypes.byref(free_bytes_available),
-                        ctypes.byref(total_number_of_bytes),
-                        ctypes.byref(total_number_of_free_bytes)
-                    )
-                    logger.info("Called GetDiskFreeSpaceExW")
-                    total_bytes = total_number_of_bytes.value
-                    free_bytes = free_bytes_available.value
-                except Exception as e:
-                    logger.error("Error %s", e)
-                                                
-            self.disk_info_label.setText("%s %s k of %s k free" % (
-                drive,
-                locale.toString(free_bytes / 2**10),
-                locale.toString(total_bytes / 2**10)
-            ))
-
-        selected_size = 0
-        selected_files = 0
-        selected_dirs = 0
-        total_size = 0
-        total_files = 0 
-        total_dirs = 0 
-        
         logger.info("Calculating total and selected sizes")
-        for row in xrange(self.model.rowCount()):
-            index = self.model.index(row, 3)
-            file_info = index.data(Qt.UserRole)
-            size = file_info.size
-            is_selected = self.getActiveView().selectionModel().isSelected(index)
-            if (fileinfo_is_dir(file_info)):
-                selected_dirs += 1 if is_selected else 0
-                total_dirs += 1
-
-            else:
-                selected_files += 1 if is_selected else 0
-                total_files += 1
-            total_size += size
-            selected_size += size if is_selected else 0
+        # This is called on every selection change, go through the model's
+        # fileinfos directly instead of through indices and data(), and only
+        # visit the selected rows using the selection ranges instead of
+        # checking isSelected on every row
+        file_infos = self.model.file_infos
+        row_count = self.model.rowCount()
+        total_size, total_files, total_dirs = fileinfo_totals(file_infos[:row_count])
+
+        # The ranges don't overlap, but a row can be in several ranges when
+        # selected column by column, collect the unique rows
+        selected_rows = set()
+        for selection_range in self.getActiveView().selectionModel().selection():
+            selected_rows.update(xrange(selection_range.top(), min(selection_range.bottom() + 1, row_count)))
+        selected_size, selected_files, selected_dirs = fileinfo_totals(map(file_infos.__getitem__, selected_rows))
         logger.info("Calculated total and selected sizes")
 
         pending_indicator = "?" if (self.model.canFetchMore(QModelIndex())) else ""
         self.summary_label.setText("%s k / %s%s k in %s / %s%s files, %s / %s%s dirs" % (
             # XXX Show the selected size in smaller units?
-            locale.toString(selected_size / 2**10),
-            locale.toString(total_size / 2**10),
+            size_to_string(selected_size / 2**10),
+            size_to_string(total_size / 2**10),
             pending_indicator,
-            locale.toString(selected_files),
-            locale.toString(total_files),
+            size_to_string(selected_files),
+            size_to_string(total_files),
             pending_indicator,
-            locale.toString(selected_dirs),
-            locale.toString(total_dirs),
+            size_to_string(selected_dirs),
+            size_to_string(total_dirs),
             pending_indicator
         ))
         
@@ -6702,6 +8472,58 @@ class FilePane(QWidget):
 
         logger.info("Done")
 
+    def refreshDiskInfo(self):
+        """
+        Get the free space of the current directory's drive in a thread and
+        update the disk info label when done
+        """
+        # Ignore until a model has been loaded after app startup, and if the
+        # previous refresh is still running (it will be refreshed once it
+        # finishes if the directory changed). Panes in background tabs are not
+        # refreshed until shown, see showEvent
+        if ((self.file_dir is None) or (not self.isVisible()) or 
+            ((self.disk_info_thread is not None) and self.disk_info_thread.isRunning())):
+            return
+
+        logger.info("%r", self.file_dir)
+        disk_info_dir = self.file_dir
+        self.disk_info_dir = disk_info_dir
+        thread = CallableThread(os_get_disk_free_space, disk_info_dir)
+        def receive_disk_info():
+            # Ignore if a later refresh replaced this one
+            if (self.disk_info_thread is not thread):
+                return
+            self.disk_info_thread = None
+            if (self.file_dir != disk_info_dir):
+                # The directory changed while querying, the result may be for
+                # the wrong drive, query again
+                self.refreshDiskInfo()
+                return
+            try:
+                drive, free_bytes, total_bytes = thread.getResult()
+            except Exception as e:
+                logger.error("Error %s", e)
+                return
+            self.disk_info_label.setText("%s %s k of %s k free" % (
+                drive,
+                size_to_string(free_bytes / 2**10),
+                size_to_string(total_bytes / 2**10)
+            ))
+        thread.finished.connect(receive_disk_info)
+        self.disk_info_thread = thread
+        thread.start()
+
+    def showEvent(self, event):
+        # Only poll the free space of visible panes, panes in background tabs
+        # could be polling network drives nobody is looking at
+        self.disk_info_timer.start()
+        self.refreshDiskInfo()
+        super(FilePane, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self.disk_info_timer.stop()
+        super(FilePane, self).hideEvent(event)
+
     def rateLimitedUpdateSummary(self):
         qRateLimitCall(self.updateSummary, 500)
 
@@ -6920,43 +8742,48 @@ class FilePane(QWidget):
         # XXX Allow multi renaming 
         # XXX Switch tab with ctrl+1..9
         
-        self.addAction(self.copyFilepathsAct)
-        self.addAction(self.copyFilesAct)
-        self.addAction(self.cutFilesAct)
-        self.addAction(self.deleteFilesAct)
-        self.addAction(self.pasteFilesAct)
-        self.addAction(self.localsendFilesAct)
-        self.addAction(self.openDirAct)
-        self.addAction(self.networkDirAct)
-        self.addAction(self.reloadDirAct)
-        self.addAction(self.reloadAllAct)
-        self.addAction(self.parentDirAct)
-        self.addAction(self.childDirAct)
-        self.addAction(self.prevDirectoryAct)
-        self.addAction(self.nextDirectoryAct)
-        self.addAction(self.chooseDirectoryAct)
+        # Add all the actions in a single call instead of one by one
+        self.addActions([
+            self.copyFilepathsAct,
+            self.copyFilesAct,
+            self.cutFilesAct,
+            self.deleteFilesAct,
+            self.pasteFilesAct,
+            self.localsendFilesAct,
+            self.openDirAct,
+            self.networkDirAct,
+            self.reloadDirAct,
+            self.reloadAllAct,
+            self.parentDirAct,
+            self.childDirAct,
+            self.prevDirectoryAct,
+            self.nextDirectoryAct,
+            self.chooseDirectoryAct,
+            self.createDirAct,
+            self.renameFileAct,
+            self.increaseIconSizeAct,
+            self.decreaseIconSizeAct,
+            self.switchViewAct,
+            self.selectAndAdvanceAct,
+            self.invertSelectionAct,
+            self.selectFilesAct,
+            self.deselectFilesAct,
+            self.selectAllOrClearAct,
+            self.openInExternalViewerAct,
+            self.openInExternalEditorAct,
+            self.openInCmdLineAct,
+            self.toggleSearchModeAct,
+            self.sortByNameAct,
+            self.sortByDateAct,
+            self.sortBySizeAct,
+            self.filterAct,
+        ])
         # Only calculate directory sizes on the tableview, this also helps with
         # not highlighting when pressing space on the CheckableMenu
-        self.table_view.addAction(self.calculateSubdirSizesAct)
-        self.table_view.addAction(self.calculateAllSubdirsSizesAct)
-        self.addAction(self.createDirAct)
-        self.addAction(self.renameFileAct)
-        self.addAction(self.increaseIconSizeAct)
-        self.addAction(self.decreaseIconSizeAct)
-        self.addAction(self.switchViewAct)
-        self.addAction(self.selectAndAdvanceAct)
-        self.addAction(self.invertSelectionAct)
-        self.addAction(self.selectFilesAct)
-        self.addAction(self.deselectFilesAct)
-        self.addAction(self.selectAllOrClearAct)
-        self.addAction(self.openInExternalViewerAct)
-        self.addAction(self.openInExternalEditorAct)
-        self.addAction(self.openInCmdLineAct)
-        self.addAction(self.toggleSearchModeAct)
-        self.addAction(self.sortByNameAct)
-        self.addAction(self.sortByDateAct)
-        self.addAction(self.sortBySizeAct)
-        self.addAction(self.filterAct)
+        self.table_view.addActions([
+            self.calculateSubdirSizesAct,
+            self.calculateAllSubdirsSizesAct,
+        ])
 
     def setCurrentIndex(self, index):
         logger.info("%d,%d", index.row(), index.column())
@@ -6970,21 +8797,35 @@ class FilePane(QWidget):
         logger.info("%d, %d", index.row(), index.column())
         self.getActiveView().scrollTo(index)
 
+    def getFirstSelectableRow(self):
+        """
+        Return the first row that can be selected in bulk, skipping ".."
+        """
+        # Check the fileinfos directly instead of going through index() and
+        # data()
+        model = self.model
+        if ((model.rowCount() > 0) and (model.file_infos[0].filename == "..")):
+            return 1
+        return 0
+
     def selectAllOrClear(self):
         logger.info("")
         # Select all if there's no selection, otherwise clear
         # XXX How does this interact with incremental loading? What if not all
         #     the rows are loaded?
-        if (len(self.getActiveView().selectionModel().selectedRows()) != 0):
+        selection_model = self.getActiveView().selectionModel()
+        # Don't use selectedRows, that creates an index per selected row
+        if (selection_model.hasSelection()):
             self.getActiveView().clearSelection()
 
         else:
-            self.getActiveView().selectAll()
-            # Deselect ".."
-            index = self.model.index(0,0)
-            if (index.isValid() and (index.data(Qt.UserRole).filename == "..")):
-                selection_model = self.getActiveView().selectionModel()
-                selection_model.select(index, QItemSelectionModel.Deselect | QItemSelectionModel.Rows)
+            # Select all but "..", in a single selection instead of selecting
+            # all and then deselecting ".."
+            model = self.model
+            first_row = self.getFirstSelectableRow()
+            if (first_row < model.rowCount()):
+                selection = QItemSelection(model.index(first_row, 0), model.index(model.rowCount()-1, 0))
+                selection_model.select(selection, QItemSelectionModel.Select | QItemSelectionModel.Rows)
         
     def invertSelection(self):
         logger.info("")
@@ -6998,13 +8839,14 @@ class FilePane(QWidget):
         # This can be slow with many files due to the individual signals, use a
         # selection instead of going index by index
         # Table model has full row selection, so only go through rows
-        selection = QItemSelection(model.index(0,0), model.index(model.rowCount()-1, 0))
-        selection_model.select(selection, QItemSelectionModel.Toggle | QItemSelectionModel.Rows)
-        # Deselect ".."
-        index = self.model.index(0,0)
-        if (index.isValid() and (index.data(Qt.UserRole).filename == "..")):
-            selection_model = self.getActiveView().selectionModel()
-            selection_model.select(index, QItemSelectionModel.Deselect | QItemSelectionModel.Rows)
+        # Skip "..", so it doesn't need deselecting afterwards
+        first_row = self.getFirstSelectableRow()
+        if (first_row < model.rowCount()):
+            selection = QItemSelection(model.index(first_row, 0), model.index(model.rowCount()-1, 0))
+            selection_model.select(selection, QItemSelectionModel.Toggle | QItemSelectionModel.Rows)
+        # Deselect ".." in case it was selected
+        if ((first_row == 1) and selection_model.isRowSelected(0, QModelIndex())):
+            selection_model.select(model.index(0, 0), QItemSelectionModel.Deselect | QItemSelectionModel.Rows)
 
     def selectFiles(self, select):
         logger.info("")
@@ -7104,27 +8946,25 @@ class FilePane(QWidget):
         logger.info("")
         def cleanup_temp_file(temp_relpath, filepath):
             logger.info("%r %r", temp_relpath, filepath)
-            def remove_leaf(relpath):
-                # XXX What if two instances of the program, both
-                #     uncompressed the same file?
-                # relpath can be empty the first time if the file was
-                # already in the temp root
-                logger.info("%r", relpath)
-                if (relpath != ""):
-                    abspath = os.path.join(TEMP_DIR, relpath)
-                    logger.info("Removing dir %r %r", abspath, relpath)
-                    try:
-                        os.rmdir(abspath)
-                        relpath = os.path.dirname(relpath)
-                        remove_leaf(relpath)
-                    except Exception as e:
-                        # The directory was not empty, done
-                        logger.info("exception %r", e)
             logger.info("Removing %r", filepath)
             os.remove(filepath)
             # Can't use os.removedirs since the deletion needs to stop at
-            # TEMP_DIR
-            remove_leaf(os.path.dirname(temp_relpath))
+            # TEMP_DIR, remove the now empty parent dirs iteratively
+            # XXX What if two instances of the program, both uncompressed the
+            #     same file?
+            # relpath can be empty the first time if the file was already in
+            # the temp root
+            relpath = os.path.dirname(temp_relpath)
+            while (relpath != ""):
+                abspath = os.path.join(TEMP_DIR, relpath)
+                logger.info("Removing dir %r %r", abspath, relpath)
+                try:
+                    os.rmdir(abspath)
+                except OSError as e:
+                    # The directory was not empty, done
+                    logger.info("exception %r", e)
+                    break
+                relpath = os.path.dirname(relpath)
         
         file_info = self.getActiveView().currentIndex().data(Qt.UserRole)
         filename = file_info.filename
@@ -7262,29 +9102,38 @@ class FilePane(QWidget):
         logger.info("%d + %d", self.display_width, delta)
         new_width = max(64, self.display_width + delta)
         if (new_width != self.display_width):
-            if (use_delegate):
-                self.display_width = new_width
-                self.list_view.itemDelegate().setWidth(self.display_width)
-                self.list_view_style.setWidth(self.display_width)
-                
-            else:
-                # XXX Make this app or even listview local (or use the iconSize
-                #     straight), but data(Qt.DisplayRole) needs this too?
-                global DISPLAY_WIDTH
-                global DISPLAY_HEIGHT
-                DISPLAY_WIDTH, DISPLAY_HEIGHT = new_width, new_width
-                # XXX setIconSize is not necessary when setting QPixmaps instead
-                #     of QIcons
-                # XXX Looks like layoutChanged is already sent by setIconSize?
-                # self.list_view.setIconSize(QSize(DISPLAY_WIDTH, DISPLAY_HEIGHT))
-                
-                self.model.layoutChanged.emit()
-                
-            # update the page size and call canFetchmore to update loaded_rows
-            # and workaround Qt keyboard navigation flag
-            self.updatePageSize()
-            if (self.model.canFetchMore(QModelIndex())):
-               self.model.fetchMore(QModelIndex())
+            # Don't repaint the list until all the changes below are done
+            self.list_view.setUpdatesEnabled(False)
+            try:
+                if (use_delegate):
+                    self.display_width = new_width
+                    self.list_view.itemDelegate().setWidth(self.display_width)
+                    self.list_view_style.setWidth(self.display_width)
+                    
+                else:
+                    # XXX Make this app or even listview local (or use the iconSize
+                    #     straight), but data(Qt.DisplayRole) needs this too?
+                    global DISPLAY_WIDTH
+                    global DISPLAY_HEIGHT
+                    DISPLAY_WIDTH, DISPLAY_HEIGHT = new_width, new_width
+                    # XXX setIconSize is not necessary when setting QPixmaps instead
+                    #     of QIcons
+                    # XXX Looks like layoutChanged is already sent by setIconSize?
+                    # self.list_view.setIconSize(QSize(DISPLAY_WIDTH, DISPLAY_HEIGHT))
+                    
+                # update the page size and call canFetchmore to update loaded_rows
+                # and workaround Qt keyboard navigation flag
+                self.updatePageSize()
+                if (self.model.canFetchMore(QModelIndex())):
+                   self.model.fetchMore(QModelIndex())
+
+                if (not use_delegate):
+                    # Emit after fetchMore so the view is only relayed out once
+                    # with the new size and rows
+                    self.model.layoutChanged.emit()
+
+            finally:
+                self.list_view.setUpdatesEnabled(True)
 
     def createDirectory(self):
         logger.info("")
@@ -7313,16 +9162,13 @@ class FilePane(QWidget):
                     self.reloadDirectory()
 
                 else:
-                    # Sleep a bit for the directory to be created and the reload to
-                    # happen
+                    # Wait a bit for the watcher to notice the directory and the
+                    # row to be inserted, return as soon as it's there
                     
-                    # XXX Do it in a better way? But this is not like the full
-                    #     directory scan, could force a reload even if a watcher is
-                    #     set?
-                    logger.info("Sleeping to give time for reload to happen")
-                    time.sleep(0.01)
-                    logger.info("Processing signals")
-                    qApp.processEvents()
+                    # XXX This is not like the full directory scan, could force a
+                    #     reload even if a watcher is set?
+                    logger.info("Waiting for the reload to happen")
+                    qWaitForCondition(lambda : self.model.findFileInfoRow(text) != -1, [self.model.rowsInserted], 10)
 
                 row = self.model.findFileInfoRow(text)
                 if (row != -1):
@@ -7399,13 +9245,26 @@ class FilePane(QWidget):
     def chooseHistoryDirectory(self):
         logger.info("")
         menu = EditablePopupMenu(self.parent(), allow_check=False, allow_delete=True)
-        for i, history_entry in enumerate(reversed(self.dir_history)):
-            # XXX Skip duplicated entries?
-            # XXX Allow ctrl+ to goto in a new tab? Needs to move method to app
-            i = len(self.dir_history) - i - 1
-            action = menu.addAction(history_entry, i, True)
-            action.setCheckable(True)
-            action.setChecked(i == self.current_dir_history)
+        current_entry = self.dir_history[self.current_dir_history] if (len(self.dir_history) > 0) else None
+        # Skip duplicated entries, only showing the most recent one, and don't
+        # relayout the menu on every action added
+        # XXX Deleting an entry only deletes that occurrence, the older
+        #     duplicates will show up next time
+        seen_entries = set()
+        menu.setUpdatesEnabled(False)
+        try:
+            for i in xrange(len(self.dir_history) - 1, -1, -1):
+                history_entry = self.dir_history[i]
+                if (history_entry in seen_entries):
+                    continue
+                seen_entries.add(history_entry)
+                # XXX Allow ctrl+ to goto in a new tab? Needs to move method to app
+                action = menu.addAction(history_entry, i, True)
+                action.setCheckable(True)
+                if (history_entry == current_entry):
+                    action.setChecked(True)
+        finally:
+            menu.setUpdatesEnabled(True)
         menu.addSeparator()
         openAct = menu.addAction("Open...")
         clearAct = menu.addAction("Clear all")
@@ -7446,7 +9305,7 @@ class FilePane(QWidget):
         # XXX Move this to the model since it also needs something like this for
         #     calculating dir sizes, or if file_info.filename is guaranteed to
         #     be absolute then can have a fileinfo_is_browsable?
-        return (fileinfo_is_dir(file_info) or zipfile.is_zipfile(os.path.join(self.file_dir, file_info.filename)))
+        return (fileinfo_is_dir(file_info) or is_zipfile_cached(os.path.join(self.file_dir, file_info.filename), file_info.size, file_info.mtime))
 
     def gotoChildDirectory(self):
         """
@@ -7596,10 +9455,11 @@ class FilePane(QWidget):
         # indicator when the thread ends.
         self.model.directoryReader.finished.connect(self.rateLimitedUpdateSummary)
         #self.model.directoryReader.finished.connect(lambda : self.table_view.resizeColumnsToContents())
-        # Sleep a bit and then processEvents, this is a simple way of not
-        # flashing the messagebox if listing the directory takes little time
-        # XXX Find a better way
-        time.sleep(0.10)
+        # Process events for a bit before showing the messagebox, this avoids
+        # flashing the messagebox if listing the directory takes little time and
+        # returns as soon as the listing is done
+        directory_reader = self.model.directoryReader
+        qWaitForCondition(lambda : not directory_reader.isRunning(), [directory_reader.finished], 100)
         if (self.model.directoryReader.isRunning()):
             # Docs say exec result is opaque, even if it seems to match .result()
             res = msg_box.exec_()
@@ -7620,9 +9480,7 @@ class FilePane(QWidget):
         # XXX This should probably go through signals?
         # XXX This needs to be done as entries are received, otherwise it
         #     can happen too early on slow listings
-        self.table_view.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
-        for i in xrange(4):
-            self.table_view.horizontalHeader().setSectionResizeMode(i + 2, QHeaderView.ResizeToContents)
+        self.setupHeaderSections()
         
         # QTimer.singleShot(0, lambda : self.table_view.resizeColumnsToContents())
             
@@ -7659,9 +9517,8 @@ class FilePane(QWidget):
         index = self.createRootIndex()
         # If going up to the parent directory, focus on the children just left
         if (os_path_dirname(old_file_dir) == self.file_dir):
-            # Focus on the incoming dir, could fail if didn't sleep enough time
-            # to list this directory, or if it didn't sleep enough to increase
-            # loaded_rows 
+            # Focus on the incoming dir, could fail if the directory wasn't
+            # listed in time, or if loaded_rows wasn't increased in time
 
             # XXX Focusing on the incoming dir cannot be done with async dir
             #     listing, schedule a task to do it after a second? Do sync dir
@@ -7669,35 +9526,23 @@ class FilePane(QWidget):
             #     do something like sync dir listing for a second and if not
             #     completed then switch to async? Pump messages for a few secs so
             #     the signal is received and then try?
-            for _ in xrange(1):
-                logger.info("Sleeping before processEvents")
-                time.sleep(0.01)
-                qApp.processEvents()
-                logger.info("Woke up after processEvents")
-                # .index will fail if there wasn't enough time to fetch the
-                # given entry
-                try:
-                    
-                    row = self.model.findFileInfoRow(os_path_basename(old_file_dir))
-                    index = self.createRootIndex(row)
-                    logger.info("Created index %r row %d vs. row %d", index.data(Qt.DisplayRole), index.row(), row)
-                    # XXX This is failing to focus even if hasIndex is True, but
-                    #     if sleep for longer then it works. In both cases the
-                    #     reported number of iterations is 0. The index with
-                    #     shorter sleep is lower and the list smaller, probably
-                    #     because the list is partially loaded, but it's not
-                    #     clear why it would fail since all is done in the same
-                    #     thread so it cannot be that the list is loaded behind
-                    #     calculating the index and setting it as current and
-                    #     scrolling to below
-                    logger.info("valid %s has %s row %d rowcount %d", index.isValid(), self.model.hasIndex(index.row(), index.column()), index.row(), self.model.rowCount())
-                    if (self.model.hasIndex(index.row(), index.column())):
-                        logger.info("Focusing on incoming dir after %d iterations", _)
-                        break
-                except ValueError:
-                    # .index() failed, not yet in list or it's deeper in
-                    # hierarchy
-                    pass
+            incoming_filename = os_path_basename(old_file_dir)
+            def isIncomingDirLoaded():
+                row = self.model.findFileInfoRow(incoming_filename)
+                return ((row != -1) and self.model.hasIndex(row, 0))
+            # Wait for the entry to be inserted, return as soon as it's there
+            if (qWaitForCondition(isIncomingDirLoaded, [self.model.rowsInserted, self.model.directoryReader.finished], 10)):
+                logger.info("Focusing on incoming dir")
+            row = self.model.findFileInfoRow(incoming_filename)
+            index = self.createRootIndex(row)
+            logger.info("Created index %r row %d vs. row %d", index.data(Qt.DisplayRole), index.row(), row)
+            # XXX This used to fail to focus even if hasIndex is True, unless
+            #     sleeping for longer. The index with shorter sleep is lower and
+            #     the list smaller, probably because the list is partially
+            #     loaded, but it's not clear why it would fail since all is done
+            #     in the same thread so it cannot be that the list is loaded
+            #     behind calculating the index and setting it as current and
+            #     scrolling to below
             
         if (self.model.hasIndex(index.row(), index.column())):
             logger.info("Setting index %r", index.data(Qt.DisplayRole))
@@ -7832,6 +9677,27 @@ class FilePane(QWidget):
         # transfer across
         
         self.updatePageSize()
+        self.updateVisibleRows()
+
+    def updateVisibleRows(self):
+        """
+        Tell the model which rows are visible in the active view, so it can
+        cancel thumbnail requests for rows that were scrolled away
+        """
+        view = self.getActiveView()
+        rect = view.viewport().rect()
+        # The list view has spacing around the items, skip it so the top left
+        # corner hits the first item
+        if (isinstance(view, QListView)):
+            rect = rect.adjusted(view.spacing(), view.spacing(), -view.spacing(), -view.spacing())
+        first_index = view.indexAt(rect.topLeft())
+        if (not first_index.isValid()):
+            self.model.setVisibleRows(None, None)
+            return
+        last_index = view.indexAt(rect.bottomRight())
+        # The bottom right can be past the last item
+        last_row = last_index.row() if (last_index.isValid()) else (view.model().rowCount() - 1)
+        self.model.setVisibleRows(first_index.row(), last_row)
 
     def updatePageSize(self):
         """
@@ -7896,6 +9762,11 @@ class FilePane(QWidget):
         self.model.page_size = max(page_size, 2)
 
     def eventFilter(self, source, event):
+        # This is called for every event of the filtered widgets, filter out
+        # the ones not handled below with a single set lookup before doing any
+        # other work (including logging, EnumString is slow)
+        if (event.type() not in FILE_PANE_FILTERED_EVENTS):
+            return False
         logger.info("%r %s", source, EnumString(QEvent, event.type()))
         # Note focusIn / focusOut is not sent to the FilePane when the
         # FileTableView is focused, trap it with eventFilter
@@ -8922,12 +10793,12 @@ class TwinWindow(QMainWindow):
         self.left_panes[i_left] = right_pane
         self.left_tab.insertTab(i_left, right_pane, "")
         self.left_tab.setCurrentIndex(i_left)
-        right_pane.updateDirectoryLabel()
+        right_pane.updateDirectoryLabel(True)
 
         self.right_panes[i_right] = left_pane
         self.right_tab.insertTab(i_right, left_pane, "")
         self.right_tab.setCurrentIndex(i_right)
-        left_pane.updateDirectoryLabel()
+        left_pane.updateDirectoryLabel(True)
 
         target_pane.getActiveView().setFocus()
 
@@ -9592,6 +11463,14 @@ def main():
 
     restore_python_exceptions()
 
+    global g_turbojpeg
+    if (use_turbojpeg):
+        try:
+            g_turbojpeg = turbojpeg.TurboJPEG()
+        except Exception as e:
+            # The bindings can be installed without the libjpeg-turbo library
+            logger.warn("Unable to load libjpeg-turbo, falling back to PIL %r", e)
+
     app = QApplication(sys.argv)
 
     # Reduce the app font size